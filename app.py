@@ -1,28 +1,68 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
 from flask_cors import CORS
-from models.user_data import update_user_stats, get_user_stats, save_workout_progress,get_leaderboard
+from models.user_data import update_user_stats
+from models import write_behind
+from models.write_behind import get_user_stats, record_workout
 from utils.xp_calculator import calculate_xp_and_score
-from models.user_data import login_user, register_user
-
-import subprocess
-import os
-import traceback
+from models.user_data import login_user, register_user, load_level_curve, save_level_curve, ACTIVITY_WINDOW_DAYS
+from utils.detector_pool import get_pool, is_supported, parse_exercises, new_detector, detector_class
+from utils.job_runner import start_job_runner
+from models.jobs import create_job, get_job, update_queued_job_options, QUEUED, DONE, FAILED
+from utils.upload_stream import HashingFile, receive_stream, mark_complete, release_upload, remove_upload
+from utils import metrics
+from utils.log import get_logger
+
+from datetime import datetime
+import hashlib
 import json
-
-from models.user_data import normalize_all_users
+import math
+import os
+import threading
+import time
+import uuid
+
+from models.migrations import start_migration, get_migration, migration_status, MIGRATIONS, NORMALIZE_USERS
+from models.indexes import ensure_indexes_in_background
+from models import leaderboard as leaderboard_cache
+from models.progress_store import get_progress_store
 from werkzeug.exceptions import RequestEntityTooLarge 
 
+UPLOAD_DIR = "uploads"
+
+
+class UploadRequest(Request):
+    # Multipart file parts are written straight into the uploads directory
+    # (hashed on the way) instead of a spooled temp file that /upload copies.
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        part = HashingFile(os.path.join(UPLOAD_DIR, f"incoming-{uuid.uuid4().hex}.part"), self.max_content_length)
+        self._upload_parts = getattr(self, '_upload_parts', []) + [part]
+        return part
+
+    def close(self):
+        super().close()
+        # Parts no route claimed (validation errors, extra fields) are dropped
+        for part in getattr(self, '_upload_parts', []):
+            if not part.moved and os.path.exists(part.name):
+                os.remove(part.name)
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
 CORS(app, supports_credentials=True, origins=["http://localhost:3000"])
+# Route latency histograms, sampled request traces and /metrics
+metrics.install(app)
 
 
 @app.errorhandler(RequestEntityTooLarge)
 def handle_large_file(e):
     return jsonify({'success': False, 'message': 'File too large'}), 413
 
-# In-memory user progress store (replace with DB in production)
-user_progress = {}
+# Today's progress per user, shared across workers (models/progress_store.py)
+progress_store = get_progress_store()
+
+log = get_logger("app")
 
 @app.route('/')
 def index():
@@ -32,7 +72,7 @@ def index():
 @app.route("/user/setup", methods=["POST"])
 def setup_user_profile():
     data = request.get_json()
-    print("Incoming data:", data) 
+    log.debug("Profile setup for %s", data.get("user_id"))
     user_id = data.get("user_id")  # This should come from login/registration flow
 
     profile = {
@@ -71,114 +111,400 @@ def save_frontend_data():
     if not user_id:
         return jsonify({'success': False, 'message': 'Missing user_id'}), 400
 
-    # Save workout progress (frontend detection data)
-    save_workout_progress(user_id, exercise, level, score, xp, completed, reps)
+    # Save workout progress (frontend detection data) and update cumulative
+    # stats in one round-trip
+    record_workout(user_id, exercise, level, score, xp, completed, reps)
 
-    # Update cumulative stats based on frontend data
-    update_user_stats(user_id, score=score, xp=xp, completed=completed, reps=reps)
-
-    # Update in-memory progress for quick access
-    progress = user_progress.get(user_id, {"total_xp": 0, "completed_exercises": 0})
-    progress["total_xp"] += xp
-    if completed:
-        progress["completed_exercises"] += 1
-    user_progress[user_id] = progress
+    # Update today's progress for quick access
+    progress_store.add(user_id, xp=xp, completed=completed)
 
     return jsonify({'success': True, 'message': 'Frontend detection data saved successfully'})
 
+def run_upload_job(job):
+    # Executed by the background job runner, never on a request thread
+    exercises = parse_exercises(job["exercise"])
+    user_id = job["user_id"]
+    video_path = job["video_path"]
+
+    try:
+        # Runs on a preloaded detector worker instead of a fresh interpreter
+        parsed_output = get_pool().run(exercises if len(exercises) > 1 else exercises[0], video_path, job["options"])
+    finally:
+        if job["options"].get("streaming"):
+            # The upload may still be arriving; the uploader removes it then
+            release_upload(video_path)
+        else:
+            remove_upload(video_path)
+
+    if "error" in parsed_output:
+        raise RuntimeError(parsed_output["error"])
+
+    # Fetch user weight for calorie calculation
+    user_stats = get_user_stats(user_id)
+    user_weight_kg = user_stats.get("weight") or 70  # fallback weight if none
+
+    # A job the runner retries (its process died) may have logged its workouts
+    # already: keyed by job and exercise, they are only logged once
+    if len(exercises) == 1:
+        return score_exercise(user_id, exercises[0], parsed_output, user_weight_kg,
+                              workout_id=f"{job['id']}:{exercises[0]}")
+
+    # Circuit upload: each exercise is scored and logged on its own
+    results = {
+        ex_type: score_exercise(user_id, ex_type, parsed_output["exercises"][ex_type], user_weight_kg,
+                                workout_id=f"{job['id']}:{ex_type}")
+        for ex_type in exercises
+    }
+    return {'success': True, 'exercises': results}
+
+
+def score_exercise(user_id, ex_type, parsed_output, user_weight_kg, workout_id=None):
+    # Video time the detector analysed, from container timestamps, so calories
+    # don't depend on which host or sampling rate scored the clip
+    exercise_duration_sec = parsed_output.get("duration_sec", 0)
+
+    # Same schema for every exercise (BaseDetector.summarize); plank counts
+    # seconds held, kept fractional so short holds still score
+    count = parsed_output.get("count", 0)
+    reps = count if parsed_output.get("unit") == "seconds" else int(count)
+    accuracy = parsed_output.get("accuracy", 0)
+
+    # Calculate score, xp, calories
+    score_data = calculate_xp_and_score(
+        reps,
+        exercise_duration_sec=exercise_duration_sec,
+        user_weight_kg=user_weight_kg,
+        exercise_type=ex_type,
+        accuracy=accuracy,
+    )
+
+    # A workout_progress row like /workout/log writes, plus how each rep went.
+    # Uploads aren't tied to a level.
+    recorded = record_workout(
+        user_id,
+        ex_type,
+        None,
+        score=score_data.get("score", 0),
+        xp=score_data.get("xp", 0),
+        completed=score_data.get("completed", False),
+        reps=score_data.get("reps", 0),
+        calories=score_data.get("calories", 0),
+        timeline=parsed_output.get("timeline"),
+        form_score=parsed_output.get("form_score"),
+        accuracy=score_data.get("accuracy", 0),
+        workout_id=workout_id,
+    )
+
+    # Update today's progress, unless this workout_id was logged before
+    if recorded:
+        progress_store.add(user_id, xp=score_data.get("xp", 0), completed=score_data.get("completed", False))
+
+    result = {
+        'success': True,
+        'reps': reps,
+        'score': score_data
+    }
+    # When in the video each rep (or plank hold) happened, and how well
+    for key in ('rep_times', 'hold_intervals', 'timeline', 'form_score', 'duration_sec', 'quality'):
+        if parsed_output.get(key):
+            result[key] = parsed_output[key]
+    return result
+
+
+def timed_upload_job(job):
+    # Queue wait and processing time per job; sampled jobs print a trace like requests do
+    if not metrics.ENABLED:
+        return run_upload_job(job)
+    metrics.observe(metrics.JOB_QUEUE_WAIT_SECONDS, max(0.0, job["started_at"] - job["created_at"]))
+    metrics.start_trace(f"job {job['exercise']} {job['id']}")
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        result = run_upload_job(job)
+        outcome = "ok"
+        return result
+    finally:
+        metrics.observe(metrics.JOB_SECONDS, time.perf_counter() - start, outcome=outcome)
+        metrics.end_trace(outcome=outcome)
+
+
+if os.getenv("JOB_RUNNER_ENABLED", "1") == "1":
+    start_job_runner(timed_upload_job)
+
+if write_behind.ENABLED:
+    write_behind.workout_log.ensure_started()
+
+# Idempotent; also available as `python -m models.indexes ensure`. On a
+# background thread, so workers boot (and serve) while Mongo is unreachable
+if os.getenv("MONGO_ENSURE_INDEXES", "1") == "1":
+    ensure_indexes_in_background()
+
+# Level curve changes saved through /admin/level-curve by any process
+LEVEL_CURVE_RELOAD_SEC = float(os.getenv("LEVEL_CURVE_RELOAD_SEC", "60"))
+
+
+def _reload_level_curve():
+    while True:
+        try:
+            load_level_curve()
+        except Exception as e:
+            log.warning("Could not load the level curve: %s", e)
+        time.sleep(LEVEL_CURVE_RELOAD_SEC)
+
+
+threading.Thread(target=_reload_level_curve, name="level-curve", daemon=True).start()
+
+
+def parse_analysis_options(form, exercises=None):
+    # Optional per-upload detector options: frame sampling (target_fps, max_side,
+    # roi as "x,y,w,h" fractions), the threaded decode/inference pipeline and
+    # chunked multi-process analysis (parallel = number of processes)
+    options = {}
+    if form.get('target_fps'):
+        options['target_fps'] = float(form['target_fps'])
+        if options['target_fps'] <= 0:
+            raise ValueError('target_fps must be positive')
+    if form.get('max_side'):
+        options['max_side'] = int(form['max_side'])
+        if options['max_side'] < 64:
+            raise ValueError('max_side must be at least 64')
+    if form.get('roi'):
+        roi = [float(v) for v in form['roi'].split(',')]
+        if len(roi) != 4 or min(roi) < 0 or roi[2] <= 0 or roi[3] <= 0 \
+                or roi[0] + roi[2] > 1 or roi[1] + roi[3] > 1:
+            raise ValueError('roi must be x,y,w,h fractions inside the frame')
+        options['roi'] = roi
+    if form.get('pipelined', '').lower() in ('1', 'true', 'yes'):
+        options['pipelined'] = True
+    if form.get('parallel'):
+        options['parallel'] = int(form['parallel'])
+        if options['parallel'] < 1:
+            raise ValueError('parallel must be at least 1')
+    # Rule thresholds, e.g. {"upward_threshold": 12} for jump or {"min_angle": 150} for plank
+    if form.get('params'):
+        params = json.loads(form['params'])
+        if not isinstance(params, dict):
+            raise ValueError('params must be a JSON object')
+        # Several exercises: {"jump": {"upward_threshold": 12}, "plank": {...}}
+        if exercises and len(exercises) > 1:
+            if not all(ex in exercises and isinstance(value, dict) for ex, value in params.items()):
+                raise ValueError('params must map each exercise type to its parameters')
+            params = {ex: parse_detector_params(ex, value) for ex, value in params.items()}
+        elif exercises:
+            params = parse_detector_params(exercises[0], params)
+        options['params'] = params
+    return options
+
+
+def parse_detector_params(ex_type, params):
+    # Checked against the detector's tunable_params here, so a bad threshold is
+    # a 400 now instead of a job that fails later in the worker
+    allowed = detector_class(ex_type).tunable_params
+    parsed = {}
+    for name, value in params.items():
+        if name not in allowed:
+            raise ValueError(f'Unknown parameter for {ex_type}: {name}')
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f'{ex_type} parameter {name} must be a number')
+        try:
+            parsed[name] = float(value)
+        except ValueError:
+            raise ValueError(f'{ex_type} parameter {name} must be a number')
+        if not math.isfinite(parsed[name]):
+            raise ValueError(f'{ex_type} parameter {name} must be a number')
+    return parsed
+
+
+def save_upload(video, video_path, chunk_size=1024 * 1024):
+    # Copy in chunks and hash on the way, so repeat uploads hit the landmark cache
+    digest = hashlib.sha256()
+    with open(video_path, 'wb') as f:
+        for chunk in iter(lambda: video.stream.read(chunk_size), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
 # Renamed original /start route to /upload
 @app.route('/upload', methods=['POST'])
 def upload_and_process():
-    ex_type = request.form.get('exercise')
+    # exercise is one type, or a comma-separated list ("pushup,squat") to score
+    # a circuit from one pose-inference pass; params are then keyed by type
+    exercises = parse_exercises(request.form.get('exercise'))
     user_id = request.form.get('user_id') or "1"  # fallback for now
     video = request.files.get('video')
     
 
-    if not ex_type or not user_id or not video:
+    if not exercises or not user_id or not video:
         return jsonify({'success': False, 'message': 'Missing workout type, user_id, or video'}), 400
 
-    video_path = f"uploads/{user_id}_{ex_type}.mp4"
-    os.makedirs("uploads", exist_ok=True)
-    video.save(video_path)
+    if not all(is_supported(ex) for ex in exercises):
+        return jsonify({'success': False, 'message': 'Invalid workout type'}), 400
+    ex_type = ",".join(exercises)
+
+    try:
+        options = parse_analysis_options(request.form, exercises)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    # One file per upload, so queued jobs never overwrite each other's video
+    video_path = f"{UPLOAD_DIR}/{user_id}_{'-'.join(exercises)}_{uuid.uuid4().hex}.mp4"
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    if isinstance(video.stream, HashingFile):
+        # Already on disk and hashed while the request was parsed
+        options['content_hash'] = video.stream.hexdigest()
+        video.stream.move_to(video_path)
+    else:
+        options['content_hash'] = save_upload(video, video_path)
+
+    try:
+        job_id = create_job(user_id, ex_type, video_path, options)
+    except Exception as e:
+        os.remove(video_path)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    return jsonify({'success': True, 'job_id': job_id, 'status': QUEUED}), 202
 
-    # Manually set video duration (fallback)
-    exercise_duration_sec = 10  # set manually if moviepy not used
 
-    script_path = f"detectors/{ex_type}_detector.py"
-    if not os.path.exists(script_path):
+@app.route('/upload/stream', methods=['POST', 'PUT'])
+def upload_stream():
+    # Raw video body with exercise, user_id and analysis options in the query
+    # string. The job is queued before the body is read, so analysis starts on
+    # the first chunks instead of after the last one.
+    exercises = parse_exercises(request.args.get('exercise'))
+    user_id = request.args.get('user_id') or "1"  # fallback for now
+
+    if not exercises or not user_id:
+        return jsonify({'success': False, 'message': 'Missing workout type or user_id'}), 400
+
+    if not all(is_supported(ex) for ex in exercises):
         return jsonify({'success': False, 'message': 'Invalid workout type'}), 400
+    ex_type = ",".join(exercises)
 
     try:
-        result = subprocess.run(
-            ['python', script_path, '--video', video_path],
-            capture_output=True,
-            text=True
-        )
+        options = parse_analysis_options(request.args, exercises)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
 
-        output = result.stdout.strip()
-        error = result.stderr.strip()
+    max_bytes = app.config['MAX_CONTENT_LENGTH']
+    if request.content_length is not None and request.content_length > max_bytes:
+        return jsonify({'success': False, 'message': 'File too large'}), 413
 
-        if result.returncode != 0:
-            return jsonify({'success': False, 'error': error}), 500
+    video_path = f"{UPLOAD_DIR}/{user_id}_{'-'.join(exercises)}_{uuid.uuid4().hex}.mp4"
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    open(video_path, 'wb').close()
+    options['streaming'] = True
+    options['expected_size'] = request.content_length
 
-        # Parse detector output JSON
-        try:
-            parsed_output = json.loads(output)
-            if ex_type == "jump":
-                 reps = int(parsed_output.get("jump_count", 0))
-            elif ex_type == "squat":
-                reps = int(parsed_output.get("squat_count", 0))
-            elif ex_type == "pushup":
-                reps = int(parsed_output.get("pushup_count", 0))
-            elif ex_type == "plank":
-                reps = int(parsed_output.get("plank_duration", 0))  # or another metric
-            else:
-                reps = 0
-
-            accuracy = parsed_output.get("accuracy", 0)# or generalize key for other exercises
-        except json.JSONDecodeError:
-            return jsonify({'success': False, 'error': 'Invalid output format from detector script'}), 500
-
-        # Fetch user weight for calorie calculation
-        user_stats = get_user_stats(user_id)
-        user_weight_kg = user_stats.get("weight") or 70  # fallback weight if none
-
-        # Calculate score, xp, calories
-        score_data = calculate_xp_and_score(
-            reps,
-            exercise_duration_sec=exercise_duration_sec,
-            user_weight_kg=user_weight_kg,
-            exercise_type=ex_type,
-            accuracy=accuracy,
-        )
+    try:
+        job_id = create_job(user_id, ex_type, video_path, options)
+    except Exception as e:
+        os.remove(video_path)
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        update_user_stats(
-            user_id=user_id,
-            score=score_data.get("score", 0),
-            xp=score_data.get("xp", 0),
-            completed=score_data.get("completed", False),
-            reps=score_data.get("reps", 0),
-            calories=score_data.get("calories", 0),
-            accuracy=score_data.get("accuracy", 0)
+    try:
+        sha256, size = receive_stream(request.stream, video_path, max_bytes)
+    except RequestEntityTooLarge:
+        mark_complete(video_path, ok=False)
+        return jsonify({'success': False, 'job_id': job_id, 'message': 'File too large'}), 413
+    except Exception as e:
+        mark_complete(video_path, ok=False)
+        return jsonify({'success': False, 'job_id': job_id, 'error': str(e)}), 500
+    mark_complete(video_path, ok=True, sha256=sha256, size=size)
+
+    # Not picked up yet: let it use the landmark cache like a regular upload
+    update_queued_job_options(job_id, content_hash=sha256)
+
+    return jsonify({'success': True, 'job_id': job_id, 'status': QUEUED}), 202
+
+
+def parse_landmark_options(args, ex_type):
+    # Frame geometry for landmarks estimated on the client
+    fps = float(args.get('fps', 30))
+    frame_width = int(args.get('frame_width', 0))
+    frame_height = int(args.get('frame_height', 0))
+    if fps <= 0:
+        raise ValueError('fps must be positive')
+    # Jump thresholds are in pixels of the original frame
+    if 'jump' in parse_exercises(ex_type) and frame_height <= 0:
+        raise ValueError('frame_height is required for jump')
+    return fps, frame_width, frame_height
+
+
+@app.route('/upload/landmarks', methods=['POST'])
+def upload_landmarks():
+    # Landmarks estimated on the client instead of a video: the body is packed
+    # little-endian float16 (frames, 33, 3) x, y, z (columns=4 adds
+    # visibility; an all-NaN frame has no pose), frame i at i / fps. Only the
+    # detectors' rules run here, so the workout is scored in the request.
+    exercises = parse_exercises(request.args.get('exercise'))
+    user_id = request.args.get('user_id') or "1"  # fallback for now
+
+    if not exercises or not user_id:
+        return jsonify({'success': False, 'message': 'Missing workout type or user_id'}), 400
+
+    if not all(is_supported(ex) for ex in exercises):
+        return jsonify({'success': False, 'message': 'Invalid workout type'}), 400
+
+    # Imported here: only landmark scoring needs the detector code in the web process
+    from detectors.base import LandmarkSequence
+    try:
+        fps, frame_width, frame_height = parse_landmark_options(request.args, ",".join(exercises))
+        params = parse_analysis_options(request.args, exercises).get('params', {})
+        seq = LandmarkSequence.from_packed(
+            request.get_data(), fps, frame_width, frame_height, int(request.args.get('columns', 3)),
         )
+        detectors = {}
+        for ex_type in exercises:
+            # Rules only: the Pose graph is never built
+            detectors[ex_type] = new_detector(ex_type)
+            detectors[ex_type].configure(**(params.get(ex_type, {}) if len(exercises) > 1 else params))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    user_weight_kg = get_user_stats(user_id).get("weight") or 70
+    results = {
+        ex_type: score_exercise(user_id, ex_type, detector.analyze(seq), user_weight_kg)
+        for ex_type, detector in detectors.items()
+    }
+    if len(exercises) == 1:
+        return jsonify(results[exercises[0]])
+    return jsonify({'success': True, 'exercises': results})
+
+
+def _job_status(job):
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'exercise': job['exercise'],
+        'user_id': job['user_id'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'error': job['error'],
+    }
 
-        # Update in-memory progress
-        progress = user_progress.get(user_id, {"total_xp": 0, "completed_exercises": 0})
-        progress["total_xp"] += score_data.get("xp", 0)
-        if score_data.get("completed"):
-            progress["completed_exercises"] += 1
-        user_progress[user_id] = progress
 
-        return jsonify({
-            'success': True,
-            'reps': reps,
-            'score': score_data
-        })
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, **_job_status(job)})
 
-    except Exception as e:
-        tb = traceback.format_exc()
-        print("Error in /upload:", tb)
-        return jsonify({'success': False, 'error': str(e), 'traceback': tb}), 500
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+
+    if job['status'] == DONE:
+        return jsonify(job['result'])
+    if job['status'] == FAILED:
+        return jsonify({'success': False, 'status': FAILED, 'error': job['error']}), 500
+    # Still queued or running
+    return jsonify({'success': False, 'status': job['status'], 'job_id': job['id']}), 202
 
     
 @app.route("/workout/unlock-level", methods=["POST"])
@@ -217,8 +543,18 @@ def get_stats():
     if not user_id:
         return jsonify({'error': 'Missing user_id'}), 400
 
+    # Activity history is paged by day: ?days=N (latest N active days) and
+    # ?before=YYYY-MM-DD (activities_next_before from the previous page)
+    try:
+        days = int(request.args.get('days', ACTIVITY_WINDOW_DAYS))
+        before = request.args.get('before')
+        if before:
+            datetime.strptime(before, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'days must be an integer and before a YYYY-MM-DD date'}), 400
+
     # Remove int() conversion if user_id is an email
-    stats = get_user_stats(user_id=user_id)
+    stats = get_user_stats(user_id=user_id, days=days, before=before)
     return jsonify(stats)
 
 
@@ -232,7 +568,7 @@ def get_today_progress():
     if not user_id:
         return jsonify({"error": "Missing user_id"}), 400
 
-    progress = user_progress.get(user_id, {"total_xp": 0, "completed_exercises": 0})
+    progress = progress_store.get(user_id)
 
     return jsonify({
         "user_id": user_id,
@@ -260,18 +596,15 @@ def log_workout():
         if not all([user_id, exercise, level]):
             return jsonify({"error": "Missing required fields"}), 400
 
-        print(f"[Workout Log] user: {user_id}, exercise: {exercise}, level: {level}")
-
-        # Save workout progress
-        save_workout_progress(user_id, exercise, level, score, xp, completed, reps, calories)
+        log.debug("Workout log: user %s, exercise %s, level %s", user_id, exercise, level)
 
-        # Update cumulative stats
-        update_user_stats(user_id, score=score, xp=xp, completed=completed, reps=reps, calories=float(calories))
+        # Save workout progress and update cumulative stats in one round-trip
+        record_workout(user_id, exercise, level, score, xp, completed, reps, calories)
 
         return jsonify({"message": "Workout logged successfully"}), 200
 
     except Exception as e:
-        print("[Workout Log ERROR]:", str(e))
+        log.exception("Workout log failed")
         return jsonify({"error": "Internal Server Error", "details": str(e)}), 500
 
 
@@ -304,20 +637,71 @@ def login():
 @app.route("/leaderboard", methods=["GET"])
 def leaderboard():
     sort_by = request.args.get("sort_by", "total_xp")  # now matches field name
+    user_id = request.args.get("user_id")
     try:
-        leaderboard_data = get_leaderboard(sort_by=sort_by)
-        return jsonify({"success": True, "leaderboard": leaderboard_data})
+        limit = min(max(int(request.args.get("limit", 10)), 1), leaderboard_cache.LEADERBOARD_SIZE)
+        # Served from the in-memory leaderboard, not an aggregation per hit
+        body = {"success": True, "leaderboard": leaderboard_cache.board.top(sort_by, limit)}
+        if user_id:
+            body["me"] = leaderboard_cache.board.rank(sort_by, user_id)
+        response = jsonify(body)
+        # Clients polling with If-None-Match get a 304 until the ranking changes
+        response.add_etag()
+        return response.make_conditional(request)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
-@app.route('/admin/normalize', methods=['POST'])
-def normalize_user_data():
+@app.route('/admin/migrations/<name>', methods=['POST'])
+def start_data_migration(name):
+    # Runs in the background in batches; poll the returned job for progress
+    if name not in MIGRATIONS:
+        return jsonify({"success": False, "message": "Unknown migration"}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        batch_size = int(data['batch_size']) if data.get('batch_size') else None
+        state = start_migration(name, batch_size=batch_size, restart=bool(data.get('restart')))
+        return jsonify({"success": True, **migration_status(state)}), 202
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route('/admin/migrations/<name>/<job_id>', methods=['GET'])
+def data_migration_status(name, job_id):
+    state = get_migration(name)
+    if not state or state['run_id'] != job_id:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, **migration_status(state)})
+
+
+@app.route('/admin/level-curve', methods=['GET', 'POST'])
+def level_curve():
+    # POST {"max_level", "xp_base", "xp_exponent", "score_step"} (any subset)
+    # saves the curve and reruns the normalize migration from the start so
+    # stored levels follow. Other processes pick the curve up within
+    # LEVEL_CURVE_RELOAD_SEC.
     try:
-        normalize_all_users()
-        return jsonify({"success": True, "message": "User data normalized"})
+        if request.method == 'GET':
+            return jsonify({"success": True, "curve": load_level_curve()._asdict()})
+        curve = save_level_curve(**(request.get_json(silent=True) or {}))
+        state = start_migration(NORMALIZE_USERS, restart=True)
+        return jsonify({"success": True, "curve": curve._asdict(), "normalize": migration_status(state)}), 202
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route('/admin/normalize', methods=['POST'])
+def normalize_user_data():
+    return start_data_migration(NORMALIZE_USERS)
+
+
+@app.route('/admin/normalize/<job_id>', methods=['GET'])
+def normalize_status(job_id):
+    return data_migration_status(NORMALIZE_USERS, job_id)
     
 
 if __name__ == '__main__':
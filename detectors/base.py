@@ -0,0 +1,545 @@
+import cv2
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detectors import landmark_cache
+from detectors.frame_source import FrameSampler
+from detectors.pipeline import FramePipeline
+from detectors.stream_source import GrowingFile, open_capture
+from utils.log import get_logger
+from utils.posture_utils import joint_angles
+
+# Suppress TensorFlow and MediaPipe logs
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+NUM_LANDMARKS = 33
+
+log = get_logger("detectors")
+
+# mediapipe PoseLandmark indices used by the exercise rules
+LEFT_SHOULDER, RIGHT_SHOULDER = 11, 12
+LEFT_ELBOW, RIGHT_ELBOW = 13, 14
+LEFT_WRIST, RIGHT_WRIST = 15, 16
+LEFT_HIP, RIGHT_HIP = 23, 24
+LEFT_KNEE, RIGHT_KNEE = 25, 26
+LEFT_ANKLE, RIGHT_ANKLE = 27, 28
+
+
+class LandmarkSequence:
+    """Pose landmarks of a whole video in one preallocated array.
+
+    landmarks: (frames, 33, 4) float32 of x, y, z, visibility in full-frame
+        normalized coordinates. Rows of frames without a pose are zero.
+    valid: (frames,) bool, True where a pose was found.
+    timestamps: (frames,) float64 video time in seconds, from the container.
+    """
+
+    def __init__(self, capacity=0, fps=30.0, frame_width=0, frame_height=0):
+        capacity = max(int(capacity), 1)
+        self._landmarks = np.zeros((capacity, NUM_LANDMARKS, 4), dtype=np.float32)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self.length = 0
+        self.fps = fps
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def duration_sec(self):
+        # Video time the frames cover, the last one lasting a frame interval
+        if not self.length:
+            return 0.0
+        return float(self.timestamps[-1] - self.timestamps[0]) + 1 / self.fps
+
+    @classmethod
+    def from_arrays(cls, landmarks, valid, timestamps, fps=30.0, frame_width=0, frame_height=0):
+        seq = cls(len(valid), fps, frame_width, frame_height)
+        seq.length = len(valid)
+        seq._landmarks[:seq.length] = landmarks
+        seq._valid[:seq.length] = valid
+        seq._timestamps[:seq.length] = timestamps
+        return seq
+
+    @classmethod
+    def concatenate(cls, sequences):
+        first = sequences[0]
+        return cls.from_arrays(
+            np.concatenate([seq.landmarks for seq in sequences]),
+            np.concatenate([seq.valid for seq in sequences]),
+            np.concatenate([seq.timestamps for seq in sequences]),
+            first.fps, first.frame_width, first.frame_height,
+        )
+
+    @classmethod
+    def from_packed(cls, data, fps=30.0, frame_width=0, frame_height=0, columns=3):
+        """Sequence from client-estimated landmarks packed as little-endian float16.
+
+        data is (frames, 33, columns) of x, y, z[, visibility] with frame i at
+        i / fps. A frame without a pose is all NaN.
+        """
+        if columns not in (3, 4):
+            raise ValueError("columns must be 3 (x, y, z) or 4 (x, y, z, visibility)")
+        frame_size = NUM_LANDMARKS * columns * 2
+        if not data or len(data) % frame_size:
+            raise ValueError(f"Expected a whole number of frames of {NUM_LANDMARKS}x{columns} float16")
+        packed = np.frombuffer(data, dtype="<f2").reshape(-1, NUM_LANDMARKS, columns)
+        valid = ~np.isnan(packed).any(axis=(1, 2))
+
+        seq = cls(len(packed), fps, frame_width, frame_height)
+        seq.length = len(packed)
+        seq._landmarks[:seq.length, :, :columns] = np.where(valid[:, None, None], packed, 0)
+        if columns == 3:
+            seq._landmarks[:seq.length, :, 3] = valid[:, None]
+        seq._valid[:seq.length] = valid
+        seq._timestamps[:seq.length] = np.arange(seq.length) / fps
+        return seq
+
+    def to_arrays(self):
+        return {
+            "landmarks": self.landmarks,
+            "valid": self.valid,
+            "timestamps": self.timestamps,
+            "meta": np.array([self.fps, self.frame_width, self.frame_height], dtype=np.float64),
+        }
+
+    @classmethod
+    def from_saved(cls, arrays):
+        fps, frame_width, frame_height = arrays["meta"].tolist()
+        return cls.from_arrays(
+            arrays["landmarks"], arrays["valid"], arrays["timestamps"], fps, int(frame_width), int(frame_height),
+        )
+
+    def slice(self, start, stop=None):
+        return LandmarkSequence.from_arrays(
+            self.landmarks[start:stop], self.valid[start:stop], self.timestamps[start:stop],
+            self.fps, self.frame_width, self.frame_height,
+        )
+
+    @property
+    def landmarks(self):
+        return self._landmarks[:self.length]
+
+    @property
+    def valid(self):
+        return self._valid[:self.length]
+
+    @property
+    def timestamps(self):
+        return self._timestamps[:self.length]
+
+    def _grow(self):
+        capacity = len(self._valid) * 2
+        self._landmarks = np.resize(self._landmarks, (capacity, NUM_LANDMARKS, 4))
+        self._valid = np.resize(self._valid, capacity)
+        self._timestamps = np.resize(self._timestamps, capacity)
+
+    def append(self, timestamp, pose_landmarks=None):
+        if self.length == len(self._valid):
+            self._grow()
+        i = self.length
+        self._timestamps[i] = timestamp
+        if pose_landmarks is not None:
+            self._landmarks[i] = [(p.x, p.y, p.z, p.visibility) for p in pose_landmarks.landmark]
+            self._valid[i] = True
+        else:
+            self._landmarks[i] = 0
+            self._valid[i] = False
+        self.length += 1
+
+    def points(self, index):
+        # (frames, 2) x/y of one landmark across the video
+        return self.landmarks[:, index, :2]
+
+
+def angle_series(seq, a, b, c):
+    # Joint angle at landmark b for every frame, in degrees
+    return joint_angles(seq.points(a), seq.points(b), seq.points(c))
+
+
+def frame_to_frame_change(seq, values):
+    """Change of ``values`` since the previous frame with a pose.
+
+    Tuned thresholds are per source frame. A movement peak only lasts a frame
+    or two, so change across frames skipped by sampling (or without a pose)
+    grows slower than linearly; it is scaled by sqrt of the gap, not the gap.
+    A single frame of landmark jitter can cross a threshold on its own, so
+    rules reading this must tolerate that (JumpDetector.min_air_sec). NaN
+    where there is no earlier valid frame.
+    """
+    change = np.full(len(seq), np.nan)
+    idx = np.flatnonzero(seq.valid)
+    if len(idx) > 1:
+        gaps = np.maximum(1, np.round(np.diff(seq.timestamps[idx]) * seq.fps))
+        change[idx[1:]] = np.diff(values[idx]) / np.sqrt(gaps)
+    return change
+
+
+def ramp(value, zero, full):
+    # 0 at `zero`, 1 at `full`, linear and clipped in between; either direction
+    return min(1.0, max(0.0, (value - zero) / (full - zero)))
+
+
+# Reps quicker than this lose tempo points in the form score
+MIN_REP_SEC = 1.0
+
+
+class RepTracker:
+    """Per-rep timeline of one joint angle, kept as running values only.
+
+    Uses the same top/bottom hysteresis as the detector's counter. A rep runs
+    from the last frame above `top` before the angle falls below `bottom`,
+    through its lowest point, to the first frame back above `top`. form is
+    0-100: depth (lowest angle from bottom toward depth_full), lockout
+    (highest angle from top toward lockout_full) and tempo.
+    """
+
+    def __init__(self, top, bottom, depth_full, lockout_full):
+        self.top = top
+        self.bottom = bottom
+        self.depth_full = depth_full
+        self.lockout_full = lockout_full
+        self.reset()
+
+    def reset(self):
+        self.reps = []
+        self._top = None
+        self._rep = None
+        self._last = None
+
+    def update(self, frame, timestamp, angle):
+        self._last = (frame, timestamp, angle)
+        rep = self._rep
+        if rep is None:
+            if angle > self.top:
+                self._top = (frame, timestamp, angle)
+            elif angle < self.bottom:
+                start_frame, start, max_angle = self._top or self._last
+                self._rep = {"start_frame": start_frame, "start": start, "max_angle": max_angle,
+                             "min_angle": angle, "bottom": timestamp}
+        else:
+            if angle < rep["min_angle"]:
+                rep["min_angle"], rep["bottom"] = angle, timestamp
+            if angle > self.top:
+                self.reps.append(self._close(rep, frame, timestamp, angle))
+                self._rep = None
+                self._top = (frame, timestamp, angle)
+
+    def _close(self, rep, frame, timestamp, angle):
+        max_angle = max(rep["max_angle"], angle)
+        form = 0.5 * ramp(rep["min_angle"], self.bottom, self.depth_full) \
+            + 0.3 * ramp(max_angle, self.top, self.lockout_full) \
+            + 0.2 * ramp(timestamp - rep["start"], MIN_REP_SEC / 2, MIN_REP_SEC)
+        return {
+            "start_frame": rep["start_frame"],
+            "end_frame": frame,
+            "start": round(rep["start"], 3),
+            "end": round(timestamp, 3),
+            "min_angle": round(rep["min_angle"], 1),
+            "max_angle": round(max_angle, 1),
+            "down_sec": round(rep["bottom"] - rep["start"], 3),
+            "up_sec": round(timestamp - rep["bottom"], 3),
+            "form": int(round(100 * form)),
+        }
+
+    def timeline(self, include_partial=False):
+        # A rep still at the bottom when the video ends closes on the last frame
+        if include_partial and self._rep is not None:
+            return self.reps + [self._close(self._rep, *self._last)]
+        return list(self.reps)
+
+
+class BaseDetector:
+    """Pose inference into a LandmarkSequence, then batch rule evaluation.
+
+    Subclasses define:
+      features(seq) -> dict of (frames,) arrays computed with NumPy over the
+          whole sequence (angles, alignment flags, trajectories).
+      reset_state() / update(valid, timestamp, *feature_values) for the
+          per-frame state machine, which only sees plain Python scalars.
+      result(seq) -> the exercise's own output dict, including count_key.
+    Thresholds listed in tunable_params can be overridden per video through
+    process_video(params=...).
+
+    analyze() returns result(seq) plus the fields every exercise shares:
+      exercise, count, unit ("reps", or "seconds" held),
+      rep_times (video seconds of each counted rep), hold_intervals
+      ([start, end] of each counted hold), timeline (one entry per rep or
+      hold: frames, times, min/max angle, tempo, 0-100 form), form_score
+      (their mean), duration_sec (video time analysed), accuracy, and
+      quality ({"frames", "pose_frames", "pose_ratio"}). process_video
+      adds stage_seconds. The size grows with reps, never with the number
+      of frames.
+
+    analyze() feeds the buffered frames through update() in order, so the
+    counts are the same as running the rules frame by frame (as RepStream
+    does live); only the feature math is batched. update() can read
+    self.frame, the index of the frame being replayed.
+    """
+
+    exercise = None
+    count_key = None
+    unit = "reps"
+    accuracy_scale = 70
+    tunable_params = ()
+
+    def __init__(self):
+        # Whatever the subclass constructor set is the baseline for params overrides
+        self.default_params = {name: getattr(self, name) for name in self.tunable_params}
+        self._pose = None
+        self.sampler = FrameSampler()
+        self.sequence = LandmarkSequence()
+        self.timings = None
+        self.stage_seconds = {}
+        self.reset_state()
+
+    @property
+    def pose(self):
+        # Built on first use: rule-only detectors (live sessions fed landmarks
+        # by the client) never load mediapipe
+        if self._pose is None:
+            import mediapipe as mp
+            self._pose = mp.solutions.pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+        return self._pose
+
+    def reset(self):
+        # Clear per-video state so a preloaded detector can be reused
+        self.sequence = LandmarkSequence()
+        self.timings = None
+        self.stage_seconds = {}
+        self.reset_state()
+        if self._pose is not None:
+            self._pose.reset()
+
+    def close(self):
+        if self._pose is not None:
+            self._pose.close()
+
+    def configure(self, **params):
+        for name, value in params.items():
+            if name not in self.tunable_params:
+                raise ValueError(f"Unknown parameter for {type(self).__name__}: {name}")
+            setattr(self, name, float(value))
+
+    def detect(self, frame, timestamp=0.0):
+        # Pose inference only; counting happens over the whole buffer in analyze()
+        self.detect_rgb(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), timestamp)
+
+    def detect_rgb(self, image_rgb, timestamp=0.0):
+        results = self.pose.process(image_rgb)
+        self.sequence.append(timestamp, results.pose_landmarks)
+
+    def extract_landmarks(self, cap, pipelined=False, start_frame=0, end_frame=None):
+        capacity = self.sampler.open(cap)
+        self.sequence = LandmarkSequence(
+            capacity=capacity,
+            fps=self.sampler.fps,
+            frame_width=self.sampler.frame_width,
+            frame_height=self.sampler.frame_height,
+        )
+        if pipelined:
+            self.timings = FramePipeline(self.sampler).run(cap, self.detect_rgb)
+            self._add_stage("decode", self.timings["decode_sec"])
+            self._add_stage("convert", self.timings["convert_sec"])
+            self._add_stage("inference", self.timings["inference_sec"])
+        else:
+            decode = inference = 0.0
+            frames = self.sampler.frames(cap, start_frame, end_frame)
+            while True:
+                start = time.perf_counter()
+                item = next(frames, None)
+                decode += time.perf_counter() - start
+                if item is None:
+                    break
+                start = time.perf_counter()
+                self.detect(item[1], item[0])
+                inference += time.perf_counter() - start
+            self._add_stage("decode", decode)
+            # Includes the BGR to RGB conversion
+            self._add_stage("inference", inference)
+
+        # One line per video, not per frame
+        missing = len(self.sequence) - int(self.sequence.valid.sum())
+        if missing == len(self.sequence):
+            log.warning("No pose found in any of %d frames", missing)
+        elif missing:
+            log.debug("No pose in %d of %d frames", missing, len(self.sequence))
+
+        # Landmarks from a cropped frame back to full-frame coordinates
+        if self.sampler.roi:
+            landmarks = self.sequence.landmarks
+            landmarks[:, :, 0] = self.sampler.x0 + landmarks[:, :, 0] * self.sampler.w
+            landmarks[:, :, 1] = self.sampler.y0 + landmarks[:, :, 1] * self.sampler.h
+        return self.sequence
+
+    def _add_stage(self, stage, seconds):
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def analyze(self, seq):
+        start = time.perf_counter()
+        self.reset_state()
+        features = self.features(seq)
+        columns = [seq.valid.tolist(), seq.timestamps.tolist()]
+        columns += [values.tolist() for values in features.values()]
+        for self.frame, row in enumerate(zip(*columns)):
+            self.update(*row)
+        result = self.summarize(seq)
+        self._add_stage("counting", time.perf_counter() - start)
+        return result
+
+    def summarize(self, seq):
+        # result(seq) in the shared schema; seq only needs len(), valid and duration_sec
+        result = self.result(seq)
+        frames = len(seq)
+        pose_frames = int(seq.valid.sum())
+        timeline = result.get("timeline", [])
+        return {
+            **result,
+            "exercise": self.exercise,
+            "count": result[self.count_key],
+            "unit": self.unit,
+            "rep_times": result.get("rep_times", []),
+            "hold_intervals": result.get("hold_intervals", []),
+            "timeline": timeline,
+            "form_score": round(sum(rep["form"] for rep in timeline) / len(timeline), 1) if timeline else None,
+            "duration_sec": round(seq.duration_sec, 3),
+            "quality": {
+                "frames": frames,
+                "pose_frames": pose_frames,
+                "pose_ratio": round(pose_frames / frames, 4) if frames else 0.0,
+            },
+        }
+
+    def accuracy(self, seq):
+        total_frames = len(seq)
+        valid_pose_frames = int(seq.valid.sum())
+        accuracy = valid_pose_frames / total_frames if total_frames > 0 else 0
+        return round(accuracy * self.accuracy_scale, 2)
+
+    def load_sequence(self, video_path, target_fps=None, max_side=None, roi=None, pipelined=False,
+                      parallel=None, content_hash=None, streaming=False, expected_size=None):
+        # Landmarks for a video: from the cache when the same content was seen
+        # with the same extraction settings, otherwise via pose inference
+        key = None
+        if content_hash:
+            segment_sec = None
+            if parallel and parallel > 1:
+                from detectors.parallel import SEGMENT_SEC
+                segment_sec = SEGMENT_SEC
+            key = landmark_cache.cache_key(
+                content_hash, target_fps=target_fps, max_side=max_side,
+                roi=list(roi) if roi else None, segment_sec=segment_sec,
+            )
+            start = time.perf_counter()
+            cached = landmark_cache.load(key)
+            self._add_stage("cache_load", time.perf_counter() - start)
+            if cached is not None:
+                return LandmarkSequence.from_saved(cached), True
+
+        self.sampler = FrameSampler(target_fps, max_side, roi)
+        seq = None
+        if parallel and parallel > 1:
+            if streaming:
+                # Segments seek all over the file, so the whole upload is needed first
+                reader = GrowingFile(video_path, expected_size)
+                reader.wait_complete()
+                reader.close()
+                if reader.error:
+                    raise reader.error
+            # Imported here: only needed by the chunked mode
+            from detectors.parallel import extract_parallel
+            start = time.perf_counter()
+            seq = extract_parallel(video_path, parallel, target_fps, max_side, roi)
+            # Decode and inference run in the segment processes
+            self._add_stage("extract_parallel", time.perf_counter() - start)
+            if seq is None:
+                log.warning("Seeking in %s is not frame-accurate, analysing it sequentially", video_path)
+        if seq is None:
+            cap, reader = open_capture(video_path, streaming, expected_size)
+            if not cap.isOpened():
+                raise IOError(f"Cannot open video file: {video_path}")
+            seq = self.extract_landmarks(cap, pipelined)
+            cap.release()
+            if reader:
+                reader.close()
+                if reader.error:
+                    raise reader.error
+
+        if key:
+            landmark_cache.store(key, **seq.to_arrays())
+        return seq, False
+
+    def process_video(self, video_path, target_fps=None, max_side=None, roi=None, pipelined=False,
+                      parallel=None, content_hash=None, params=None, streaming=False, expected_size=None):
+        # Fresh tracking state per video, so results don't depend on what ran before
+        self.reset()
+        self.configure(**{**self.default_params, **(params or {})})
+        try:
+            seq, cached = self.load_sequence(
+                video_path, target_fps, max_side, roi, pipelined, parallel, content_hash, streaming, expected_size,
+            )
+        except IOError as e:
+            return {"error": str(e)}
+
+        result = self.analyze(seq)
+        if cached:
+            result["cached"] = True
+        elif pipelined:
+            # Per-stage timings, to see whether decode or inference is the bottleneck
+            result["timings"] = self.timings
+        # Popped by the detector pool into the metrics
+        result["stage_seconds"] = dict(self.stage_seconds)
+        return result
+
+    def reset_state(self):
+        raise NotImplementedError
+
+    def features(self, seq):
+        raise NotImplementedError
+
+    def update(self, valid, timestamp, *values):
+        raise NotImplementedError
+
+    def result(self, seq):
+        raise NotImplementedError
+
+
+def process_video_multi(detectors, video_path, target_fps=None, max_side=None, roi=None, pipelined=False,
+                        parallel=None, content_hash=None, params=None, streaming=False, expected_size=None):
+    """Score one video for several exercises with a single pose-inference pass.
+
+    detectors maps exercise type to a preloaded detector. The first one
+    extracts the landmarks (or loads them from the cache), then every
+    detector replays its rules over that same sequence, so inference cost
+    doesn't grow with the number of exercises. params maps exercise type to
+    that detector's threshold overrides.
+    """
+    params = params or {}
+    extractor = next(iter(detectors.values()))
+    extractor.reset()
+    try:
+        seq, cached = extractor.load_sequence(
+            video_path, target_fps, max_side, roi, pipelined, parallel, content_hash, streaming, expected_size,
+        )
+    except IOError as e:
+        return {"error": str(e)}
+
+    results = {}
+    start = time.perf_counter()
+    for ex_type, detector in detectors.items():
+        detector.configure(**{**detector.default_params, **params.get(ex_type, {})})
+        results[ex_type] = detector.analyze(seq)
+    counting = time.perf_counter() - start
+
+    result = {"exercises": results}
+    if cached:
+        result["cached"] = True
+    elif pipelined:
+        result["timings"] = extractor.timings
+    result["stage_seconds"] = {**extractor.stage_seconds, "counting": counting}
+    return result
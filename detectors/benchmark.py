@@ -0,0 +1,346 @@
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import types
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detectors.base import (
+    LandmarkSequence, NUM_LANDMARKS,
+    LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_ELBOW, RIGHT_ELBOW, LEFT_WRIST, RIGHT_WRIST,
+    LEFT_HIP, RIGHT_HIP, LEFT_KNEE, RIGHT_KNEE, LEFT_ANKLE, RIGHT_ANKLE,
+)
+from utils.detector_pool import DETECTOR_CLASSES, new_detector
+
+# Throughput and count accuracy of the detectors, as JSON so runs can be
+# diffed. Counting runs replay landmark sequences (synthetic motion with a
+# known rep count, or fixtures recorded from real clips) through the rules
+# only and never touch mediapipe; video runs time every pipeline stage.
+#
+#   python -m detectors.benchmark counting [--fixtures DIR] [--out FILE]
+#   python -m detectors.benchmark video clip.mp4 --exercise squat [--expected 12] [--stub-pose]
+#   python -m detectors.benchmark record clip.mp4 --exercise squat --expected 12 --out DIR
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _stub_mediapipe():
+    # Counting needs no pose inference; fail loudly if anything tries
+    class Pose:
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError("pose inference is stubbed out in counting benchmarks")
+
+    stub = types.ModuleType("mediapipe")
+    stub.__version__ = "stub"
+    stub.solutions = types.SimpleNamespace(pose=types.SimpleNamespace(Pose=Pose))
+    sys.modules["mediapipe"] = stub
+
+
+class _StubPose:
+    # Stands in for the Pose graph so decode and convert can be timed offline
+    def process(self, image_rgb):
+        return types.SimpleNamespace(pose_landmarks=None)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Synthetic motion. A side-on standing figure in normalized coordinates; each
+# generator moves the joints its detector reads through a known number of reps.
+
+_STANDING = {
+    LEFT_SHOULDER: (0.48, 0.30), RIGHT_SHOULDER: (0.52, 0.30),
+    LEFT_ELBOW: (0.47, 0.42), RIGHT_ELBOW: (0.53, 0.42),
+    LEFT_WRIST: (0.47, 0.52), RIGHT_WRIST: (0.53, 0.52),
+    LEFT_HIP: (0.49, 0.55), RIGHT_HIP: (0.51, 0.55),
+    LEFT_KNEE: (0.49, 0.72), RIGHT_KNEE: (0.51, 0.72),
+    LEFT_ANKLE: (0.49, 0.90), RIGHT_ANKLE: (0.51, 0.90),
+}
+
+
+def _skeleton(frames):
+    landmarks = np.zeros((frames, NUM_LANDMARKS, 4), dtype=np.float32)
+    landmarks[:, :, :2] = 0.5
+    landmarks[:, :, 3] = 1.0
+    for index, (x, y) in _STANDING.items():
+        landmarks[:, index, 0] = x
+        landmarks[:, index, 1] = y
+    return landmarks
+
+
+def _cycles(reps, fps, rep_sec, rest_sec):
+    # Phase 0..1 within each rep (NaN while resting between reps)
+    rep_frames, rest_frames = int(round(rep_sec * fps)), int(round(rest_sec * fps))
+    one = np.concatenate([np.full(rest_frames, np.nan), np.arange(rep_frames) / rep_frames])
+    return np.concatenate([np.tile(one, reps), np.full(rest_frames, np.nan)])
+
+
+def _place(landmarks, joint, origin, length, direction):
+    # joint = origin + length * unit vector at `direction` radians (0 = straight down)
+    landmarks[:, joint, 0] = landmarks[:, origin, 0] + length * np.sin(direction)
+    landmarks[:, joint, 1] = landmarks[:, origin, 1] + length * np.cos(direction)
+
+
+def _squat(reps, fps):
+    phase = _cycles(reps, fps, rep_sec=2.0, rest_sec=0.5)
+    # Knee angle 175 -> 70 -> 175 degrees through each rep
+    knee = np.radians(np.where(np.isnan(phase), 175, 122.5 + 52.5 * np.cos(2 * np.pi * np.nan_to_num(phase))))
+    landmarks = _skeleton(len(phase))
+    # The shin points straight down, so the thigh's direction is the knee angle
+    _place(landmarks, LEFT_HIP, LEFT_KNEE, 0.17, knee)
+    return landmarks, reps
+
+
+def _pushup(reps, fps):
+    phase = _cycles(reps, fps, rep_sec=1.6, rest_sec=0.4)
+    # Elbow angle 170 -> 80 -> 170 degrees, body flat and side-on
+    elbow = np.radians(np.where(np.isnan(phase), 170, 125 + 45 * np.cos(2 * np.pi * np.nan_to_num(phase))))
+    landmarks = _skeleton(len(phase))
+    for joint, (x, y) in {LEFT_SHOULDER: (0.35, 0.55), RIGHT_SHOULDER: (0.36, 0.55), LEFT_HIP: (0.55, 0.58),
+                          RIGHT_HIP: (0.56, 0.58), LEFT_ANKLE: (0.75, 0.62), RIGHT_ANKLE: (0.76, 0.62)}.items():
+        landmarks[:, joint, 0] = x
+        landmarks[:, joint, 1] = y
+    _place(landmarks, LEFT_ELBOW, LEFT_SHOULDER, 0.12, 0.0)
+    # Wrist direction measured from the upper arm (pointing back up at the shoulder)
+    _place(landmarks, LEFT_WRIST, LEFT_ELBOW, 0.12, np.pi - elbow)
+    return landmarks, reps
+
+
+def _jump(reps, fps):
+    phase = _cycles(reps, fps, rep_sec=0.5, rest_sec=0.8)
+    # Hips rise and fall by a fifth of the frame height in each jump
+    lift = np.where(np.isnan(phase), 0.0, 0.2 * np.sin(np.pi * np.nan_to_num(phase)))
+    landmarks = _skeleton(len(phase))
+    landmarks[:, :, 1] -= lift[:, None]
+    return landmarks, reps
+
+
+def _plank(holds, fps, hold_sec=4.0, break_sec=1.0, hold_threshold=1.0):
+    hold_frames, break_frames = int(round(hold_sec * fps)), int(round(break_sec * fps))
+    holding = np.tile(np.concatenate([np.ones(hold_frames, bool), np.zeros(break_frames, bool)]), holds)
+    landmarks = _skeleton(len(holding))
+    for joint, x in {LEFT_SHOULDER: 0.3, RIGHT_SHOULDER: 0.31, LEFT_HIP: 0.5, RIGHT_HIP: 0.51,
+                     LEFT_ANKLE: 0.7, RIGHT_ANKLE: 0.71}.items():
+        landmarks[:, joint, 0] = x
+        landmarks[:, joint, 1] = 0.6
+    # Hips piked up between holds, so the body line breaks
+    landmarks[~holding, LEFT_HIP, 1] = landmarks[~holding, RIGHT_HIP, 1] = 0.35
+    # Counted time starts hold_threshold into each hold. The detector puts hold
+    # boundaries halfway between frames, except the start of the first hold,
+    # which is the first frame of the video.
+    counted = max(0.0, hold_frames / fps - hold_threshold)
+    return landmarks, round(holds * counted - 0.5 / fps, 2)
+
+
+GENERATORS = {"squat": _squat, "pushup": _pushup, "jump": _jump, "plank": _plank}
+
+
+def synthetic(ex_type, reps, fps=30.0, frame_height=720, noise=0.002, dropout=0.0, seed=0):
+    """(LandmarkSequence, expected count) of generated motion.
+
+    noise is landmark jitter in normalized units; dropout is the fraction of
+    frames with no pose. Plank "reps" are holds and the expected count is the
+    seconds the detector should count.
+    """
+    landmarks, expected = GENERATORS[ex_type](reps, fps)
+    rng = np.random.default_rng(seed)
+    landmarks[:, :, :2] += rng.normal(0, noise, landmarks[:, :, :2].shape).astype(np.float32)
+    valid = rng.random(len(landmarks)) >= dropout
+    landmarks[~valid] = 0
+    timestamps = np.arange(len(landmarks)) / fps
+    seq = LandmarkSequence.from_arrays(landmarks, valid, timestamps, fps, int(frame_height * 16 / 9), frame_height)
+    return seq, expected
+
+
+def synthetic_cases(seed=0):
+    # Clean motion, then jitter and dropped frames. Plank gets jitter only: a
+    # dropped frame at the edge of a hold moves that edge by a frame.
+    cases = []
+    for ex_type in GENERATORS:
+        for reps in (5, 20):
+            cases.append((f"synthetic-{ex_type}-{reps}", ex_type, *synthetic(ex_type, reps, noise=0, seed=seed)))
+            noisy = synthetic(ex_type, reps, noise=0.004, dropout=0 if ex_type == "plank" else 0.03, seed=seed)
+            cases.append((f"synthetic-{ex_type}-{reps}-noisy", ex_type, *noisy))
+    return cases
+
+
+def recorded_cases(fixtures_dir):
+    # <name>.npz (LandmarkSequence.to_arrays) next to <name>.json {"exercise", "expected"}
+    cases = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.npz"))):
+        with open(path[:-len(".npz")] + ".json") as f:
+            meta = json.load(f)
+        with np.load(path) as data:
+            seq = LandmarkSequence.from_saved({name: data[name] for name in data.files})
+        cases.append((os.path.basename(path)[:-len(".npz")], meta["exercise"], seq, meta.get("expected")))
+    return cases
+
+
+def _stage(frames, seconds):
+    return {"sec": round(seconds, 6), "fps": round(frames / seconds, 1) if seconds > 0 else None}
+
+
+def _count_case(name, ex_type, seq, expected, repeat):
+    detector = new_detector(ex_type)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = detector.analyze(seq)
+        best = min(best, time.perf_counter() - start)
+    counted = result["count"]
+    return {
+        "name": name,
+        "exercise": ex_type,
+        "frames": len(seq),
+        "expected": expected,
+        "counted": counted,
+        "count_error": None if expected is None else round(abs(counted - expected), 2),
+        "stages": {"counting": _stage(len(seq), best)},
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _summary(cases):
+    summary = {}
+    for ex_type in DETECTOR_CLASSES:
+        mine = [case for case in cases if case["exercise"] == ex_type]
+        if not mine:
+            continue
+        errors = [case["count_error"] for case in mine if case["count_error"] is not None]
+        frames = sum(case["frames"] for case in mine)
+        seconds = sum(case["stages"]["counting"]["sec"] for case in mine)
+        summary[ex_type] = {
+            "cases": len(mine),
+            "mean_abs_count_error": round(sum(errors) / len(errors), 3) if errors else None,
+            "exact": sum(1 for error in errors if error == 0),
+            "counting_fps": _stage(frames, seconds)["fps"],
+        }
+    return summary
+
+
+def _report(kind, cases, **extra):
+    return {
+        "benchmark": kind,
+        "generated_at": datetime.utcnow().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        **extra,
+        "cases": cases,
+        "summary": _summary(cases),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_counting(fixtures_dir=None, repeat=5, seed=0):
+    """Count-only benchmark over synthetic motion and any recorded fixtures."""
+    _stub_mediapipe()
+    cases = synthetic_cases(seed)
+    if fixtures_dir:
+        cases += recorded_cases(fixtures_dir)
+    return _report("counting", [_count_case(*case, repeat=repeat) for case in cases], repeat=repeat)
+
+
+def run_video(video_path, ex_type, expected=None, stub_pose=False, target_fps=None, max_side=None, repeat=5):
+    """Every stage on one clip: decode, convert and pose (threaded pipeline), then counting."""
+    import cv2
+    if stub_pose:
+        _stub_mediapipe()
+    detector = new_detector(ex_type)
+    if stub_pose:
+        detector._pose = _StubPose()
+    else:
+        # Build the graph before the clock starts
+        detector.pose
+
+    from detectors.frame_source import FrameSampler
+    detector.sampler = FrameSampler(target_fps, max_side)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file: {video_path}")
+    seq = detector.extract_landmarks(cap, pipelined=True)
+    cap.release()
+
+    timings = detector.timings
+    frames = timings["frames"]
+    case = _count_case(os.path.basename(video_path), ex_type, seq, expected, repeat)
+    case["stages"] = {
+        "decode": _stage(frames, timings["decode_sec"]),
+        "convert": _stage(frames, timings["convert_sec"]),
+        "pose": _stage(frames, timings["inference_sec"]),
+        **case["stages"],
+        "wall": _stage(frames, timings["wall_sec"]),
+    }
+    case["peak_rss_mb"] = _peak_rss_mb()
+    return _report("video", [case], stub_pose=stub_pose, repeat=repeat)
+
+
+def record_fixture(video_path, ex_type, expected, out_dir, target_fps=None, max_side=None):
+    # Landmarks of a real clip plus its hand-counted reps, for the counting benchmark
+    detector = new_detector(ex_type)
+    seq, _ = detector.load_sequence(video_path, target_fps=target_fps, max_side=max_side)
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    os.makedirs(out_dir, exist_ok=True)
+    np.savez_compressed(os.path.join(out_dir, f"{name}.npz"), **seq.to_arrays())
+    with open(os.path.join(out_dir, f"{name}.json"), "w") as f:
+        json.dump({"exercise": ex_type, "expected": expected, "source": os.path.basename(video_path)}, f)
+    detector.close()
+    return os.path.join(out_dir, f"{name}.npz")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Detector throughput and count-accuracy benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    counting = commands.add_parser("counting", help="Rules only over synthetic and recorded landmarks (no mediapipe)")
+    counting.add_argument("--fixtures", help="Directory of recorded .npz/.json fixtures")
+    counting.add_argument("--seed", type=int, default=0)
+
+    video = commands.add_parser("video", help="Decode, convert, pose and counting stages on one clip")
+    video.add_argument("video")
+    video.add_argument("--stub-pose", action="store_true", help="Time decode and convert without mediapipe")
+
+    record = commands.add_parser("record", help="Save a clip's landmarks as a counting fixture")
+    record.add_argument("video")
+    record.add_argument("--out", required=True, help="Fixture directory")
+
+    for sub in (video, record):
+        sub.add_argument("--exercise", required=True, choices=sorted(DETECTOR_CLASSES))
+        sub.add_argument("--expected", type=float, default=None, help="Hand-counted reps (plank: seconds held)")
+        sub.add_argument("--target_fps", type=float, default=None)
+        sub.add_argument("--max_side", type=int, default=None)
+    for sub in (counting, video):
+        sub.add_argument("--repeat", type=int, default=5, help="Time counting this many times and keep the best")
+        sub.add_argument("--out", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        print(record_fixture(args.video, args.exercise, args.expected, args.out, args.target_fps, args.max_side))
+        sys.exit(0)
+
+    if args.command == "counting":
+        report = run_counting(args.fixtures, args.repeat, args.seed)
+    else:
+        report = run_video(args.video, args.exercise, args.expected, args.stub_pose,
+                           args.target_fps, args.max_side, args.repeat)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
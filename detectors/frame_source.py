@@ -0,0 +1,95 @@
+import cv2
+
+from detectors.landmark_cache import hash_file
+
+
+class FrameSampler:
+    """Reads a video at a reduced rate and resolution for pose estimation.
+
+    target_fps: analyse at most this many frames per second of video. Skipped
+        frames are only grabbed, never retrieved into an image.
+    max_side: downscale so the longer side is at most this many pixels.
+    roi: (x, y, w, h) crop as fractions of the frame, applied before scaling.
+
+    Landmarks found on the cropped frame must be mapped back to full-frame
+    normalized coordinates (x0 + x * w, y0 + y * h) so thresholds keep working.
+    """
+
+    def __init__(self, target_fps=None, max_side=None, roi=None):
+        self.target_fps = target_fps
+        self.max_side = max_side
+        self.roi = roi
+        self.x0, self.y0, self.w, self.h = roi or (0.0, 0.0, 1.0, 1.0)
+        self.fps = 30.0  # replaced by the container fps once a video is opened
+        self.step = 1
+        self.frame_width = 0
+        self.frame_height = 0
+
+    def open(self, cap):
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.step = max(1, int(round(self.fps / self.target_fps))) if self.target_fps else 1
+        self.frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # Upper bound on how many frames frames() will yield
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0) // self.step + 1
+
+    def frames(self, cap, start_frame=0, end_frame=None):
+        # Yields (timestamp_sec, frame) for every sampled frame in
+        # [start_frame, end_frame). Sampling stays aligned to frame 0, so a
+        # range picks exactly the frames a full pass would.
+        self.open(cap)
+        index = start_frame
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        while end_frame is None or index < end_frame:
+            if index % self.step:
+                if not cap.grab():
+                    break
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield self.timestamp(cap, index), self.prepare(frame)
+            index += 1
+
+    def timestamp(self, cap, index):
+        # Presentation time of the frame just read, from the container, so
+        # variable frame rate video and seeks (parallel segments) get the same
+        # times a full pass would. index / fps where the backend reports none.
+        msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+        if msec > 0 or index == 0:
+            return msec / 1000
+        return index / self.fps
+
+    def prepare(self, frame):
+        if self.roi:
+            height, width = frame.shape[:2]
+            x1, y1 = int(self.x0 * width), int(self.y0 * height)
+            x2, y2 = int((self.x0 + self.w) * width), int((self.y0 + self.h) * height)
+            frame = frame[y1:y2, x1:x2]
+
+        if self.max_side:
+            height, width = frame.shape[:2]
+            longest = max(height, width)
+            if longest > self.max_side:
+                scale = self.max_side / longest
+                frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        return frame
+
+
+def add_sampling_args(parser):
+    parser.add_argument("--target_fps", type=float, default=None, help="Analyse at most this many frames per second")
+    parser.add_argument("--max_side", type=int, default=None, help="Downscale frames so the longer side fits")
+    parser.add_argument("--roi", type=lambda s: tuple(float(v) for v in s.split(",")), default=None,
+                        help="Crop x,y,w,h as fractions of the frame")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Decode, convert and run inference on separate threads and report stage timings")
+    parser.add_argument("--parallel", type=int, default=None,
+                        help="Split the video into this many segments analysed in separate processes")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse landmarks cached for this exact video content")
+
+
+def sampling_kwargs(args):
+    return {"target_fps": args.target_fps, "max_side": args.max_side, "roi": args.roi, "pipelined": args.pipelined,
+            "parallel": args.parallel, "content_hash": hash_file(args.video) if args.cache else None}
@@ -1,86 +1,108 @@
-import cv2
-import mediapipe as mp
-import sys
 import json
+import logging
 import os
+import sys
 
-# Suppress TensorFlow and MediaPipe logs
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-
-class JumpDetector:
-    def __init__(self, upward_threshold=10.0, downward_threshold=8.0):
-        self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose()
-        self.jump_count = 0
-        self.prev_y = None
-        self.upward_threshold = upward_threshold
-        self.downward_threshold = downward_threshold
-        self.in_air = False
-        self.total_frames = 0
-        self.valid_pose_frames = 0
-
-    def detect(self, frame):
-        self.total_frames += 1
-        # Convert BGR to RGB as mediapipe expects RGB images
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = self.pose.process(frame_rgb)
-
-        if results.pose_landmarks:
-            self.valid_pose_frames += 1
-            # Get left and right hip landmarks
-            left_hip = results.pose_landmarks.landmark[self.mp_pose.PoseLandmark.LEFT_HIP]
-            right_hip = results.pose_landmarks.landmark[self.mp_pose.PoseLandmark.RIGHT_HIP]
-            
-            # Calculate average y position of hips in pixels
-            frame_height = frame.shape[0]
-            current_hip_y = ((left_hip.y + right_hip.y) / 2) * frame_height
-
-            print(f"[Debug] Hip Y position: {current_hip_y:.2f}", file=sys.stderr)
-
-            if self.prev_y is not None:
-                diff = current_hip_y - self.prev_y  # Negative if moving up
-                print(f"[Debug] Vertical movement diff: {diff:.2f}, In air: {self.in_air}, Jump count: {self.jump_count}", file=sys.stderr)
-
-
-                # Detect lift-off (moving up fast enough and not already in air)
-                if diff < -self.upward_threshold and not self.in_air:
-                    self.in_air = True
-                    print(f"[Jump] Detected lift-off. diff: {diff:.2f}", file=sys.stderr)
-
-                # Detect landing (moving down fast enough and currently in air)
-                elif diff > self.downward_threshold and self.in_air:
-                    self.in_air = False
-                    self.jump_count += 1
-                    print(f"[Jump] Landing detected. Count: {self.jump_count}", file=sys.stderr)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detectors.base import (
+    BaseDetector, angle_series, frame_to_frame_change, log, ramp, LEFT_HIP, RIGHT_HIP, LEFT_KNEE, LEFT_ANKLE,
+)
+from detectors.frame_source import add_sampling_args, sampling_kwargs
 
-            self.prev_y = current_hip_y
-        else:
-            print("[Warning] No pose landmarks detected in this frame.", file=sys.stderr)
 
+class JumpDetector(BaseDetector):
+    exercise = "jump"
+    count_key = "jump_count"
+    tunable_params = ("upward_threshold", "downward_threshold", "min_air_sec")
 
-    def process_video(self, video_path):
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            print(json.dumps({"error": f"Cannot open video file: {video_path}"}), file=sys.stdout)
+    def __init__(self, upward_threshold=10.0, downward_threshold=8.0, min_air_sec=0.1):
+        self.upward_threshold = upward_threshold
+        self.downward_threshold = downward_threshold
+        # A "landing" sooner than this after lift-off is one jittery frame, not a jump
+        self.min_air_sec = min_air_sec
+        super().__init__()
 
+    def reset_state(self):
+        self.jump_count = 0
+        self.in_air = False
+        self.rep_times = []
+        # One entry per jump, lift-off to landing; the open one while in the air
+        self.timeline = []
+        self._jump = None
+        # Checked once per video: update() runs for every frame
+        self.debug = log.isEnabledFor(logging.DEBUG)
+
+    def features(self, seq):
+        # Average y position of hips in pixels of the original frame, so
+        # thresholds don't depend on downscaling or cropping
+        y = seq.landmarks[:, :, 1]
+        hip_y = (y[:, LEFT_HIP] + y[:, RIGHT_HIP]) / 2 * seq.frame_height
+        # A jump rising a tenth of the frame gets full height points
+        self.good_rise = 0.1 * seq.frame_height
+        return {
+            "hip_y": hip_y,
+            "diff": frame_to_frame_change(seq, hip_y),  # Negative if moving up
+            "knee_angle": angle_series(seq, LEFT_HIP, LEFT_KNEE, LEFT_ANKLE),
+        }
+
+    def update(self, valid, timestamp, hip_y, diff, knee_angle):
+        if not valid:
             return
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            self.detect(frame)
-
-        cap.release()
-        self.pose.close()
-        accuracy = (
-            self.valid_pose_frames / self.total_frames
-            if self.total_frames > 0 else 0
-        )
-
-        print(json.dumps({"jump_count": self.jump_count, "accuracy": round(accuracy*70, 2)}))
+        if diff != diff:  # NaN: first frame with a pose
+            return
+        if self.debug:
+            log.debug("Jump t=%.2f hip_y=%.2f diff=%.2f in_air=%s count=%d",
+                      timestamp, hip_y, diff, self.in_air, self.jump_count)
+
+        # Detect lift-off (moving up fast enough and not already in air)
+        if diff < -self.upward_threshold and not self.in_air:
+            self.in_air = True
+            # Hips before this frame's rise are the standing height
+            self._jump = {"start_frame": self.frame, "start": timestamp, "ground": hip_y - diff,
+                          "apex": hip_y, "min_angle": knee_angle, "max_angle": knee_angle}
+            return
 
+        # Detect landing (moving down fast enough and currently in air)
+        elif diff > self.downward_threshold and self.in_air:
+            self.in_air = False
+            if timestamp - self._jump["start"] < self.min_air_sec:
+                self._jump = None
+                return
+            self.jump_count += 1
+            self.rep_times.append(round(timestamp, 3))
+            self.timeline.append(self._close_jump(timestamp, knee_angle))
+
+        if self.in_air:
+            jump = self._jump
+            jump["apex"] = min(jump["apex"], hip_y)
+            jump["min_angle"] = min(jump["min_angle"], knee_angle)
+            jump["max_angle"] = max(jump["max_angle"], knee_angle)
+
+    def _close_jump(self, timestamp, landing_angle):
+        jump, self._jump = self._jump, None
+        rise = jump["ground"] - jump["apex"]
+        # Height, and a soft landing: knees bent to 150 degrees or less on touchdown
+        form = 0.6 * ramp(rise, 0, self.good_rise) + 0.4 * ramp(landing_angle, 175, 150)
+        return {
+            "start_frame": jump["start_frame"],
+            "end_frame": self.frame,
+            "start": round(jump["start"], 3),
+            "end": round(timestamp, 3),
+            "min_angle": round(min(jump["min_angle"], landing_angle), 1),
+            "max_angle": round(max(jump["max_angle"], landing_angle), 1),
+            "air_sec": round(timestamp - jump["start"], 3),
+            "rise_px": round(rise, 1),
+            "form": int(round(100 * form)),
+        }
+
+    def result(self, seq):
+        return {
+            "jump_count": self.jump_count,
+            "rep_times": self.rep_times,
+            "timeline": self.timeline,
+            "accuracy": self.accuracy(seq),
+        }
 
 
 if __name__ == "__main__":
@@ -90,11 +112,15 @@ if __name__ == "__main__":
     parser.add_argument("--video", "-v", required=True, help="Path to video file")
     parser.add_argument("--upward", "-u", type=float, default=10.0, help="Upward jump detection threshold in pixels")
     parser.add_argument("--downward", "-d", type=float, default=8.0, help="Downward landing detection threshold in pixels")
+    parser.add_argument("--min_air_sec", type=float, default=0.1, help="Shortest time in the air that counts as a jump")
+    add_sampling_args(parser)
 
     args = parser.parse_args()
 
     try:
-        detector = JumpDetector(upward_threshold=args.upward, downward_threshold=args.downward)
-        detector.process_video(args.video)
+        detector = JumpDetector(upward_threshold=args.upward, downward_threshold=args.downward,
+                                min_air_sec=args.min_air_sec)
+        print(json.dumps(detector.process_video(args.video, **sampling_kwargs(args))))
+        detector.close()
     except Exception as e:
         print(json.dumps({"error": str(e)}))
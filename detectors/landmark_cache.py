@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Extracted landmarks per video, keyed by upload content hash plus everything
+# that changes what pose inference produces. Rule thresholds are not part of
+# the key, so re-scoring a clip with different thresholds skips mediapipe.
+CACHE_DIR = os.getenv("LANDMARK_CACHE_DIR", "cache/landmarks")
+CACHE_MAX_BYTES = int(float(os.getenv("LANDMARK_CACHE_MAX_MB", "500")) * 1024 * 1024)
+
+# Bump when landmark extraction changes in a way that invalidates old entries
+LANDMARK_VERSION = 2
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash, **extraction):
+    try:
+        import mediapipe
+        mp_version = mediapipe.__version__
+    except ImportError:
+        mp_version = None
+    parts = {"hash": content_hash, "version": LANDMARK_VERSION, "mediapipe": mp_version, **extraction}
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def _path(key):
+    return os.path.join(CACHE_DIR, f"{key}.npz")
+
+
+def load(key):
+    path = _path(key)
+    try:
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+    # Touch on hit: mtime is the LRU clock
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return arrays
+
+
+def store(key, **arrays):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write then rename, so concurrent readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, _path(key))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict()
+
+
+def evict(max_bytes=CACHE_MAX_BYTES):
+    # Drop least recently used entries until the cache fits in max_bytes
+    try:
+        entries = [e for e in os.scandir(CACHE_DIR) if e.name.endswith(".npz")]
+    except FileNotFoundError:
+        return
+    stats = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        stats.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,149 @@
+import hashlib
+import math
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detectors.base import BaseDetector, LandmarkSequence
+from detectors.frame_source import FrameSampler
+
+SEGMENT_WORKERS = int(os.getenv("DETECTOR_SEGMENT_WORKERS", str(os.cpu_count() or 2)))
+# Segments sit on a fixed time grid that doesn't depend on how many processes
+# run them. Pose tracking carries state from frame to frame, so this is what
+# makes the landmarks, and therefore the counts, identical for any process
+# count, including running every segment one after another in one process.
+#
+# They are not bit-identical to a plain sequential pass: tracking restarts at
+# every segment, and the landmarks after a boundary differ slightly (about
+# 0.01 of the frame) from those of a tracker that ran through it. That is
+# enough to change a count whose angle sits right at a threshold. On the
+# sample clips cut into 5 s segments every count matches a sequential run;
+# cut into 2 s segments the plank clip, whose body angle hovers around
+# min_angle, holds 3.22 s against 4.88 s: fewer boundaries, fewer of these.
+SEGMENT_SEC = float(os.getenv("DETECTOR_SEGMENT_SEC", "30"))
+# Frames decoded before each segment and thrown away, so pose tracking has
+# settled by the time the segment's own frames start
+WARMUP_SEC = float(os.getenv("DETECTOR_SEGMENT_WARMUP", "1.0"))
+
+
+class LandmarkExtractor(BaseDetector):
+    # Pose inference only; the rules are replayed by the caller on the merged stream
+    def reset_state(self):
+        pass
+
+
+class _OverlapSampler(FrameSampler):
+    # Keeps a digest of each sampled frame whose index falls in one of ranges:
+    # the frames a segment decodes in common with its neighbours
+    def __init__(self, target_fps, max_side, roi, ranges):
+        super().__init__(target_fps, max_side, roi)
+        self.ranges = ranges
+        self.digests = {}
+
+    def frames(self, cap, start_frame=0, end_frame=None):
+        index = None
+        for timestamp, frame in super().frames(cap, start_frame, end_frame):
+            # Sampling is aligned to frame 0, so the indices follow from the start
+            index = -(-start_frame // self.step) * self.step if index is None else index + self.step
+            if any(low <= index < high for low, high in self.ranges):
+                self.digests[index] = hashlib.blake2b(frame.tobytes(), digest_size=16).hexdigest()
+            yield timestamp, frame
+
+
+_extractor = None
+
+
+def _extract_segment(video_path, start_frame, end_frame, warmup_frames, target_fps, max_side, roi):
+    # Runs in a segment worker process; the extractor is built once per process
+    global _extractor
+    if _extractor is None:
+        _extractor = LandmarkExtractor()
+    _extractor.reset()
+    # The warm-up, and the frames the next segment warms up on
+    ranges = [(max(0, start_frame - warmup_frames), start_frame)]
+    if end_frame is not None:
+        ranges.append((end_frame - warmup_frames, end_frame))
+    _extractor.sampler = _OverlapSampler(target_fps, max_side, roi, ranges)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video file: {video_path}")
+    seq = _extractor.extract_landmarks(cap, start_frame=max(0, start_frame - warmup_frames), end_frame=end_frame)
+    cap.release()
+
+    # Drop the warm-up frames that belong to the previous segment. Counted, not
+    # compared by time: container timestamps needn't be index / fps.
+    warmup_sampled = (start_frame - max(0, start_frame - warmup_frames)) // _extractor.sampler.step
+    seq = seq.slice(min(warmup_sampled, len(seq)))
+    arrays = (seq.landmarks, seq.valid, seq.timestamps, seq.fps, seq.frame_width, seq.frame_height)
+    return arrays, _extractor.sampler.digests
+
+
+def _seeks_exact(parts):
+    # Segment k + 1 seeks to its warm-up, which segment k decoded as its last
+    # frames. Segment 0 never seeks, so if every shared frame decodes to the
+    # same pixels, every seek landed where it was asked to.
+    for (_, before), (_, after) in zip(parts, parts[1:]):
+        shared = before.keys() & after.keys()
+        if any(before[index] != after[index] for index in shared):
+            return False
+    return True
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(SEGMENT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def plan_segments(frame_count, fps, step=1, segment_sec=SEGMENT_SEC):
+    """Split [0, frame_count) into SEGMENT_SEC long frame ranges.
+
+    Boundaries are multiples of the sampling step so each range samples the
+    same frames a full pass would. The last range is open-ended because
+    container frame counts are estimates.
+    """
+    length = max(step, math.ceil(segment_sec * fps / step) * step)
+    starts = list(range(0, max(frame_count, 1), length))
+    return [(start, start + length) for start in starts[:-1]] + [(starts[-1], None)]
+
+
+def extract_parallel(video_path, processes, target_fps=None, max_side=None, roi=None):
+    """Landmarks for the whole video, extracted segment by segment.
+
+    The rep/hold state machines are not run here: the caller replays them
+    over the merged stream, so reps that straddle a boundary are counted
+    once. Segments start with a CAP_PROP_POS_FRAMES seek, which some codecs
+    and containers can't do frame-accurately; when the frames segments share
+    don't decode identically, this returns None and the caller should run a
+    sequential pass instead.
+    """
+    cap = cv2.VideoCapture(video_path)
+    sampler = FrameSampler(target_fps, max_side, roi)
+    sampler.open(cap)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    cap.release()
+
+    ranges = plan_segments(frame_count, sampler.fps, sampler.step)
+    warmup_frames = int(round(WARMUP_SEC * sampler.fps / sampler.step)) * sampler.step
+    jobs = [(video_path, start, end, warmup_frames, target_fps, max_side, roi) for start, end in ranges]
+
+    if processes <= 1 or len(jobs) == 1:
+        parts = [_extract_segment(*job) for job in jobs]
+    else:
+        executor = _get_executor()
+        parts = [future.result() for future in [executor.submit(_extract_segment, *job) for job in jobs]]
+    if not _seeks_exact(parts):
+        return None
+    return LandmarkSequence.concatenate([LandmarkSequence.from_arrays(*arrays) for arrays, _ in parts])
@@ -0,0 +1,154 @@
+import queue
+import threading
+import time
+
+import cv2
+
+PIPELINE_DEPTH = 8
+
+_EMPTY_SLOT = object()
+
+
+class FramePipeline:
+    """Decode, convert and inference stages running concurrently.
+
+    A decoder thread reads sampled frames into a fixed ring of reusable
+    buffers, a converter thread crops/downscales them and converts to RGB,
+    and the calling thread runs inference. Every hand-off is a bounded queue,
+    so a slow stage blocks the ones upstream instead of buffering the video.
+
+    run() returns per-stage timings. ``*_wait_sec`` is time a stage spent
+    blocked: a large decode_wait_sec means inference is the bottleneck, a
+    large inference_wait_sec means decoding is.
+    """
+
+    def __init__(self, sampler, depth=PIPELINE_DEPTH):
+        self.sampler = sampler
+        self.depth = depth
+        self.timings = {
+            "frames": 0,
+            "decode_sec": 0.0,
+            "decode_wait_sec": 0.0,
+            "convert_sec": 0.0,
+            "convert_wait_sec": 0.0,
+            "inference_sec": 0.0,
+            "inference_wait_sec": 0.0,
+            "wall_sec": 0.0,
+        }
+        # Slots start empty; cap.read() allocates once, then reuses them in place
+        self._free = queue.Queue()
+        for _ in range(depth):
+            self._free.put(_EMPTY_SLOT)
+        self._decoded = queue.Queue(maxsize=depth)
+        self._ready = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._error = None
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _decode(self, cap):
+        try:
+            step = self.sampler.step
+            index = 0
+            while not self._stop.is_set():
+                if index % step:
+                    start = time.perf_counter()
+                    ok = cap.grab()
+                    self.timings["decode_sec"] += time.perf_counter() - start
+                    if not ok:
+                        break
+                else:
+                    start = time.perf_counter()
+                    slot = self._get(self._free)
+                    self.timings["decode_wait_sec"] += time.perf_counter() - start
+                    if slot is None:
+                        break
+
+                    start = time.perf_counter()
+                    ok, frame = cap.read() if slot is _EMPTY_SLOT else cap.read(slot)
+                    self.timings["decode_sec"] += time.perf_counter() - start
+                    if not ok:
+                        break
+                    if not self._put(self._decoded, (self.sampler.timestamp(cap, index), frame)):
+                        break
+                index += 1
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(self._decoded, None)
+
+    def _convert(self):
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._get(self._decoded)
+                self.timings["convert_wait_sec"] += time.perf_counter() - start
+                if item is None:
+                    break
+
+                timestamp, frame = item
+                start = time.perf_counter()
+                image_rgb = cv2.cvtColor(self.sampler.prepare(frame), cv2.COLOR_BGR2RGB)
+                self.timings["convert_sec"] += time.perf_counter() - start
+                # cvtColor made a copy, so the decode slot can be reused now
+                self._free.put(frame)
+
+                if not self._put(self._ready, (timestamp, image_rgb)):
+                    break
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(self._ready, None)
+
+    def run(self, cap, infer):
+        # infer(image_rgb, timestamp) is called on this thread for every frame
+        wall_start = time.perf_counter()
+        self.sampler.open(cap)
+        threads = [
+            threading.Thread(target=self._decode, args=(cap,), name="frame-decode", daemon=True),
+            threading.Thread(target=self._convert, name="frame-convert", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._get(self._ready)
+                self.timings["inference_wait_sec"] += time.perf_counter() - start
+                if item is None:
+                    break
+
+                timestamp, image_rgb = item
+                start = time.perf_counter()
+                infer(image_rgb, timestamp)
+                self.timings["inference_sec"] += time.perf_counter() - start
+                self.timings["frames"] += 1
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._error:
+            raise self._error
+
+        self.timings["wall_sec"] = time.perf_counter() - wall_start
+        for key, value in self.timings.items():
+            if key != "frames":
+                self.timings[key] = round(value, 4)
+        return self.timings
@@ -1,108 +1,141 @@
-import cv2
-import mediapipe as mp
-import math
-import sys
 import json
 import os
-import time
+import sys
 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+import numpy as np
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detectors.base import (
+    BaseDetector, angle_series, ramp,
+    LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_HIP, RIGHT_HIP, LEFT_ANKLE, RIGHT_ANKLE,
+)
+from detectors.frame_source import add_sampling_args, sampling_kwargs
 
-def calculate_angle(a, b, c):
-    a = [a[0] - b[0], a[1] - b[1]]
-    c = [c[0] - b[0], c[1] - b[1]]
-    dot_product = a[0] * c[0] + a[1] * c[1]
-    mag_a = math.hypot(a[0], a[1])
-    mag_c = math.hypot(c[0], c[1])
-    if mag_a == 0 or mag_c == 0:
-        return 0
-    angle = math.acos(dot_product / (mag_a * mag_c))
-    return math.degrees(angle)
 
+class PlankDetector(BaseDetector):
+    exercise = "plank"
+    count_key = "plank_duration"
+    unit = "seconds"
+    accuracy_scale = 70 + 4
+    tunable_params = ("min_angle", "max_angle", "hold_threshold", "grace_sec", "angle_margin")
 
-class PlankDetector:
-    def __init__(self, min_angle=160, max_angle=200, hold_threshold=1.0):
-        self.pose = mp.solutions.pose.Pose()
+    def __init__(self, min_angle=160, max_angle=200, hold_threshold=1.0, grace_sec=0.5, angle_margin=5.0):
         self.min_angle = min_angle
         self.max_angle = max_angle
         self.hold_threshold = hold_threshold
-        self.last_good_posture_time = None
+        # Hysteresis: a lapse (or lost pose) shorter than grace_sec doesn't end
+        # a hold, and once in position the angle range widens by angle_margin
+        self.grace_sec = grace_sec
+        self.angle_margin = angle_margin
+        super().__init__()
+
+    def reset_state(self):
+        self.last_timestamp = None
+        # Video time the current stretch in position began, and the current
+        # lapse out of it; None when not in position / not in a lapse
+        self.good_since = None
+        self.bad_since = None
         self.total_plank_time = 0.0
-        self.valid_pose_frames = 0
-        self.total_frames = 0
-        self.fps = 30  # approximate
-
-    def detect(self, frame):
-        self.total_frames += 1
-        image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = self.pose.process(image_rgb)
-
-        if not results.pose_landmarks:
-            self.last_good_posture_time = None
-            return
-
-        self.valid_pose_frames += 1
-        lm = results.pose_landmarks.landmark
+        # Timeline entry per counted stretch of hold, with the body line's
+        # lowest and highest angle over it
+        self.holds = []
+        self._hold = None
 
-    # Get points
-        l_shoulder = [lm[11].x, lm[11].y]
-        l_hip = [lm[23].x, lm[23].y]
-        l_ankle = [lm[27].x, lm[27].y]
-        r_shoulder = [lm[12].x, lm[12].y]
-        r_hip = [lm[24].x, lm[24].y]
-        r_ankle = [lm[28].x, lm[28].y]
+    def features(self, seq):
+        y = seq.landmarks[:, :, 1]
 
-    # Angles
-        left_angle = calculate_angle(l_shoulder, l_hip, l_ankle)
-        right_angle = calculate_angle(r_shoulder, r_hip, r_ankle)
+        # Angles
+        left_angle = angle_series(seq, LEFT_SHOULDER, LEFT_HIP, LEFT_ANKLE)
+        right_angle = angle_series(seq, RIGHT_SHOULDER, RIGHT_HIP, RIGHT_ANKLE)
         avg_angle = (left_angle + right_angle) / 2
-        angle_good = self.min_angle <= avg_angle <= self.max_angle
-
-    # Y-alignment
-        left_y_aligned = abs(l_shoulder[1] - l_hip[1]) < 0.2 and abs(l_hip[1] - l_ankle[1]) < 0.2
-        right_y_aligned = abs(r_shoulder[1] - r_hip[1]) < 0.2 and abs(r_hip[1] - r_ankle[1]) < 0.2
-        aligned = left_y_aligned or right_y_aligned
-
-        current_time = time.time()
 
-        if aligned and angle_good:
-            if self.last_good_posture_time is None:
-                self.last_good_posture_time = current_time
-            else:
-                held_duration = current_time - self.last_good_posture_time
-                if held_duration >= self.hold_threshold:
-                    self.total_plank_time += current_time - self.prev_frame_time
-        else:
-            self.last_good_posture_time = None
-
-        self.prev_frame_time = current_time
-
-
-    def process_video(self, video_path):
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            print(json.dumps({"error": f"Cannot open video file: {video_path}"}))
+        # Y-alignment
+        left_y_aligned = (np.abs(y[:, LEFT_SHOULDER] - y[:, LEFT_HIP]) < 0.2) & \
+                         (np.abs(y[:, LEFT_HIP] - y[:, LEFT_ANKLE]) < 0.2)
+        right_y_aligned = (np.abs(y[:, RIGHT_SHOULDER] - y[:, RIGHT_HIP]) < 0.2) & \
+                          (np.abs(y[:, RIGHT_HIP] - y[:, RIGHT_ANKLE]) < 0.2)
+
+        # The angle range is checked per frame, since it depends on whether a hold is on
+        return {"aligned": left_y_aligned | right_y_aligned, "body_angle": avg_angle}
+
+    def update(self, valid, timestamp, aligned, body_angle):
+        # Video time rather than wall clock, and every rule in seconds rather
+        # than frames, so frame sampling and host speed don't change the hold.
+        # A change of posture is placed halfway between the two frames either
+        # side of it.
+        previous, self.last_timestamp = self.last_timestamp, timestamp
+        edge = timestamp if previous is None else (previous + timestamp) / 2
+
+        margin = self.angle_margin if self.good_since is not None else 0.0
+        if valid and aligned and self.min_angle - margin <= body_angle <= self.max_angle + margin:
+            if self.bad_since is not None and edge - self.bad_since >= self.grace_sec:
+                self._end_hold()
+            if self.good_since is None:
+                self.good_since = edge
+            self.bad_since = None
+            self._count(timestamp, body_angle)
+        elif self.good_since is not None:
+            if self.bad_since is None:
+                self.bad_since = edge
+            if timestamp - self.bad_since >= self.grace_sec:
+                self._end_hold()
+
+    def held_seconds(self):
+        # Video seconds of counted hold so far: the sum of hold_intervals
+        return round(self.total_plank_time, 2)
+
+    def _count(self, timestamp, body_angle):
+        # Hold time counts from hold_threshold into the stretch in position
+        counted_from = self.good_since + self.hold_threshold
+        if timestamp <= counted_from:
             return
-
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            self.detect(frame)
-
-        cap.release()
-        self.pose.close()
-
-        accuracy = (
-            self.valid_pose_frames / self.total_frames
-            if self.total_frames > 0 else 0
-        )
-
-        print(json.dumps({
-            "plank_duration": round(self.total_plank_time*5, 2),
-            "accuracy": round(accuracy*(70+4), 2)
-        }))
+        hold = self._hold
+        if hold is None:
+            hold = self._hold = {"start_frame": self.frame, "start": counted_from, "end": counted_from,
+                                 "min_angle": body_angle, "max_angle": body_angle}
+            self.holds.append(hold)
+        self.total_plank_time += timestamp - hold["end"]
+        hold["end_frame"] = self.frame
+        hold["end"] = timestamp
+        hold["min_angle"] = min(hold["min_angle"], body_angle)
+        hold["max_angle"] = max(hold["max_angle"], body_angle)
+
+    def _end_hold(self):
+        # Out of position for grace_sec or longer: the hold ran until the lapse began
+        hold = self._hold
+        if hold is not None and self.bad_since > hold["end"]:
+            self.total_plank_time += self.bad_since - hold["end"]
+            hold["end"] = self.bad_since
+        self._hold = None
+        self.good_since = None
+        self.bad_since = None
+
+    def _timeline(self):
+        timeline = []
+        for hold in self.holds:
+            # Straight body line scores 100, the edge of the allowed range 0
+            sag = max(abs(180 - hold["min_angle"]), abs(hold["max_angle"] - 180))
+            limit = max(180 - self.min_angle, self.max_angle - 180) or 1
+            timeline.append({
+                "start_frame": hold["start_frame"],
+                "end_frame": hold["end_frame"],
+                "start": round(hold["start"], 3),
+                "end": round(hold["end"], 3),
+                "min_angle": round(hold["min_angle"], 1),
+                "max_angle": round(hold["max_angle"], 1),
+                "duration": round(hold["end"] - hold["start"], 3),
+                "form": int(round(100 * ramp(sag, limit, 0))),
+            })
+        return timeline
+
+    def result(self, seq):
+        return {
+            "plank_duration": self.held_seconds(),
+            # [start, end] video time of each counted stretch of hold
+            "hold_intervals": [[round(hold["start"], 3), round(hold["end"], 3)] for hold in self.holds],
+            "timeline": self._timeline(),
+            "accuracy": self.accuracy(seq)
+        }
 
 
 if __name__ == "__main__":
@@ -112,10 +145,14 @@ if __name__ == "__main__":
     parser.add_argument("--min_angle", type=int, default=160)
     parser.add_argument("--max_angle", type=int, default=200)
     parser.add_argument("--hold_threshold", type=float, default=1.0)
+    parser.add_argument("--grace_sec", type=float, default=0.5)
+    parser.add_argument("--angle_margin", type=float, default=5.0)
+    add_sampling_args(parser)
     args = parser.parse_args()
 
     try:
-        detector = PlankDetector(args.min_angle, args.max_angle, args.hold_threshold)
-        detector.process_video(args.video)
+        detector = PlankDetector(args.min_angle, args.max_angle, args.hold_threshold, args.grace_sec, args.angle_margin)
+        print(json.dumps(detector.process_video(args.video, **sampling_kwargs(args))))
+        detector.close()
     except Exception as e:
         print(json.dumps({"error": str(e)}))
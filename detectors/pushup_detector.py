@@ -1,97 +1,64 @@
-import cv2
-import mediapipe as mp
-import math
-import sys
 import json
 import os
+import sys
 
-# Suppress TensorFlow and MediaPipe logs
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+import numpy as np
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detectors.base import (
+    BaseDetector, RepTracker, angle_series,
+    LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_ELBOW, LEFT_WRIST, LEFT_HIP, RIGHT_HIP, LEFT_ANKLE,
+)
+from detectors.frame_source import add_sampling_args, sampling_kwargs
 
-def calculate_angle(a, b, c):
-    a = [a[0] - b[0], a[1] - b[1]]
-    c = [c[0] - b[0], c[1] - b[1]]
-    dot_product = a[0] * c[0] + a[1] * c[1]
-    mag_a = math.hypot(a[0], a[1])
-    mag_c = math.hypot(c[0], c[1])
-    if mag_a * mag_c == 0:
-        return 0
-    angle = math.acos(dot_product / (mag_a * mag_c))
-    return math.degrees(angle)
 
+class PushUpDetector(BaseDetector):
+    exercise = "pushup"
+    count_key = "pushup_count"
+    accuracy_scale = 70 + 3
 
-class PushUpDetector:
-    def __init__(self):
-        self.pose = mp.solutions.pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+    def reset_state(self):
         self.counter = 0
         self.stage = "up"
-        self.total_frames = 0
-        self.valid_pose_frames = 0
-
-    def detect(self, frame):
-        self.total_frames += 1
-        image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = self.pose.process(image_rgb)
-
-        if results.pose_landmarks:
-            self.valid_pose_frames += 1
-            lm = results.pose_landmarks.landmark
-
-            # Left side keypoints
-            l_shoulder = [lm[11].x, lm[11].y]
-            l_elbow = [lm[13].x, lm[13].y]
-            l_wrist = [lm[15].x, lm[15].y]
-            l_hip = [lm[23].x, lm[23].y]
-            l_ankle = [lm[27].x, lm[27].y]
-
-            # Right side keypoints
-            r_shoulder = [lm[12].x, lm[12].y]
-            r_hip = [lm[24].x, lm[24].y]
-
-            # Elbow angle
-            elbow_angle = calculate_angle(l_shoulder, l_elbow, l_wrist)
-
-            # Loosened side facing and body flat checks
-            side_facing = abs(l_shoulder[0] - r_shoulder[0]) < 0.2 and abs(l_hip[0] - r_hip[0]) < 0.2
-            body_flat = abs(l_shoulder[1] - l_hip[1]) < 0.25 and abs(l_hip[1] - l_ankle[1]) < 0.25
-
-            if side_facing and body_flat:
-                # Detect push-up down and up transitions
-                if elbow_angle > 150 and self.stage == "down":
-                    self.stage = "up"
-                elif elbow_angle < 100 and self.stage == "up":
-                    self.stage = "down"
-                    self.counter += 1
-
-        else:
-            print("[Warning] No landmarks detected.", file=sys.stderr)
-
-
-    def process_video(self, video_path):
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            print(json.dumps({"error": f"Cannot open video file: {video_path}"}), file=sys.stdout)
+        self.rep_times = []
+        # Full depth at 80 degrees, full lockout at 170
+        self.reps = RepTracker(top=150, bottom=100, depth_full=80, lockout_full=170)
+
+    def features(self, seq):
+        x = seq.landmarks[:, :, 0]
+        y = seq.landmarks[:, :, 1]
+
+        # Loosened side facing and body flat checks
+        side_facing = (np.abs(x[:, LEFT_SHOULDER] - x[:, RIGHT_SHOULDER]) < 0.2) & \
+                      (np.abs(x[:, LEFT_HIP] - x[:, RIGHT_HIP]) < 0.2)
+        body_flat = (np.abs(y[:, LEFT_SHOULDER] - y[:, LEFT_HIP]) < 0.25) & \
+                    (np.abs(y[:, LEFT_HIP] - y[:, LEFT_ANKLE]) < 0.25)
+
+        return {
+            "elbow_angle": angle_series(seq, LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST),
+            "in_position": side_facing & body_flat,
+        }
+
+    def update(self, valid, timestamp, elbow_angle, in_position):
+        if not (valid and in_position):
             return
-
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            self.detect(frame)
-
-        cap.release()
-        self.pose.close()
-
-        accuracy = (
-            self.valid_pose_frames / self.total_frames
-            if self.total_frames > 0 else 0
-        )
-
-        print(json.dumps({
+        self.reps.update(self.frame, timestamp, elbow_angle)
+        # Detect push-up down and up transitions
+        if elbow_angle > 150 and self.stage == "down":
+            self.stage = "up"
+        elif elbow_angle < 100 and self.stage == "up":
+            self.stage = "down"
+            self.counter += 1
+            self.rep_times.append(round(timestamp, 3))
+
+    def result(self, seq):
+        return {
             "pushup_count": self.counter,
-            "accuracy": round(accuracy*(70+3), 2)
-        }))
+            "rep_times": self.rep_times,
+            # Counted on the way down, so a rep cut off at the bottom still has an entry
+            "timeline": self.reps.timeline(include_partial=True),
+            "accuracy": self.accuracy(seq)
+        }
 
 
 if __name__ == "__main__":
@@ -100,10 +67,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Push-Up Detector - Video Only")
     parser.add_argument("--video", "-v", required=True, help="Path to video file")
 
+    add_sampling_args(parser)
     args = parser.parse_args()
 
     try:
         detector = PushUpDetector()
-        detector.process_video(args.video)
+        print(json.dumps(detector.process_video(args.video, **sampling_kwargs(args))))
+        detector.close()
     except Exception as e:
         print(json.dumps({"error": str(e)}))
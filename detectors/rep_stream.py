@@ -0,0 +1,123 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from detectors.base import LandmarkSequence, NUM_LANDMARKS
+
+# Live rep counting from landmarks estimated on the client. A session is a
+# rule-only detector (no mediapipe graph is built) plus the last frame with a
+# pose, so one process can hold thousands of them.
+MAX_FRAMES_PER_BATCH = 300
+
+
+class _FrameTally:
+    # What detector.summarize() reads from a sequence: frame count, pose flags, duration
+    def __init__(self, frames, valid_frames, duration_sec):
+        self.length = frames
+        self.valid = np.arange(frames) < valid_frames
+        self.duration_sec = duration_sec
+
+    def __len__(self):
+        return self.length
+
+
+class RepStream:
+    """Runs one detector's state machine over landmarks as they arrive.
+
+    push() takes a batch of (timestamp, landmarks) frames in video time,
+    landmarks being 33 rows of x, y, z[, visibility] normalized to the frame,
+    or None where no pose was found. It returns the events the batch
+    produced: {"type": "rep", "count", "t"} per counted rep, or for plank
+    {"type": "hold", "seconds", "t"} each time the counted hold passes
+    another whole second, seconds being what result() would report as count.
+    """
+
+    def __init__(self, detector, fps=30.0, frame_width=0, frame_height=0):
+        self.detector = detector
+        self.fps = fps
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.frames = 0
+        self.valid_frames = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        # Last frame with a pose, replayed ahead of each batch so frame-to-frame
+        # features (jump) carry across batch boundaries
+        self._previous = None
+        detector.reset_state()
+
+    def _sequence(self, frames):
+        offset = 0 if self._previous is None else 1
+        count = offset + len(frames)
+        landmarks = np.zeros((count, NUM_LANDMARKS, 4), dtype=np.float32)
+        valid = np.zeros(count, dtype=bool)
+        timestamps = np.zeros(count, dtype=np.float64)
+        if self._previous is not None:
+            landmarks[0], timestamps[0] = self._previous
+            valid[0] = True
+
+        for i, (timestamp, points) in enumerate(frames, start=offset):
+            timestamps[i] = timestamp
+            if points is None:
+                continue
+            points = np.asarray(points, dtype=np.float32)
+            if points.shape not in ((NUM_LANDMARKS, 3), (NUM_LANDMARKS, 4)):
+                raise ValueError(f"landmarks must be {NUM_LANDMARKS} rows of x, y, z[, visibility]")
+            landmarks[i, :, :points.shape[1]] = points
+            if points.shape[1] == 3:
+                landmarks[i, :, 3] = 1.0
+            valid[i] = True
+
+        seq = LandmarkSequence.from_arrays(landmarks, valid, timestamps, self.fps, self.frame_width, self.frame_height)
+        return seq, offset
+
+    def push(self, frames):
+        if not frames:
+            return []
+        if len(frames) > MAX_FRAMES_PER_BATCH:
+            raise ValueError(f"At most {MAX_FRAMES_PER_BATCH} frames per batch")
+        timestamps = [float(timestamp) for timestamp, _ in frames]
+        previous = self.last_timestamp
+        for timestamp in timestamps:
+            if previous is not None and timestamp <= previous:
+                raise ValueError("Frame timestamps must increase")
+            previous = timestamp
+
+        detector = self.detector
+        seq, offset = self._sequence(list(zip(timestamps, (points for _, points in frames))))
+        reps_before = len(getattr(detector, "rep_times", ()))
+        holding = hasattr(detector, "held_seconds")
+        hold_before = int(detector.held_seconds()) if holding else 0
+
+        # Same per-frame replay as BaseDetector.analyze, minus the replayed frame
+        features = detector.features(seq)
+        columns = [seq.valid.tolist(), seq.timestamps.tolist()]
+        columns += [values.tolist() for values in features.values()]
+        for detector.frame, row in enumerate(list(zip(*columns))[offset:], start=self.frames):
+            detector.update(*row)
+
+        self.frames += len(frames)
+        self.valid_frames += int(seq.valid[offset:].sum())
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamps[0]
+        self.last_timestamp = timestamps[-1]
+        valid_rows = np.flatnonzero(seq.valid)
+        if len(valid_rows):
+            last = valid_rows[-1]
+            self._previous = (seq.landmarks[last].copy(), seq.timestamps[last])
+
+        events = []
+        rep_times = getattr(detector, "rep_times", None)
+        if rep_times is not None:
+            for count, timestamp in enumerate(rep_times[reps_before:], start=reps_before + 1):
+                events.append({"type": "rep", "count": count, "t": timestamp})
+        elif holding and int(detector.held_seconds()) > hold_before:
+            events.append({"type": "hold", "seconds": detector.held_seconds(), "t": round(self.last_timestamp, 3)})
+        return events
+
+    def result(self):
+        # Same output as process_video would give for the frames seen so far
+        duration = self.last_timestamp - self.first_timestamp + 1 / self.fps if self.frames else 0.0
+        return self.detector.summarize(_FrameTally(self.frames, self.valid_frames, duration))
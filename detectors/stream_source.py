@@ -0,0 +1,107 @@
+import io
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.upload_stream import read_marker
+
+POLL_SEC = 0.02
+IDLE_TIMEOUT_SEC = float(os.getenv("STREAM_IDLE_TIMEOUT", "30"))
+
+
+class GrowingFile(io.BufferedIOBase):
+    """Read-only view of a video that is still being uploaded.
+
+    Reads past the bytes written so far block until more data arrives or the
+    uploader drops its completion marker. FFmpeg only asks for the total size
+    (seek to end), which is answered from the expected Content-Length, so
+    demuxing starts on the first chunks for containers that keep their index
+    up front. For ones that don't (MP4 with moov at the end) FFmpeg simply
+    waits until that part arrives.
+
+    Errors cannot propagate through OpenCV's read callback, so they end the
+    stream and are kept in ``error`` for the caller to raise.
+    """
+
+    def __init__(self, path, expected_size=None, idle_timeout=IDLE_TIMEOUT_SEC):
+        self.path = path
+        self.expected_size = expected_size
+        self.idle_timeout = idle_timeout
+        self.error = None
+        self._file = open(path, "rb")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def _total_size(self):
+        if self.expected_size:
+            return self.expected_size
+        # Chunked upload without a length: nothing to do but wait for the end
+        return self.wait_complete()
+
+    def wait_complete(self):
+        last_size, last_progress = -1, time.time()
+        while True:
+            marker = read_marker(self.path)
+            if marker is not None:
+                if not marker["ok"]:
+                    self.error = IOError("Upload was aborted")
+                return os.path.getsize(self.path)
+            size = os.path.getsize(self.path)
+            if size != last_size:
+                last_size, last_progress = size, time.time()
+            elif time.time() - last_progress > self.idle_timeout:
+                self.error = IOError("Upload stalled")
+                return size
+            time.sleep(POLL_SEC)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            self._pos = self._total_size() + offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = offset
+        return self._pos
+
+    def read(self, size=-1):
+        last_progress = time.time()
+        while self.error is None:
+            self._file.seek(self._pos)
+            # Check the marker before reading: data written before it is final
+            marker = read_marker(self.path)
+            chunk = self._file.read(size)
+            if chunk:
+                self._pos += len(chunk)
+                return chunk
+            if marker is not None:
+                if not marker["ok"]:
+                    self.error = IOError("Upload was aborted")
+                return b""
+            if time.time() - last_progress > self.idle_timeout:
+                self.error = IOError("Upload stalled")
+                return b""
+            time.sleep(POLL_SEC)
+        return b""
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_capture(video_path, streaming=False, expected_size=None):
+    # Returns (cap, reader); reader is None unless the video is still arriving
+    if not streaming:
+        return cv2.VideoCapture(video_path), None
+    reader = GrowingFile(video_path, expected_size)
+    return cv2.VideoCapture(reader, cv2.CAP_FFMPEG, []), reader
@@ -0,0 +1,80 @@
+import json
+import os
+
+# The web process runs the upload job runner and creates the indexes
+os.environ.setdefault("JOB_RUNNER_ENABLED", "0")
+os.environ.setdefault("MONGO_ENSURE_INDEXES", "0")
+
+from flask import Flask, request
+from flask_sock import Sock
+from gevent import get_hub
+
+from app import (
+    get_user_stats, is_supported, new_detector, parse_analysis_options, parse_landmark_options, score_exercise,
+)
+from detectors.rep_stream import RepStream
+from utils import metrics
+
+# Live rep counting (/ws/reps) as a service of its own: the Procfile's `live`
+# process, with /ws/reps routed here and everything else to `web`. A session
+# holds its socket for the whole workout, so this runs under a gevent worker
+# where each one is a greenlet, not an OS thread: a worker holds up to
+# --worker-connections (1000) sessions and past that new connections wait in
+# the listen backlog. The web process stays on threaded workers because its
+# routes block (sqlite, detector calls, log scans) and would stall an event
+# loop; the blocking calls a session does make go to the hub's thread pool.
+app = Flask(__name__)
+metrics.install(app)
+sock = Sock(app)
+
+
+def _blocking(fn, *args):
+    # Runs fn on a thread-pool thread while this session's greenlet waits, so
+    # counting a big batch or logging the workout doesn't stall other sessions
+    return get_hub().threadpool.apply(fn, args)
+
+
+@sock.route('/ws/reps')
+def live_reps(ws):
+    """Count reps live from landmarks the client estimates on-device.
+
+    Query: exercise, user_id, fps, frame_height (needed for jump) and
+    optional params. The client sends {"frames": [{"t": seconds, "landmarks":
+    [[x, y, z, visibility], ...33 rows] or null}, ...]} as often as it likes
+    and gets {"type": "rep"} / {"type": "hold"} events back for each batch.
+    {"type": "end"} scores and logs the workout and returns {"type": "result"}.
+    """
+    def send(message):
+        ws.send(json.dumps(message))
+
+    ex_type = request.args.get('exercise')
+    user_id = request.args.get('user_id') or "1"  # fallback for now
+    if not ex_type or not is_supported(ex_type):
+        return send({'type': 'error', 'message': 'Invalid workout type'})
+    try:
+        fps, frame_width, frame_height = parse_landmark_options(request.args, ex_type)
+        params = parse_analysis_options(request.args, [ex_type]).get('params', {})
+        # Rules only: the Pose graph is never built for a live session
+        detector = new_detector(ex_type)
+        detector.configure(**params)
+    except ValueError as e:
+        return send({'type': 'error', 'message': str(e)})
+
+    stream = RepStream(detector, fps, frame_width, frame_height)
+    send({'type': 'ready', 'exercise': ex_type})
+    while True:
+        try:
+            message = json.loads(ws.receive())
+            if message.get('type') == 'end':
+                break
+            frames = [(frame['t'], frame.get('landmarks')) for frame in message.get('frames', [])]
+            events = _blocking(stream.push, frames)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            send({'type': 'error', 'message': str(e)})
+            continue
+        for event in events:
+            send({**event, 'exercise': ex_type})
+
+    user_weight_kg = _blocking(get_user_stats, user_id).get("weight") or 70
+    result = _blocking(score_exercise, user_id, ex_type, stream.result(), user_weight_kg)
+    send({'type': 'result', 'exercise': ex_type, **result})
@@ -0,0 +1,148 @@
+import os
+import sys
+import threading
+import time
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.log import get_logger
+from models.user_data import (
+    db, users, progress, daily_activity, exercise_results, LEADERBOARD_SORT_FIELDS, _leaderboard_pipeline,
+)
+
+log = get_logger("indexes")
+
+# ensure_indexes_in_background retries a failed bootstrap after this long
+ENSURE_RETRY_SEC = float(os.getenv("MONGO_ENSURE_INDEXES_RETRY_SEC", "60"))
+
+# Every query in models/user_data.py should be served by one of these
+INDEXES = {
+    users: [
+        # login/register; sparse because users created by a stats upsert
+        # have no email and must not collide on null
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True, sparse=True),
+        # Not unique until the exercise_results migration has run
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ] + [
+        IndexModel([(field, DESCENDING)], name=f"leaderboard_{field}")
+        for field in LEADERBOARD_SORT_FIELDS
+    ],
+    exercise_results: [
+        IndexModel([("user_id", ASCENDING), ("exercise", ASCENDING), ("level", ASCENDING)],
+                   name="user_exercise_level_unique", unique=True),
+    ],
+    progress: [
+        IndexModel([("user_id", ASCENDING), ("timestamp", ASCENDING)], name="user_timestamp"),
+    ],
+    # PROGRESS_STORE=mongo: today's progress expires on its own
+    db["daily_progress"]: [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    daily_activity: [
+        IndexModel([("user_id", ASCENDING), ("date", DESCENDING)], name="user_date_unique", unique=True),
+        # Weekly XP leaderboard
+        IndexModel([("date", ASCENDING)], name="date"),
+    ],
+}
+
+
+def ensure_indexes():
+    # create_indexes is a no-op for indexes that already exist, so this is
+    # safe on every start; a failure on one collection doesn't stop the rest
+    errors = {}
+    for collection, models in INDEXES.items():
+        try:
+            collection.create_indexes(models)
+        except PyMongoError as e:
+            errors[collection.name] = str(e)
+            log.error("Creating indexes on %s failed: %s", collection.name, e)
+    return errors
+
+
+def ensure_indexes_in_background(retry_sec=ENSURE_RETRY_SEC):
+    # For app startup: each create_index can wait out the server-selection
+    # timeout when Mongo is unreachable, which must not hold up worker boot
+    def run():
+        while ensure_indexes():
+            log.warning("Index bootstrap incomplete, retrying in %.0fs", retry_sec)
+            time.sleep(retry_sec)
+        log.info("Indexes are in place")
+
+    threading.Thread(target=run, name="ensure-indexes", daemon=True).start()
+
+
+def _repository_queries():
+    # (description, explain command) for each query shape the app runs
+    sample_user = "plan-check@example.com"
+    finds = [
+        ("users by user_id", users, {"user_id": sample_user}, None),
+        ("users by email", users, {"email": sample_user}, None),
+        ("exercise result upsert", exercise_results, {"user_id": sample_user, "exercise": "squat", "level": "Level1"}, None),
+        ("progress by user in time order", progress, {"user_id": sample_user}, {"timestamp": 1}),
+        ("progress backfill scan", progress, {}, {"user_id": 1, "timestamp": 1}),
+        ("daily activity page", daily_activity, {"user_id": sample_user, "date": {"$lt": "9999-12-31"}}, {"date": -1}),
+    ]
+    for name, collection, query, sort in finds:
+        command = {"find": collection.name, "filter": query}
+        if sort:
+            command["sort"] = sort
+        yield name, command
+    for field in LEADERBOARD_SORT_FIELDS:
+        yield f"leaderboard by {field}", {
+            "aggregate": users.name, "pipeline": _leaderboard_pipeline(10, field), "cursor": {},
+        }
+        yield f"rank by {field}", {
+            "count": users.name, "query": {field: {"$gt": 0}, "email": {"$exists": True}, "name": {"$exists": True}},
+        }
+    yield "weekly xp leaderboard", {
+        "aggregate": daily_activity.name, "pipeline": [{"$match": {"date": {"$gte": "2000-01-01"}}}], "cursor": {},
+    }
+
+
+def _collscans(plan):
+    # Walks an explain document; yields COLLSCAN stages of winning plans only
+    if isinstance(plan, dict):
+        for key, value in plan.items():
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and value == "COLLSCAN":
+                yield plan
+            else:
+                yield from _collscans(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _collscans(item)
+
+
+def check_query_plans():
+    """Explain every repository query and return the ones planned as COLLSCAN.
+
+    Meant to run against a local mongod with the indexes in place, e.g.
+    ``MONGO_URI=mongodb://localhost:27017/ python -m models.indexes check``.
+    """
+    failures = []
+    for name, command in _repository_queries():
+        explain = db.command({"explain": command, "verbosity": "queryPlanner"})
+        if any(True for _ in _collscans(explain)):
+            failures.append(name)
+    return failures
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Create the Mongo indexes or check query plans against them")
+    parser.add_argument("command", choices=["ensure", "check"])
+    args = parser.parse_args()
+
+    errors = ensure_indexes()
+    if errors:
+        sys.exit(1)
+    if args.command == "check":
+        failures = check_query_plans()
+        for name in failures:
+            print(f"COLLSCAN: {name}")
+        print(f"{len(failures)} of {len(list(_repository_queries()))} queries scan a whole collection")
+        sys.exit(1 if failures else 0)
+    print("Indexes are in place")
@@ -0,0 +1,182 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+# Local SQLite queue for video analysis jobs, so they survive a restart and
+# any web worker on this host can pick them up.
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    exercise TEXT NOT NULL,
+    video_path TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+_initialized = set()
+
+
+def _connect():
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if JOB_DB_PATH not in _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _initialized.add(JOB_DB_PATH)
+    return conn
+
+
+def _to_dict(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["options"] = json.loads(job["options"] or "{}")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def create_job(user_id, exercise, video_path, options=None):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, user_id, exercise, video_path, options, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, user_id, exercise, video_path, json.dumps(options or {}), QUEUED, now, now),
+        )
+    finally:
+        conn.close()
+    return job_id
+
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return _to_dict(row)
+
+
+def claim_next_job():
+    # BEGIN IMMEDIATE takes the write lock up front, so two runners can
+    # never claim the same queued row.
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, started_at = ?, updated_at = ?, attempts = attempts + 1 WHERE id = ?",
+            (RUNNING, now, now, row["id"]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    job = _to_dict(row)
+    job["status"] = RUNNING
+    job["started_at"] = job["updated_at"] = now
+    job["attempts"] += 1
+    return job
+
+
+def update_queued_job_options(job_id, **options):
+    # Only while nobody has started the job, so a runner never sees options change
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT options FROM jobs WHERE id = ? AND status = ?", (job_id, QUEUED)).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return False
+        merged = {**json.loads(row["options"] or "{}"), **options}
+        conn.execute("UPDATE jobs SET options = ?, updated_at = ? WHERE id = ?", (json.dumps(merged), time.time(), job_id))
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def touch_job(job_id):
+    # Heartbeat from the runner working on it, so requeue_stale_jobs leaves it be
+    conn = _connect()
+    try:
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING))
+    finally:
+        conn.close()
+
+
+def finish_job(job_id, result):
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+            (DONE, json.dumps(result), now, now, job_id),
+        )
+    finally:
+        conn.close()
+
+
+def fail_job(job_id, error):
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+            (FAILED, str(error), now, now, job_id),
+        )
+    finally:
+        conn.close()
+
+
+def requeue_stale_jobs(stale_after_sec, max_attempts=3):
+    # Jobs left "running" by a worker that died (restart, crash) go back to
+    # the queue; ones that keep failing this way are given up on.
+    cutoff = time.time() - stale_after_sec
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = 'Gave up after repeated interruptions', finished_at = ? "
+            "WHERE status = ? AND updated_at < ? AND attempts >= ?",
+            (FAILED, time.time(), RUNNING, cutoff, max_attempts),
+        )
+        cur = conn.execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+            (QUEUED, time.time(), RUNNING, cutoff),
+        )
+        return cur.rowcount
+    finally:
+        conn.close()
@@ -0,0 +1,229 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.user_data import (
+    users, daily_activity, LEADERBOARD_SORT_FIELDS, _leaderboard_pipeline, add_stats_listener,
+)
+
+# Top-N per metric kept in memory and served without touching Mongo. Stats
+# writes in this process update it right away; writes from other processes
+# show up at the next reconcile, which rebuilds it from Mongo. Weekly XP is
+# also kept for every eligible user active this week, to rank those below
+# the top-N.
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "100"))
+RECONCILE_SEC = float(os.getenv("LEADERBOARD_RECONCILE_SEC", "300"))
+
+WEEKLY_XP = "weekly_xp"
+METRICS = LEADERBOARD_SORT_FIELDS + (WEEKLY_XP,)
+
+_PROFILE_FIELDS = {"_id": 0, "user_id": 1, "name": 1, "total_xp": 1, "total_score": 1, "level": 1,
+                   "workouts_completed": 1, "total_reps": 1}
+# Same eligibility as the Mongo leaderboard query: accounts with a profile
+_ELIGIBLE = {"email": {"$exists": True}, "name": {"$exists": True}}
+
+
+def _week_start(now=None):
+    today = (now or datetime.utcnow()).date()
+    return (today - timedelta(days=today.weekday())).strftime("%Y-%m-%d")
+
+
+class Leaderboard:
+    def __init__(self, size=LEADERBOARD_SIZE, reconcile_sec=RECONCILE_SEC):
+        self.size = size
+        self.reconcile_sec = reconcile_sec
+        self._lock = threading.Lock()
+        # Held for a whole reconcile, so only one thread reads Mongo for it
+        self._reconcile_lock = threading.Lock()
+        self._reconciling = False
+        # Candidates: everybody in some metric's top-N plus recently active users
+        self._profiles = {}
+        self._rankings = {}
+        # This week's XP of every eligible user active this week, and the same
+        # values sorted, so a rank below the top-N is a bisect
+        self._weekly = {}
+        self._weekly_sorted = []
+        self._dirty = set()
+        self._weekly_dirty = set()
+        self._week = None
+        self._reconciled_at = 0.0
+
+    def on_stats_change(self, user_id, doc=None):
+        # doc is the user's document after the update when the writer has it
+        with self._lock:
+            if doc is not None and "email" in doc and "name" in doc:
+                profile = self._profiles.setdefault(user_id, {WEEKLY_XP: 0})
+                profile.update({k: doc.get(k) for k in _PROFILE_FIELDS if k != "_id"})
+                self._rankings.clear()
+                if self._reconciling:
+                    # The reconcile may have read the user before this write
+                    self._dirty.add(user_id)
+            else:
+                self._dirty.add(user_id)
+            self._weekly_dirty.add(user_id)
+
+    def _weekly_totals(self, week, user_ids=None):
+        match = {"date": {"$gte": week}}
+        if user_ids is not None:
+            match["user_id"] = {"$in": list(user_ids)}
+        pipeline = [{"$match": match}, {"$group": {"_id": "$user_id", "xp": {"$sum": "$xp"}}}]
+        return {doc["_id"]: doc["xp"] for doc in daily_activity.aggregate(pipeline)}
+
+    def _fetch_profiles(self, user_ids):
+        query = {"user_id": {"$in": list(user_ids)}, **_ELIGIBLE}
+        return {doc["user_id"]: doc for doc in users.find(query, _PROFILE_FIELDS)}
+
+    def _eligible(self, user_ids):
+        query = {"user_id": {"$in": list(user_ids)}, **_ELIGIBLE}
+        return {doc["user_id"] for doc in users.find(query, {"_id": 0, "user_id": 1})}
+
+    def _load(self, week):
+        # All reads of a reconcile; runs without self._lock held
+        profiles = {}
+        for metric in LEADERBOARD_SORT_FIELDS:
+            for doc in users.aggregate(_leaderboard_pipeline(self.size, metric)):
+                profiles[doc["user_id"]] = doc
+        weekly = self._weekly_totals(week)
+        eligible = self._eligible(weekly)
+        weekly = {user_id: xp for user_id, xp in weekly.items() if user_id in eligible}
+        top_weekly = sorted(weekly, key=lambda user_id: (-weekly[user_id], user_id))[:self.size]
+        missing = set(top_weekly) - set(profiles)
+        if missing:
+            profiles.update(self._fetch_profiles(missing))
+        for user_id, profile in profiles.items():
+            profile[WEEKLY_XP] = weekly.get(user_id, 0)
+        return profiles, weekly
+
+    def _reconcile(self, week):
+        with self._lock:
+            self._reconciling = True
+            # The reads below cover every change marked so far
+            self._dirty.clear()
+            self._weekly_dirty.clear()
+        try:
+            profiles, weekly = self._load(week)
+        finally:
+            with self._lock:
+                self._reconciling = False
+
+        with self._lock:
+            self._profiles = profiles
+            self._rankings = {}
+            self._weekly = weekly
+            self._weekly_sorted = sorted(weekly.values())
+            self._week = week
+            self._reconciled_at = time.time()
+
+    def _due(self, week):
+        return self._week != week or time.time() - self._reconciled_at > self.reconcile_sec
+
+    def _refresh(self):
+        # Called without the lock. A due reconcile rebuilds from Mongo outside
+        # self._lock, so lookups keep being served meanwhile from the current
+        # candidates; only when those are from another week (or there are none
+        # yet) do callers wait for it.
+        week = _week_start()
+        with self._lock:
+            due, stale = self._due(week), self._week != week
+        if due and self._reconcile_lock.acquire(blocking=stale):
+            try:
+                with self._lock:
+                    due = self._due(week)
+                if due:
+                    self._reconcile(week)
+            finally:
+                self._reconcile_lock.release()
+
+    def _set_weekly(self, user_id, xp):
+        old = self._weekly.get(user_id)
+        if old is not None:
+            del self._weekly_sorted[bisect.bisect_left(self._weekly_sorted, old)]
+        self._weekly[user_id] = xp
+        bisect.insort(self._weekly_sorted, xp)
+
+    def _update(self):
+        # Called with the lock held: apply this process's writes since the last
+        # look, a few indexed reads for the users they touched
+        if self._dirty:
+            for user_id, doc in self._fetch_profiles(self._dirty).items():
+                self._profiles.setdefault(user_id, {WEEKLY_XP: 0}).update(doc)
+            self._weekly_dirty |= self._dirty
+            self._dirty.clear()
+            self._rankings = {}
+        if self._weekly_dirty:
+            weekly = self._weekly_totals(self._week, self._weekly_dirty)
+            unknown = {user_id for user_id in self._weekly_dirty
+                       if user_id not in self._weekly and user_id not in self._profiles}
+            eligible = self._weekly_dirty - unknown
+            if unknown:
+                eligible |= self._eligible(unknown)
+            for user_id in eligible:
+                self._set_weekly(user_id, weekly.get(user_id, 0))
+                if user_id in self._profiles:
+                    self._profiles[user_id][WEEKLY_XP] = weekly.get(user_id, 0)
+            self._weekly_dirty.clear()
+            self._rankings = {}
+
+    def _ranking(self, metric):
+        ranking = self._rankings.get(metric)
+        if ranking is None:
+            ranking = sorted(
+                self._profiles.values(),
+                key=lambda p: (-(p.get(metric) or 0), p.get("user_id")),
+            )[:self.size]
+            self._rankings[metric] = ranking
+        return ranking
+
+    def top(self, metric, limit=10):
+        if metric not in METRICS:
+            raise ValueError(f"sort_by must be one of {', '.join(METRICS)}")
+        self._refresh()
+        with self._lock:
+            self._update()
+            return [
+                {"user_id": p.get("user_id"), "name": p.get("name"), **{m: p.get(m) or 0 for m in METRICS}}
+                for p in self._ranking(metric)[:limit]
+            ]
+
+    def rank(self, metric, user_id):
+        """Return {"rank", "value"} for user_id, or None if they aren't ranked.
+
+        Inside the cached top-N this is a lookup. Below it, weekly_xp is a
+        bisect over the cached weekly totals; the other metrics are one
+        indexed read and one indexed count.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"sort_by must be one of {', '.join(METRICS)}")
+        self._refresh()
+        with self._lock:
+            self._update()
+            ranking = self._ranking(metric)
+            for position, profile in enumerate(ranking, start=1):
+                if profile.get("user_id") == user_id:
+                    return {"rank": position, "value": profile.get(metric) or 0}
+            if metric == WEEKLY_XP:
+                value = self._weekly.get(user_id)
+                if value is not None:
+                    return {"rank": len(self._weekly_sorted) - bisect.bisect_right(self._weekly_sorted, value) + 1,
+                            "value": value}
+                # No XP this week: behind everybody who has some
+                ahead = len(self._weekly_sorted) - bisect.bisect_right(self._weekly_sorted, 0)
+
+        if metric == WEEKLY_XP:
+            if not users.count_documents({"user_id": user_id, **_ELIGIBLE}, limit=1):
+                return None
+            return {"rank": ahead + 1, "value": 0}
+        doc = users.find_one({"user_id": user_id, **_ELIGIBLE}, {"_id": 0, metric: 1})
+        if doc is None:
+            return None
+        value = doc.get(metric) or 0
+        ahead = users.count_documents({metric: {"$gt": value}, **_ELIGIBLE})
+        return {"rank": ahead + 1, "value": value}
+
+
+board = Leaderboard()
+add_stats_listener(board.on_stats_change)
@@ -0,0 +1,92 @@
+import bisect
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# Level N needs int(xp_base * N ** xp_exponent) more XP than level N-1, and
+# score_step * N more score. Defaults come from the environment; overrides
+# saved with user_data.save_level_curve apply on top and reach every process
+# at its next load_level_curve.
+LevelCurve = namedtuple("LevelCurve", "max_level xp_base xp_exponent score_step")
+
+_curve = LevelCurve(
+    max_level=int(os.getenv("LEVEL_MAX", "30")),
+    xp_base=float(os.getenv("LEVEL_XP_BASE", "100")),
+    xp_exponent=float(os.getenv("LEVEL_XP_EXPONENT", "1.5")),
+    score_step=int(os.getenv("LEVEL_SCORE_STEP", "50")),
+)
+
+
+def get_curve():
+    return _curve
+
+
+def curve_with(**changes):
+    # The current curve with changes applied, checked but not installed
+    unknown = set(changes) - set(LevelCurve._fields)
+    if unknown:
+        raise ValueError(f"Unknown level curve fields: {', '.join(sorted(unknown))}")
+    curve = _curve._replace(**{name: type(getattr(_curve, name))(value) for name, value in changes.items()})
+    if curve.max_level < 1 or curve.xp_base <= 0 or curve.score_step < 0:
+        raise ValueError("max_level must be at least 1, xp_base positive and score_step not negative")
+    return curve
+
+
+def set_curve(**changes):
+    # Tables are cached per curve, so the next lookup builds the new one
+    global _curve
+    _curve = curve_with(**changes)
+    return _curve
+
+
+@lru_cache(maxsize=16)
+def _xp_thresholds(levels, xp_base, xp_exponent):
+    # thresholds[i] = total XP needed to finish level i + 1
+    total, thresholds = 0, []
+    for level in range(1, levels + 1):
+        total += int(xp_base * (level ** xp_exponent))
+        thresholds.append(total)
+    return tuple(thresholds), np.array(thresholds, dtype=np.int64)
+
+
+def _thresholds(levels, curve=None):
+    curve = curve or _curve
+    return _xp_thresholds(max(levels, curve.max_level), curve.xp_base, curve.xp_exponent)
+
+
+def level_from_xp(xp, max_level=None):
+    max_level = max_level or _curve.max_level
+    table, _ = _thresholds(max_level)
+    # Number of finished levels, capped; the curve never reports below level 1
+    finished = bisect.bisect_right(table, xp, 0, max_level)
+    return max(finished, 1)
+
+
+def levels_from_xp(xp, max_level=None):
+    # Vectorized level_from_xp for recomputing many users at once
+    max_level = max_level or _curve.max_level
+    _, table = _thresholds(max_level)
+    finished = np.searchsorted(table[:max_level], np.asarray(xp), side="right")
+    return np.maximum(finished, 1)
+
+
+def xp_thresholds(max_level=None):
+    # Cumulative XP per level as a plain list, e.g. to embed in a Mongo expression
+    max_level = max_level or _curve.max_level
+    table, _ = _thresholds(max_level)
+    return list(table[:max_level])
+
+
+def max_xp_for_level(level):
+    if level <= 0:
+        return 0
+    table, _ = _thresholds(level)
+    return table[level - 1]
+
+
+def max_score_for_level(level):
+    if level <= 0:
+        return 0
+    return _curve.score_step * level * (level + 1) // 2
@@ -0,0 +1,234 @@
+import os
+import sys
+import threading
+import time
+import uuid
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.user_data import (
+    db, users, exercise_results, normalize_all_users, NORMALIZE_BATCH_SIZE, _result_update, _stats_update,
+)
+
+# One state document per background migration: status, checkpoint and
+# throughput. It lives in Mongo so any web worker can report on a run, and
+# a run whose process died can be resumed from its last checkpoint.
+migrations = db["migrations"]
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+NORMALIZE_USERS = "normalize_users"
+EXERCISE_RESULTS = "exercise_results"
+# A running migration that hasn't checkpointed for this long is presumed dead
+STALE_AFTER_SEC = float(os.getenv("MIGRATION_STALE_SEC", "120"))
+# The pseudo-user _ids already merged into a document, so a page replayed
+# after a crash doesn't add them twice; removed once the migration is done
+MIGRATED_FROM = "migrated_from"
+
+
+class _Superseded(Exception):
+    pass
+
+
+def get_migration(name):
+    return migrations.find_one({"_id": name})
+
+
+def _checkpoint(name, run_id, started, **fields):
+    elapsed = time.time() - started
+    fields.update(heartbeat_at=time.time(), elapsed_sec=round(elapsed, 2))
+    if "run_processed" in fields:
+        fields["docs_per_sec"] = round(fields["run_processed"] / elapsed, 1) if elapsed > 0 else None
+    result = migrations.update_one({"_id": name, "run_id": run_id}, {"$set": fields})
+    if result.matched_count == 0:
+        # Another process took the migration over (we were presumed dead)
+        raise _Superseded()
+
+
+def move_exercise_results(batch_size=NORMALIZE_BATCH_SIZE, start_after=None, on_batch=None):
+    """Move the per-exercise pseudo-user documents out of users.
+
+    Each one becomes an exercise_results row. Most are then deleted. A
+    pseudo-user that the stats updates had been landing on (it has
+    total_xp) is folded into the user's real document. If there is no
+    real document, it is turned into one by dropping the workout fields.
+    Same paging and callback contract as normalize_all_users.
+
+    Safe to resume from any checkpoint: a page is replayed from its start,
+    and the increments it makes into exercise_results and real users skip
+    documents already tagged with the pseudo-user's _id (MIGRATED_FROM).
+    """
+    processed = 0
+    last_id = start_after
+    while True:
+        query = {"exercise": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        page = list(users.find(query).sort("_id", 1).limit(batch_size))
+        if not page:
+            break
+
+        user_ids = list({doc.get("user_id") for doc in page})
+        real = {
+            doc["user_id"]: doc["_id"]
+            for doc in users.find({"user_id": {"$in": user_ids}, "exercise": {"$exists": False}}, {"user_id": 1})
+        }
+        created, results, user_ops = [], [], []
+        for doc in page:
+            key, update = _result_update(doc)
+            # Not an upsert with the tag filter: on a replay that would insert
+            # a second row. Create missing rows first, then apply tagged updates.
+            created.append(UpdateOne(key, {"$setOnInsert": key}, upsert=True))
+            update["$push"] = {MIGRATED_FROM: doc["_id"]}
+            results.append(UpdateOne({**key, MIGRATED_FROM: {"$ne": doc["_id"]}}, update))
+
+            if "total_xp" not in doc:
+                user_ops.append(DeleteOne({"_id": doc["_id"]}))
+            elif doc.get("user_id") in real:
+                merged = {"$concatArrays": [{"$ifNull": ["$" + MIGRATED_FROM, []]}, [doc["_id"]]]}
+                user_ops += [
+                    UpdateOne({"_id": real[doc["user_id"]], MIGRATED_FROM: {"$ne": doc["_id"]}}, _stats_update(
+                        doc.get("total_score", 0), doc.get("total_xp", 0),
+                        completed=doc.get("workouts_completed", 0), reps=doc.get("total_reps", 0),
+                        calories=doc.get("calories", 0), played_dates=doc.get("played_dates", []),
+                    ) + [{"$set": {MIGRATED_FROM: merged}}]),
+                    DeleteOne({"_id": doc["_id"]}),
+                ]
+            else:
+                # The stats pipeline recomputes level, which was the exercise level here
+                unset = ["exercise", "date", "xp", "reps", "completed", "timestamp"]
+                if not isinstance(doc.get("score"), dict):
+                    unset.append("score")
+                user_ops.append(UpdateOne({"_id": doc["_id"]}, [{"$project": {field: 0 for field in unset}}] + _stats_update()))
+                real[doc.get("user_id")] = doc["_id"]
+
+        exercise_results.bulk_write(created, ordered=False)
+        exercise_results.bulk_write(results, ordered=False)
+        # Ordered: a merge must land before the pseudo-user is deleted
+        users.bulk_write(user_ops, ordered=True)
+        processed += len(page)
+        last_id = page[-1]["_id"]
+        if on_batch:
+            on_batch(last_id, processed)
+
+    # Every page is in: nothing will be replayed any more
+    for collection in (exercise_results, users):
+        collection.update_many({MIGRATED_FROM: {"$exists": True}}, {"$unset": {MIGRATED_FROM: ""}})
+    # Only needed for the old pseudo-user upserts
+    try:
+        users.drop_index("user_exercise_level")
+    except OperationFailure:
+        pass
+    return processed
+
+
+# name -> fn(batch_size, start_after=None, on_batch=None) returning a count
+MIGRATIONS = {
+    NORMALIZE_USERS: normalize_all_users,
+    EXERCISE_RESULTS: move_exercise_results,
+}
+# name -> the users each one goes through, for its progress total
+MIGRATION_FILTERS = {
+    NORMALIZE_USERS: {},
+    EXERCISE_RESULTS: {"exercise": {"$exists": True}},
+}
+
+
+def _run(name, run_id, start_after, already_processed, batch_size):
+    started = time.time()
+
+    def on_batch(last_id, processed):
+        _checkpoint(name, run_id, started, last_id=last_id,
+                    processed=already_processed + processed, run_processed=processed)
+
+    try:
+        processed = MIGRATIONS[name](batch_size, start_after=start_after, on_batch=on_batch)
+        _checkpoint(name, run_id, started, status=DONE, finished_at=time.time(),
+                    processed=already_processed + processed, run_processed=processed)
+    except _Superseded:
+        pass
+    except Exception as e:
+        try:
+            _checkpoint(name, run_id, started, status=FAILED, error=str(e), finished_at=time.time())
+        except _Superseded:
+            pass
+
+
+def start_migration(name, batch_size=None, restart=False):
+    """Start a migration in a background thread and return its state.
+
+    An interrupted or failed run resumes after its last checkpoint unless
+    restart is set. If a run is already in progress, its state is returned
+    instead of starting a second one.
+    """
+    state = get_migration(name)
+    if state and state["status"] == RUNNING and time.time() - state["heartbeat_at"] < STALE_AFTER_SEC:
+        return state
+
+    resume = state is not None and state["status"] != DONE and not restart
+    # What is left to go through, plus what earlier runs already did
+    remaining = dict(MIGRATION_FILTERS[name])
+    if resume and state.get("last_id") is not None:
+        remaining["_id"] = {"$gt": state["last_id"]}
+    new_state = {
+        "_id": name,
+        "run_id": uuid.uuid4().hex,
+        "status": RUNNING,
+        "started_at": time.time(),
+        "heartbeat_at": time.time(),
+        "finished_at": None,
+        "error": None,
+        "last_id": state.get("last_id") if resume else None,
+        "processed": state.get("processed", 0) if resume else 0,
+        "run_processed": 0,
+        "total": (state.get("processed", 0) if resume else 0) + users.count_documents(remaining),
+        "docs_per_sec": None,
+        "elapsed_sec": 0,
+        "resumed": resume,
+    }
+    # Claim it: conditional on the state we read, so two workers racing to
+    # start the same migration can't both win
+    try:
+        if state is None:
+            migrations.insert_one(new_state)
+        elif migrations.replace_one({"_id": name, "run_id": state["run_id"]}, new_state).matched_count == 0:
+            return get_migration(name)
+    except DuplicateKeyError:
+        return get_migration(name)
+
+    threading.Thread(
+        target=_run,
+        args=(name, new_state["run_id"], new_state["last_id"], new_state["processed"], batch_size or NORMALIZE_BATCH_SIZE),
+        name=f"migration-{name}",
+        daemon=True,
+    ).start()
+    return new_state
+
+
+def migration_status(state):
+    # JSON-friendly view of a state document
+    return {
+        "job_id": state["run_id"],
+        "name": state["_id"],
+        **{k: v for k, v in state.items() if k not in ("_id", "run_id", "last_id")},
+        "last_id": str(state["last_id"]) if state.get("last_id") is not None else None,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a data migration in the foreground")
+    parser.add_argument("name", choices=sorted(MIGRATIONS))
+    parser.add_argument("--batch_size", type=int, default=NORMALIZE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    started = time.time()
+    count = MIGRATIONS[args.name](
+        args.batch_size,
+        on_batch=lambda last_id, processed: print(f"{processed} documents, {processed / (time.time() - started):.0f}/s"),
+    )
+    print(f"Migrated {count} documents")
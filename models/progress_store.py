@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Today's XP and completed exercises per user, shared by every worker
+# process. Counters are keyed by UTC day, so they reset at midnight, and
+# rows for past days are evicted after PROGRESS_TTL_DAYS.
+PROGRESS_STORE = os.getenv("PROGRESS_STORE", "sqlite")
+PROGRESS_DB_PATH = os.getenv("PROGRESS_DB_PATH", "progress.db")
+PROGRESS_TTL_DAYS = int(os.getenv("PROGRESS_TTL_DAYS", "2"))
+# SQLite only: sweep expired rows every this many writes
+EVICT_EVERY = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_progress (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    total_xp REAL NOT NULL DEFAULT 0,
+    completed_exercises INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, day)
+);
+CREATE INDEX IF NOT EXISTS daily_progress_day ON daily_progress (day);
+"""
+
+
+def _today():
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def _empty():
+    return {"total_xp": 0, "completed_exercises": 0}
+
+
+class SQLiteProgressStore:
+    """Single-host store: one SQLite file shared by the workers on it."""
+
+    def __init__(self, path=PROGRESS_DB_PATH, ttl_days=PROGRESS_TTL_DAYS):
+        self.path = path
+        self.ttl_days = ttl_days
+        self._writes = 0
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._initialized = True
+        return conn
+
+    def add(self, user_id, xp=0, completed=False):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO daily_progress (user_id, day, total_xp, completed_exercises, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, day) DO UPDATE SET "
+                "total_xp = total_xp + excluded.total_xp, "
+                "completed_exercises = completed_exercises + excluded.completed_exercises, "
+                "updated_at = excluded.updated_at",
+                (user_id, _today(), xp, 1 if completed else 0, time.time()),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(conn)
+        finally:
+            conn.close()
+
+    def get(self, user_id):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT total_xp, completed_exercises FROM daily_progress WHERE user_id = ? AND day = ?",
+                (user_id, _today()),
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return _empty()
+        total_xp = row["total_xp"]
+        return {"total_xp": int(total_xp) if total_xp == int(total_xp) else total_xp,
+                "completed_exercises": row["completed_exercises"]}
+
+    def _evict(self, conn):
+        cutoff = (datetime.utcnow() - timedelta(days=self.ttl_days)).strftime("%Y-%m-%d")
+        conn.execute("DELETE FROM daily_progress WHERE day < ?", (cutoff,))
+
+
+class MongoProgressStore:
+    """Multi-host store. A TTL index on expires_at does the eviction (models/indexes.py)."""
+
+    def __init__(self, collection=None, ttl_days=PROGRESS_TTL_DAYS):
+        if collection is None:
+            from models.user_data import db
+            collection = db["daily_progress"]
+        self.collection = collection
+        self.ttl_days = ttl_days
+
+    def add(self, user_id, xp=0, completed=False):
+        day = _today()
+        expires_at = datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1 + self.ttl_days)
+        self.collection.update_one(
+            {"_id": f"{user_id}:{day}"},
+            {
+                "$inc": {"total_xp": xp, "completed_exercises": 1 if completed else 0},
+                "$setOnInsert": {"user_id": user_id, "day": day, "expires_at": expires_at},
+            },
+            upsert=True,
+        )
+
+    def get(self, user_id):
+        # _id lookup, so O(1) regardless of how many users are tracked
+        doc = self.collection.find_one({"_id": f"{user_id}:{_today()}"}, {"total_xp": 1, "completed_exercises": 1})
+        if doc is None:
+            return _empty()
+        return {"total_xp": doc.get("total_xp", 0), "completed_exercises": doc.get("completed_exercises", 0)}
+
+
+_BACKENDS = {"sqlite": SQLiteProgressStore, "mongo": MongoProgressStore}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_progress_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if PROGRESS_STORE not in _BACKENDS:
+                raise ValueError(f"PROGRESS_STORE must be one of {', '.join(_BACKENDS)}")
+            _store = _BACKENDS[PROGRESS_STORE]()
+        return _store
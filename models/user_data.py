@@ -1,9 +1,14 @@
 from pymongo import MongoClient
-from pymongo import DESCENDING
+from pymongo import DESCENDING, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import ClientBulkWriteException, DuplicateKeyError, InvalidOperation
 from datetime import datetime
+from itertools import groupby
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 
+from models import levels
+from utils.metrics import timed, REPOSITORY_SECONDS
+
 # Connect to MongoDB Atlas or localhost if not set
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 client = MongoClient(mongo_uri)
@@ -11,10 +16,28 @@ client = MongoClient(mongo_uri)
 db = client["fitness_app"]
 users = db["users"]
 progress = db["workout_progress"]
+# Latest and best result per (user_id, exercise, level). These used to be
+# upserted into users as pseudo-user documents; see models/migrations.py
+exercise_results = db["exercise_results"]
+_RESULT_FIELDS = ("date", "score", "xp", "reps", "completed", "timestamp", "calories")
+# One document per user per day with that day's totals and workouts, kept
+# up to date on every save, so /user/stats never scans workout_progress
+daily_activity = db["daily_activity"]
+# App-wide settings, one document per setting
+settings = db["settings"]
+_LEVEL_CURVE = {"_id": "level_curve"}
+
+ACTIVITY_WINDOW_DAYS = 30
+MAX_ACTIVITY_WINDOW_DAYS = 366
+MAX_ACTIVITIES_PER_DAY = 200
+
+# Fields the leaderboard can be sorted by; each has an index (models/indexes.py)
+LEADERBOARD_SORT_FIELDS = ("total_xp", "total_score", "level", "workouts_completed", "total_reps")
 
 # Register user
 from werkzeug.security import generate_password_hash, check_password_hash
 
+@timed(REPOSITORY_SECONDS, call="register_user")
 def register_user(email, password):
     if users.find_one({"email": email}):
         return {"error": "Email already exists"}
@@ -33,6 +56,7 @@ def register_user(email, password):
     return {"message": "User registered successfully"}
 
 
+@timed(REPOSITORY_SECONDS, call="login_user")
 def login_user(email, password):
     user = users.find_one({"email": email})
     if not user:
@@ -48,65 +72,97 @@ def login_user(email, password):
     }
     
 
-def get_level_from_xp(xp, max_level=30):
-    total_required_xp = 0
-    for level in range(1, max_level + 1):
-        required_xp = int(100 * (level ** 1.5))
-        total_required_xp += required_xp
-        if xp < total_required_xp:
-            return level - 1 if level > 1 else 1
-    return max_level
+def get_level_from_xp(xp, max_level=None):
+    # Bisect over the cached level curve (see models/levels.py)
+    return levels.level_from_xp(xp, max_level)
 
 def calculate_max_xp_for_level(level):
-    total = 0
-    for l in range(1, level + 1):
-        total += int(100 * (l ** 1.5))
-    return total
+    return levels.max_xp_for_level(level)
 
 def calculate_max_score_for_level(level):
-    # Example: Assuming each level requires 50 * level score.
-    total = 0
-    for l in range(1, level + 1):
-        total += 50 * l
-    return total
+    return levels.max_score_for_level(level)
 
 
+def load_level_curve():
+    # Applies the saved level curve overrides, if any, on top of the defaults
+    doc = settings.find_one(_LEVEL_CURVE, {"_id": 0})
+    return levels.set_curve(**doc) if doc else levels.get_curve()
 
-def normalize_all_users():
-    all_users = users.find()
-    for user in all_users:
-        updates = {}
 
-        # Normalize 'user_id' and 'email'
-        user_id = user.get("user_id") or user.get("email")
-        updates["user_id"] = user_id
-        updates["email"] = user.get("email", user_id)
+def save_level_curve(**changes):
+    # Stored levels were computed with the old curve: run the normalize
+    # migration afterwards to bring them in line
+    curve = levels.curve_with(**changes)
+    settings.update_one(_LEVEL_CURVE, {"$set": {name: getattr(curve, name) for name in changes}}, upsert=True)
+    return levels.set_curve(**changes)
+
 
-        # Set default fields
-        xp = user.get("total_xp", 0)
-        updates["level"] = get_level_from_xp(xp)
-        updates["total_score"] = user.get("total_score", 0)
-        updates["total_xp"] = user.get("total_xp", 0)
-        updates["workouts_completed"] = user.get("workouts_completed", 0)
-        updates["total_reps"] = user.get("total_reps", 0)
 
-        # Preserve password if exists
-        if "password" in user:
-            updates["password"] = user["password"]
+NORMALIZE_BATCH_SIZE = int(os.getenv("NORMALIZE_BATCH_SIZE", "1000"))
+_NORMALIZE_FIELDS = {"user_id": 1, "email": 1, "password": 1, "total_xp": 1, "total_score": 1,
+                     "workouts_completed": 1, "total_reps": 1}
 
-        # Optional: preserve workout snapshot
-        for field in ["exercise", "completed", "reps", "score", "xp", "timestamp"]:
-            if field in user:
-                updates[field] = user[field]
 
-        users.update_one({"_id": user["_id"]}, {"$set": updates})
+def _normalized(user, level):
+    updates = {}
+
+    # Normalize 'user_id' and 'email'
+    user_id = user.get("user_id") or user.get("email")
+    updates["user_id"] = user_id
+    # Only accounts get an email; pseudo-user documents not yet moved to
+    # exercise_results would collide on the unique index
+    if "email" in user or "password" in user:
+        updates["email"] = user.get("email", user_id)
+
+    # Set default fields
+    updates["level"] = int(level)
+    updates["total_score"] = user.get("total_score", 0)
+    updates["total_xp"] = user.get("total_xp", 0)
+    updates["workouts_completed"] = user.get("workouts_completed", 0)
+    updates["total_reps"] = user.get("total_reps", 0)
+    return updates
+
+
+def normalize_all_users(batch_size=NORMALIZE_BATCH_SIZE, start_after=None, on_batch=None):
+    """Normalize every user document, one page of batch_size at a time.
+
+    Pages are read in _id order with a projection, levels are computed for
+    the whole page at once and the page is written as one unordered bulk
+    write. start_after resumes after that _id; on_batch(last_id, processed)
+    runs after each page so callers can checkpoint. Returns the count.
+    """
+    processed = 0
+    last_id = start_after
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        page = list(users.find(query, _NORMALIZE_FIELDS).sort("_id", 1).limit(batch_size))
+        if not page:
+            return processed
+
+        page_levels = levels.levels_from_xp([user.get("total_xp") or 0 for user in page])
+        users.bulk_write(
+            [UpdateOne({"_id": user["_id"]}, {"$set": _normalized(user, level)}) for user, level in zip(page, page_levels)],
+            ordered=False,
+        )
+        processed += len(page)
+        last_id = page[-1]["_id"]
+        if on_batch:
+            on_batch(last_id, processed)
 
 
 # Workout progress
-def save_workout_progress(user_id, exercise, level, score, xp, completed, reps=0,calories=0):
-    today_str = datetime.utcnow().strftime("%Y-%m-%d")
-    workout_data = {
-        "date": today_str,
+def _timeline_columns(timeline):
+    # Detector timeline (a list of per-rep dicts) as one list per field, so a
+    # field name is stored once per workout instead of once per rep
+    fields = list(timeline[0]) if timeline else []
+    return {field: [rep.get(field) for rep in timeline] for field in fields}
+
+
+def _workout_data(user_id, exercise, level, score, xp, completed, reps, calories, timestamp=None,
+                  timeline=None, form_score=None, accuracy=None):
+    timestamp = timestamp or datetime.utcnow()
+    doc = {
+        "date": timestamp.strftime("%Y-%m-%d"),
         "user_id": user_id,
         "exercise": exercise,
         "level": level,
@@ -114,65 +170,195 @@ def save_workout_progress(user_id, exercise, level, score, xp, completed, reps=0
         "xp": xp,
         "reps": int(reps),            # <-- Add reps here
         "completed": completed,
-        "timestamp": datetime.utcnow(),
+        "timestamp": timestamp,
         "calories":calories,
     }
-    users.update_one(
-        {"user_id": user_id, "exercise": exercise, "level": level},
-        {"$set": workout_data},
-        upsert=True
-    )
-    progress.insert_one(workout_data)
+    # Video uploads also store how each rep went (BaseDetector.summarize)
+    if timeline:
+        doc["timeline"] = _timeline_columns(timeline)
+    if form_score is not None:
+        doc["form_score"] = form_score
+    if accuracy is not None:
+        doc["accuracy"] = accuracy
+    return doc
 
-    if completed:
-        today_str = datetime.utcnow().strftime("%Y-%m-%d")
-        users.update_one(
-            {"user_id": user_id},
-            {"$addToSet": {"played_dates": today_str}}  # Add date to user document
-        )
 
-def update_user_stats(user_id, score=0, xp=0, completed=False, reps=0, calories=0, **kwargs):
-    # Step 1: Fetch current XP
-    user = users.find_one({"user_id": user_id})
-    current_xp = user.get("total_xp", 0) if user else 0
-    new_xp = current_xp + xp
-    
-    new_level = get_level_from_xp(new_xp)
-    new_max_xp = calculate_max_xp_for_level(new_level)
-    new_max_score = calculate_max_score_for_level(new_level)
-
-    update_fields = {
-        "$inc": {
-            "total_score": score,
-            "total_xp": xp,
-            "total_reps": int(reps),
-            "calories": calories,
-        },
-        "$set": {
-            "level": new_level,
-            "max_xp": new_max_xp,
-            "max_score": new_max_score
-        }
+def _activity_entry(doc):
+    return {
+        "exercise": doc.get("exercise"),
+        "level": doc.get("level"),
+        "reps": doc.get("reps"),
+        "xp": doc.get("xp"),
+        "calories": doc.get("calories"),
     }
 
-    if completed:
-        update_fields["$inc"]["workouts_completed"] = 1
-        update_fields["$set"]["score.completed"] = True
 
+def _rollup_update(workout_data):
+    # Upsert for the workout's day in daily_activity
+    date_key = workout_data["timestamp"].strftime("%Y-%m-%d")
+    return (
+        {"user_id": workout_data["user_id"], "date": date_key},
+        {
+            "$inc": {
+                "reps": workout_data["reps"],
+                "xp": workout_data["xp"],
+                "calories": workout_data["calories"],
+                "workouts": 1,
+            },
+            "$addToSet": {"exercises": workout_data["exercise"]},
+            "$push": {"activities": {"$each": [_activity_entry(workout_data)], "$slice": -MAX_ACTIVITIES_PER_DAY}},
+        },
+    )
+
+
+def _result_update(doc):
+    # Upsert for exercise_results: the latest attempt, plus running bests
+    # (only for values that are actually numbers)
+    bests = {f"best_{field}": doc.get(field) for field in ("score", "xp", "reps")}
+    update = {
+        "$set": {field: doc[field] for field in _RESULT_FIELDS if field in doc},
+        "$inc": {"attempts": 1},
+    }
+    bests = {k: v for k, v in bests.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+    if bests:
+        update["$max"] = bests
+    return {"user_id": doc.get("user_id"), "exercise": doc["exercise"], "level": doc.get("level")}, update
+
+
+def _stats_update(score=0, xp=0, completed=False, reps=0, calories=0, played_dates=(), **kwargs):
+    # Update pipeline: the increments, then level / max_xp / max_score derived
+    # from the new total_xp on the server, so it is one atomic write and two
+    # concurrent workouts can't leave a level computed from a stale read.
+    def add(field, amount):
+        return {"$add": [{"$ifNull": ["$" + field, 0]}, amount]}
+
+    counters = {
+        "total_score": add("total_score", score),
+        "total_xp": add("total_xp", xp),
+        "total_reps": add("total_reps", int(reps)),
+        "calories": add("calories", calories),
+    }
+    # completed may also be a count, when several workouts are applied at once
+    if completed:
+        counters["workouts_completed"] = add("workouts_completed", int(completed))
+        counters["score.completed"] = True
+    if played_dates:
+        counters["played_dates"] = {"$setUnion": [{"$ifNull": ["$played_dates", []]}, list(played_dates)]}
     for key, value in kwargs.items():
-        update_fields["$set"][key] = value
+        # $literal so user-supplied strings starting with "$" stay plain values
+        counters[key] = {"$literal": value}
+
+    thresholds = levels.xp_thresholds()
+    max_scores = [levels.max_score_for_level(l) for l in range(1, len(thresholds) + 1)]
+    finished = {"$size": {"$filter": {"input": thresholds, "cond": {"$lte": ["$$this", "$total_xp"]}}}}
+    return [
+        {"$set": counters},
+        {"$set": {"level": {"$max": [finished, 1]}}},
+        {"$set": {
+            "max_xp": {"$arrayElemAt": [thresholds, {"$subtract": ["$level", 1]}]},
+            "max_score": {"$arrayElemAt": [max_scores, {"$subtract": ["$level", 1]}]},
+        }},
+    ]
+
+
+_stats_listeners = []
 
-    users.update_one(
-        {"user_id": user_id},
-        update_fields,
-        upsert=True
-    )
 
+def add_stats_listener(listener):
+    # listener(user_id, doc) after every stats write; doc is the updated user
+    # document when the write returned it, None otherwise
+    _stats_listeners.append(listener)
 
 
+def _stats_changed(user_id, doc=None):
+    for listener in _stats_listeners:
+        listener(user_id, doc)
 
 
-def get_user_stats(user_id):
+@timed(REPOSITORY_SECONDS, call="update_user_stats")
+def update_user_stats(user_id, score=0, xp=0, completed=False, reps=0, calories=0, **kwargs):
+    # Still one round-trip: the updated document comes back with the write
+    doc = users.find_one_and_update(
+        {"user_id": user_id},
+        _stats_update(score, xp, completed, reps, calories, **kwargs),
+        projection={"password": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    _stats_changed(user_id, doc)
+
+
+_client_bulk_write = callable(getattr(type(client), "bulk_write", None))
+
+
+@timed(REPOSITORY_SECONDS, call="record_workout")
+def record_workout(user_id, exercise, level, score, xp, completed, reps=0, calories=0,
+                   timeline=None, form_score=None, accuracy=None, workout_id=None):
+    """Save a workout and bump the user's stats.
+
+    Writes the exercise result, the workout_progress document and the daily
+    rollup along with the update_user_stats increments. On MongoDB 8.0+ they
+    go out as a single cross-collection client bulk write, one round-trip.
+    Older servers get one write per collection, four sequential round-trips,
+    and a failure part way leaves the earlier writes in place. timeline,
+    form_score and accuracy (from a detector) are kept on the
+    workout_progress document only.
+
+    workout_id, when given, becomes the workout_progress _id and is written
+    first: recording the same workout_id again (a retried job) changes
+    nothing and returns False. Returns True when the workout was recorded.
+    """
+    global _client_bulk_write
+    workout_data = _workout_data(user_id, exercise, level, score, xp, completed, reps, calories,
+                                 timeline=timeline, form_score=form_score, accuracy=accuracy)
+    if workout_id is not None:
+        workout_data["_id"] = workout_id
+    result = _result_update(workout_data)
+    rollup = _rollup_update(workout_data)
+    stats = ({"user_id": user_id}, _stats_update(
+        score, xp, completed, reps, float(calories),
+        played_dates=[workout_data["date"]] if completed else (),
+    ))
+
+    if _client_bulk_write:
+        try:
+            # Ordered, with the insert first: a duplicate workout_id stops it
+            # before any increment is applied
+            client.bulk_write([
+                InsertOne(dict(workout_data), namespace=progress.full_name),
+                UpdateOne(*result, upsert=True, namespace=exercise_results.full_name),
+                UpdateOne(*rollup, upsert=True, namespace=daily_activity.full_name),
+                UpdateOne(*stats, upsert=True, namespace=users.full_name),
+            ])
+            _stats_changed(user_id)
+            return True
+        except InvalidOperation:
+            # Raised before anything is sent when the server is older than 8.0
+            _client_bulk_write = False
+        except ClientBulkWriteException as e:
+            if workout_id is not None and [error.get("code") for error in e.write_errors] == [11000]:
+                return False
+            raise
+
+    # Pre-8.0 servers: four round-trips, one per collection, not atomic as a
+    # group. WORKOUT_WRITE_BEHIND=1 (models/write_behind.py) batches them instead.
+    try:
+        progress.insert_one(workout_data)
+    except DuplicateKeyError:
+        if workout_id is None:
+            raise
+        return False
+    exercise_results.update_one(*result, upsert=True)
+    users.update_one(*stats, upsert=True)
+    daily_activity.update_one(*rollup, upsert=True)
+    _stats_changed(user_id)
+    return True
+
+
+@timed(REPOSITORY_SECONDS, call="get_user_stats")
+def get_user_stats(user_id, days=ACTIVITY_WINDOW_DAYS, before=None):
+    # Activity comes from the daily rollups: the latest `days` active days,
+    # older than `before` (YYYY-MM-DD, exclusive) when paging back
     
     user = users.find_one(
         {"user_id": user_id},
@@ -224,39 +410,95 @@ def get_user_stats(user_id):
     next_level = user["level"] + 1
     user["max_xp_for_level"] = calculate_max_xp_for_level(next_level)
     user["max_score_for_level"] = calculate_max_score_for_level(next_level)
-    activities = progress.find({"user_id": user_id})
+    days = max(1, min(int(days), MAX_ACTIVITY_WINDOW_DAYS))
+    query = {"user_id": user_id}
+    if before:
+        query["date"] = {"$lt": before}
+    # One extra day tells us whether there is an older page
+    rollups = list(
+        daily_activity.find(query, {"_id": 0, "user_id": 0, "exercises": 0})
+        .sort("date", DESCENDING)
+        .limit(days + 1)
+    )
+    page = rollups[:days]
+
     activities_by_date = {}
+    daily_totals = {}
+    for doc in reversed(page):
+        activities_by_date[doc["date"]] = doc.get("activities", [])
+        daily_totals[doc["date"]] = {
+            "reps": doc.get("reps", 0),
+            "xp": doc.get("xp", 0),
+            "calories": doc.get("calories", 0),
+            "workouts": doc.get("workouts", 0),
+        }
 
-    for doc in activities:
-        timestamp = doc.get("timestamp")
-        if not timestamp:
-          continue
+    user["activities_by_date"] = activities_by_date
+    user["daily_totals"] = daily_totals
+    # Pass back as `before` to get the previous window
+    user["activities_next_before"] = page[-1]["date"] if len(rollups) > days else None
+    return user
 
+
+def _rollup_days(user_id, workouts):
+    # workouts: one user's workout_progress docs in timestamp order
+    days = {}
+    for doc in workouts:
+        timestamp = doc.get("timestamp")
         if isinstance(timestamp, str):
-            dt = datetime.fromisoformat(timestamp)
-        elif isinstance(timestamp, datetime):
-            dt = timestamp
-        else:
+            timestamp = datetime.fromisoformat(timestamp)
+        if not isinstance(timestamp, datetime):
             continue
 
-        date_key = dt.strftime("%Y-%m-%d")
-        activities_by_date.setdefault(date_key, []).append({
-            "exercise": doc.get("exercise"),
-            "level": doc.get("level"),
-            "reps": doc.get("reps"),
-            "xp": doc.get("xp"),
-            "calories": doc.get("calories"),
+        date_key = timestamp.strftime("%Y-%m-%d")
+        day = days.setdefault(date_key, {
+            "user_id": user_id, "date": date_key,
+            "reps": 0, "xp": 0, "calories": 0, "workouts": 0, "exercises": [], "activities": [],
         })
-
-    user["activities_by_date"] = activities_by_date
-    return user
-
-def get_leaderboard(limit=10, sort_by="total_xp"):
-    db1 = db
-    pipeline = [
+        day["reps"] += doc.get("reps") or 0
+        day["xp"] += doc.get("xp") or 0
+        day["calories"] += doc.get("calories") or 0
+        day["workouts"] += 1
+        if doc.get("exercise") not in day["exercises"]:
+            day["exercises"].append(doc.get("exercise"))
+        day["activities"].append(_activity_entry(doc))
+
+    for day in days.values():
+        day["activities"] = day["activities"][-MAX_ACTIVITIES_PER_DAY:]
+    return days.values()
+
+
+def backfill_daily_activity(batch_size=500):
+    """Rebuild daily_activity from the full workout_progress history.
+
+    Each user's days are recomputed from scratch and replaced, so it is safe
+    to run again; workouts saved while it runs may need another pass.
+    """
+    cursor = progress.find(
+        {}, {"_id": 0, "user_id": 1, "timestamp": 1, "exercise": 1, "level": 1, "reps": 1, "xp": 1, "calories": 1}
+    ).sort([("user_id", 1), ("timestamp", 1)])
+
+    ops, written = [], 0
+    for user_id, workouts in groupby(cursor, key=lambda doc: doc.get("user_id")):
+        ops += [
+            ReplaceOne({"user_id": user_id, "date": day["date"]}, day, upsert=True)
+            for day in _rollup_days(user_id, workouts)
+        ]
+        if len(ops) >= batch_size:
+            daily_activity.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        daily_activity.bulk_write(ops, ordered=False)
+        written += len(ops)
+    return written
+
+
+def _leaderboard_pipeline(limit, sort_by):
+    return [
         {
             "$match": {
-                "email": {"$exists": True},  # filters out workout logs
+                "email": {"$exists": True},  # registered accounts only
                 "name": {"$exists": True}
             }
         },
@@ -267,7 +509,9 @@ def get_leaderboard(limit=10, sort_by="total_xp"):
                 "name": 1,
                 "total_xp": 1,
                 "total_score": 1,
-                "level": 1
+                "level": 1,
+                "workouts_completed": 1,
+                "total_reps": 1
             }
         },
         {
@@ -277,6 +521,14 @@ def get_leaderboard(limit=10, sort_by="total_xp"):
             "$limit": limit
         }
     ]
-    users = list(db1.users.aggregate(pipeline))
-    return users
 
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintenance commands for the fitness_app database")
+    parser.add_argument("command", choices=["backfill-rollups"])
+    parser.add_argument("--batch_size", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == "backfill-rollups":
+        print(f"Wrote {backfill_daily_activity(args.batch_size)} daily rollups")
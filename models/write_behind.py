@@ -0,0 +1,426 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import levels
+from utils.log import get_logger
+from models import user_data
+from models.user_data import (
+    users, progress, exercise_results, daily_activity, MAX_ACTIVITIES_PER_DAY,
+    _workout_data, _result_update, _rollup_update, _activity_entry, _stats_update, _stats_changed,
+)
+
+# Optional write-behind for workout logging. A logged workout is appended
+# (and fsynced) to a local log and acknowledged; a background thread flushes
+# the log to Mongo in batches, merging each user's increments into one write
+# per collection. Stats reads add whatever is still in the log on top.
+ENABLED = os.getenv("WORKOUT_WRITE_BEHIND", "0") == "1"
+LOG_DIR = os.getenv("WORKOUT_LOG_DIR", "workout_log")
+FLUSH_INTERVAL_SEC = float(os.getenv("WORKOUT_FLUSH_INTERVAL", "1.0"))
+FLUSH_MAX_EVENTS = int(os.getenv("WORKOUT_FLUSH_MAX_EVENTS", "1000"))
+
+# A segment is appended to as active-<pid>-<n>.log, renamed to
+# pending-<pid>-<n>.log for flushing, and deleted once every step below has
+# been applied. The steps done so far are kept in a .state file next to it,
+# so a flush interrupted by a crash resumes at the next step.
+ACTIVE = "active"
+PENDING = "pending"
+STEPS = ("progress", "results", "daily", "users")
+# A crash can still land between a step's write and its .state file. So each
+# $inc is tagged with the segment (its first event id) and skips documents
+# already carrying the tag; the last APPLIED_KEEP tags are kept per document.
+APPLIED_KEEP = 50
+# Flushes (every process's) hold this exclusively while they rename, apply
+# and delete segments; stats reads hold it shared across their Mongo read and
+# log scan, so a workout is counted exactly once
+LOCK_FILE = "flush.lock"
+LOCK_POLL_SEC = 0.005
+
+log = get_logger("write_behind")
+
+
+def _segment_pid(path):
+    try:
+        return int(os.path.basename(path).split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_events(path):
+    events = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # Torn last line from a crash mid-append; it was never acknowledged
+                continue
+    return events
+
+
+def _read_state(path):
+    try:
+        with open(path + ".state") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+
+
+def _write_state(path, done):
+    tmp = path + ".state.tmp"
+    with open(tmp, "w") as f:
+        json.dump(done, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path + ".state")
+
+
+def _segment_tag(events):
+    return events[0]["id"]
+
+
+def _tagged(key, update, tag):
+    # Match only documents this segment hasn't been applied to, and record it
+    push = {"$each": [tag], "$slice": -APPLIED_KEEP}
+    if isinstance(update, list):
+        # Update pipeline (users)
+        applied = {"$ifNull": ["$applied_log", []]}
+        update = update + [{"$set": {"applied_log": {"$slice": [{"$concatArrays": [applied, [tag]]}, -APPLIED_KEEP]}}}]
+    else:
+        update = {**update, "$push": {**update.get("$push", {}), "applied_log": push}}
+    return UpdateOne({**key, "applied_log": {"$ne": tag}}, update)
+
+
+def _write_tagged(collection, updates, tag):
+    # Not an upsert with the $ne filter: on a replay that would insert a second
+    # document. Create missing documents first, then apply the tagged updates.
+    collection.bulk_write([UpdateOne(key, {"$setOnInsert": key}, upsert=True) for key, _ in updates], ordered=False)
+    collection.bulk_write([_tagged(key, update, tag) for key, update in updates], ordered=False)
+
+
+def _workout(event):
+    doc = _workout_data(
+        event["user_id"], event["exercise"], event["level"], event["score"], event["xp"],
+        event["completed"], event["reps"], event["calories"],
+        timestamp=datetime.fromisoformat(event["timestamp"]),
+        timeline=event.get("timeline"), form_score=event.get("form_score"), accuracy=event.get("accuracy"),
+    )
+    doc["_id"] = event["id"]
+    return doc
+
+
+def _group(docs, key):
+    groups = OrderedDict()
+    for doc in docs:
+        groups.setdefault(key(doc), []).append(doc)
+    return groups
+
+
+def _apply_progress(workouts, tag):
+    # Event ids are the _ids, so replaying a segment doesn't duplicate rows
+    try:
+        progress.insert_many([dict(doc) for doc in workouts], ordered=False)
+    except BulkWriteError as e:
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+
+def _apply_results(workouts, tag):
+    updates = []
+    for group in _group(workouts, lambda d: (d["user_id"], d["exercise"], str(d["level"]))).values():
+        key, update = _result_update(group[-1])
+        update["$inc"]["attempts"] = len(group)
+        bests = {}
+        for doc in group:
+            for field, value in _result_update(doc)[1].get("$max", {}).items():
+                bests[field] = max(bests.get(field, value), value)
+        update.pop("$max", None)
+        if bests:
+            update["$max"] = bests
+        updates.append((key, update))
+    _write_tagged(exercise_results, updates, tag)
+
+
+def _apply_daily(workouts, tag):
+    updates = []
+    for group in _group(workouts, lambda d: (d["user_id"], d["timestamp"].strftime("%Y-%m-%d"))).values():
+        key, update = _rollup_update(group[0])
+        for doc in group[1:]:
+            _, more = _rollup_update(doc)
+            for field, amount in more["$inc"].items():
+                update["$inc"][field] += amount
+            update["$push"]["activities"]["$each"] += more["$push"]["activities"]["$each"]
+        update["$addToSet"] = {"exercises": {"$each": list(dict.fromkeys(d["exercise"] for d in group))}}
+        updates.append((key, update))
+    _write_tagged(daily_activity, updates, tag)
+
+
+def _merged_stats(workouts):
+    # One user's workouts as the arguments of a single _stats_update
+    return dict(
+        score=sum(d["score"] for d in workouts),
+        xp=sum(d["xp"] for d in workouts),
+        completed=sum(1 for d in workouts if d["completed"]),
+        reps=sum(d["reps"] for d in workouts),
+        calories=sum(float(d["calories"]) for d in workouts),
+        played_dates=sorted({d["date"] for d in workouts if d["completed"]}),
+    )
+
+
+def _apply_users(workouts, tag):
+    updates = [
+        ({"user_id": user_id}, _stats_update(**_merged_stats(group)))
+        for user_id, group in _group(workouts, lambda d: d["user_id"]).items()
+    ]
+    _write_tagged(users, updates, tag)
+
+
+_APPLY = {
+    "progress": _apply_progress,
+    "results": _apply_results,
+    "daily": _apply_daily,
+    "users": _apply_users,
+}
+
+
+class WorkoutLog:
+    def __init__(self, log_dir=LOG_DIR):
+        self.log_dir = log_dir
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._fd = None
+        self._path = None
+        self._segment = 0
+        self._count = 0
+
+    def _start(self):
+        # Called with the lock held. Again after a fork: the flusher thread is per process
+        self._pid = os.getpid()
+        self._fd = None
+        os.makedirs(self.log_dir, exist_ok=True)
+        atexit.register(self.flush)
+        threading.Thread(target=self._flush_loop, name="workout-log-flush", daemon=True).start()
+
+    def ensure_started(self):
+        # Also recovers segments left by dead processes, so call it at startup
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+
+    def append(self, event):
+        line = (json.dumps(event) + "\n").encode()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            if self._fd is None:
+                self._segment += 1
+                self._path = os.path.join(self.log_dir, f"{ACTIVE}-{self._pid}-{self._segment}.log")
+                self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            os.write(self._fd, line)
+            os.fsync(self._fd)
+            self._count += 1
+            if self._count >= FLUSH_MAX_EVENTS:
+                self._wake.set()
+
+    @contextmanager
+    def _locked(self, mode):
+        # flock is per open file, so this excludes other threads as well as
+        # other processes. Polled rather than blocking: under gevent a blocking
+        # flock would stall the whole worker, including the greenlet holding it.
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(os.path.join(self.log_dir, LOCK_FILE), "a") as f:
+            while True:
+                try:
+                    fcntl.flock(f, mode | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    time.sleep(LOCK_POLL_SEC)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def shared(self):
+        """Hold off every process's flush, e.g. across a Mongo read plus pending()."""
+        return self._locked(fcntl.LOCK_SH)
+
+    def _rotate(self):
+        with self._lock:
+            if self._fd is None:
+                return
+            os.close(self._fd)
+            name = os.path.basename(self._path).replace(f"{ACTIVE}-", f"{PENDING}-", 1)
+            os.rename(self._path, os.path.join(self.log_dir, name))
+            self._fd, self._count = None, 0
+
+    def _recover(self):
+        # Claim segments left behind by processes that are gone
+        for path in glob.glob(os.path.join(self.log_dir, "*.log")):
+            pid = _segment_pid(path)
+            if pid is None or pid == os.getpid() or _pid_alive(pid):
+                continue
+            claimed = os.path.join(self.log_dir, f"{PENDING}-{os.getpid()}-r{uuid.uuid4().hex}.log")
+            try:
+                if os.path.exists(path + ".state"):
+                    os.replace(path + ".state", claimed + ".state")
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # Another process claimed it first
+                continue
+
+    def flush(self):
+        with self._flush_lock, self._locked(fcntl.LOCK_EX):
+            self._rotate()
+            self._recover()
+            for path in sorted(glob.glob(os.path.join(self.log_dir, f"{PENDING}-{os.getpid()}-*.log"))):
+                self._apply(path)
+
+    def _apply(self, path):
+        events = _read_events(path)
+        workouts = [_workout(event) for event in events]
+        done = _read_state(path)
+        if workouts:
+            for step in STEPS:
+                if step not in done:
+                    _APPLY[step](workouts, _segment_tag(events))
+                    done.append(step)
+                    _write_state(path, done)
+        os.remove(path)
+        if os.path.exists(path + ".state"):
+            os.remove(path + ".state")
+        for user_id in dict.fromkeys(d["user_id"] for d in workouts):
+            _stats_changed(user_id)
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL_SEC)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Left in place and retried on the next tick
+                log.exception("Flush failed")
+
+    def contains(self, event_id):
+        # Whether any process's log still holds event_id; under shared(), like pending()
+        return any(
+            event.get("id") == event_id
+            for path in glob.glob(os.path.join(self.log_dir, "*.log"))
+            for event in _read_events(path)
+        )
+
+    def pending(self, user_id, step):
+        """Workouts for user_id whose `step` hasn't reached Mongo yet, from every process's log.
+
+        Only consistent with a Mongo read made under the same shared().
+        """
+        workouts = []
+        for path in glob.glob(os.path.join(self.log_dir, "*.log")):
+            if step in _read_state(path):
+                continue
+            workouts += [_workout(e) for e in _read_events(path) if e.get("user_id") == user_id]
+        return sorted(workouts, key=lambda d: d["timestamp"])
+
+
+workout_log = WorkoutLog()
+
+
+def record_workout(user_id, exercise, level, score, xp, completed, reps=0, calories=0,
+                   timeline=None, form_score=None, accuracy=None, workout_id=None):
+    # Same contract as user_data.record_workout; only durable locally when enabled
+    if not ENABLED:
+        return user_data.record_workout(user_id, exercise, level, score, xp, completed, reps, calories,
+                                        timeline, form_score, accuracy, workout_id)
+    if workout_id is None:
+        _append_workout(uuid.uuid4().hex, user_id, exercise, level, score, xp, completed, reps, calories,
+                        timeline, form_score, accuracy)
+        return True
+    # The event id is the workout_progress _id, so a workout_id already logged
+    # is either in Mongo or still in some process's log. Held shared so no
+    # flush moves it from one to the other between the two checks.
+    with workout_log.shared():
+        if progress.count_documents({"_id": workout_id}, limit=1) or workout_log.contains(workout_id):
+            return False
+        _append_workout(workout_id, user_id, exercise, level, score, xp, completed, reps, calories,
+                        timeline, form_score, accuracy)
+    return True
+
+
+def _append_workout(event_id, user_id, exercise, level, score, xp, completed, reps, calories,
+                    timeline, form_score, accuracy):
+    workout_log.append({
+        "id": event_id,
+        "user_id": user_id,
+        "exercise": exercise,
+        "level": level,
+        "score": score,
+        "xp": xp,
+        "completed": completed,
+        "reps": int(reps),
+        "calories": calories,
+        "timestamp": datetime.utcnow().isoformat(),
+        "timeline": timeline,
+        "form_score": form_score,
+        "accuracy": accuracy,
+    })
+
+
+def get_user_stats(user_id, days=user_data.ACTIVITY_WINDOW_DAYS, before=None):
+    """user_data.get_user_stats plus the caller's workouts still in the log."""
+    if not ENABLED:
+        return user_data.get_user_stats(user_id, days, before)
+
+    # No flush can apply, rename or delete a segment between the two reads, so
+    # a workout is either already in stats or still pending, never both or neither
+    with workout_log.shared():
+        stats = user_data.get_user_stats(user_id, days, before)
+        unflushed = workout_log.pending(user_id, "users")
+        unflushed_daily = workout_log.pending(user_id, "daily") if before is None else []
+    if unflushed:
+        merged = _merged_stats(unflushed)
+        for field, amount in (("total_score", "score"), ("total_xp", "xp"), ("total_reps", "reps"),
+                              ("calories", "calories"), ("workouts_completed", "completed")):
+            stats[field] = (stats.get(field) or 0) + merged[amount]
+        if merged["played_dates"]:
+            stats["played_dates"] = sorted(set(stats.get("played_dates") or []) | set(merged["played_dates"]))
+        stats["level"] = levels.level_from_xp(stats["total_xp"])
+        stats["max_xp_for_level"] = levels.max_xp_for_level(stats["level"] + 1)
+        stats["max_score_for_level"] = levels.max_score_for_level(stats["level"] + 1)
+
+    # Pending workouts are today's, so they only belong on the first page
+    if before is None and "activities_by_date" in stats:
+        for doc in unflushed_daily:
+            date_key = doc["timestamp"].strftime("%Y-%m-%d")
+            stats["activities_by_date"].setdefault(date_key, []).append(_activity_entry(doc))
+            stats["activities_by_date"][date_key] = stats["activities_by_date"][date_key][-MAX_ACTIVITIES_PER_DAY:]
+            totals = stats["daily_totals"].setdefault(date_key, {"reps": 0, "xp": 0, "calories": 0, "workouts": 0})
+            totals["reps"] += doc["reps"]
+            totals["xp"] += doc["xp"]
+            totals["calories"] += doc["calories"]
+            totals["workouts"] += 1
+    return stats
@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+
+import mongomock
+import pymongo
+import pytest
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import ClientBulkWriteException, DuplicateKeyError
+
+# The models connect to Mongo at import, so this runs before any test module
+# imports them: an in-memory Mongo, and every background thread and local
+# file the app would start kept out of the way
+pymongo.MongoClient = mongomock.MongoClient
+_scratch = tempfile.mkdtemp(prefix="fitness-tests-")
+os.environ.update(
+    JOB_RUNNER_ENABLED="0",
+    MONGO_ENSURE_INDEXES="0",
+    JOB_DB_PATH=os.path.join(_scratch, "jobs.db"),
+    PROGRESS_DB_PATH=os.path.join(_scratch, "progress.db"),
+    WORKOUT_LOG_DIR=os.path.join(_scratch, "workout_log"),
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import user_data  # noqa: E402
+
+
+def apply_op(collection, op):
+    # One pymongo write model against a mongomock collection. mongomock's own
+    # bulk_write predates the models' sort field and rejects them.
+    if isinstance(op, InsertOne):
+        collection.insert_one(dict(op._doc))
+    elif isinstance(op, DeleteOne):
+        collection.delete_one(op._filter)
+    elif isinstance(op, UpdateOne):
+        collection.update_one(op._filter, op._doc, upsert=op._upsert)
+    else:
+        raise TypeError(f"Unsupported write model {op!r}")
+
+
+def _collection_bulk_write(collection):
+    def bulk_write(ops, ordered=True, **kwargs):
+        for op in ops:
+            apply_op(collection, op)
+    return bulk_write
+
+
+def _client_bulk_write(ops, ordered=True, **kwargs):
+    # MongoDB 8.0+ cross-collection bulk write: ordered, so the first failing
+    # write stops the rest, and reported the way the driver reports it
+    for index, op in enumerate(ops):
+        collection = user_data.db[op._namespace.split(".", 1)[1]]
+        try:
+            apply_op(collection, op)
+        except DuplicateKeyError as e:
+            raise ClientBulkWriteException(
+                {"writeErrors": [{"idx": index, "code": e.code, "errmsg": str(e)}], "anySuccessful": index > 0},
+                False,
+            )
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """An empty database, with bulk writes that mongomock can run.
+
+    Stats writes use the pre-8.0 one-write-per-collection path unless a test
+    asks for client_bulk_write.
+    """
+    for name in user_data.db.list_collection_names():
+        user_data.db[name].delete_many({})
+    for name in ("users", "progress", "exercise_results", "daily_activity"):
+        collection = getattr(user_data, name)
+        monkeypatch.setattr(collection, "bulk_write", _collection_bulk_write(collection), raising=False)
+    monkeypatch.setattr(user_data, "_client_bulk_write", False)
+    return user_data.db
+
+
+@pytest.fixture
+def client_bulk_write(mongo, monkeypatch):
+    monkeypatch.setattr(user_data.client, "bulk_write", _client_bulk_write, raising=False)
+    monkeypatch.setattr(user_data, "_client_bulk_write", True)
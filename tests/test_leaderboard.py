@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from models import leaderboard
+from models.leaderboard import Leaderboard, METRICS, WEEKLY_XP, _week_start
+from models.user_data import daily_activity, users
+
+
+@pytest.fixture
+def population(mongo):
+    # Registered users with profiles, plus users without one (no email/name),
+    # who must never be ranked or counted ahead of anybody
+    rng = random.Random(7)
+    week = _week_start()
+    for i in range(40):
+        doc = {"user_id": f"u{i}", "total_xp": rng.randint(0, 900), "total_score": rng.randint(0, 90),
+               "level": rng.randint(1, 9), "workouts_completed": rng.randint(0, 30), "total_reps": rng.randint(0, 500)}
+        if i % 4:
+            doc.update(email=f"u{i}@example.com", name=f"User {i}")
+        users.insert_one(doc)
+        if i % 3:
+            daily_activity.insert_one({"user_id": f"u{i}", "date": week, "xp": rng.randint(0, 400)})
+    return week
+
+
+def _expected(metric, user_id):
+    # Brute force: 1 + eligible users strictly ahead
+    eligible = {doc["user_id"]: doc for doc in users.find({"email": {"$exists": True}, "name": {"$exists": True}})}
+    if user_id not in eligible:
+        return None
+    if metric == WEEKLY_XP:
+        values = {}
+        for doc in daily_activity.find({"date": {"$gte": _week_start()}}):
+            if doc["user_id"] in eligible:
+                values[doc["user_id"]] = values.get(doc["user_id"], 0) + doc["xp"]
+    else:
+        values = {uid: doc.get(metric) or 0 for uid, doc in eligible.items()}
+    value = values.get(user_id, 0)
+    return {"rank": 1 + sum(1 for other in values.values() if other > value), "value": value}
+
+
+def _check(board, metric):
+    top = board.top(metric, limit=board.size)
+    for position, entry in enumerate(top, start=1):
+        assert board.rank(metric, entry["user_id"]) == {"rank": position, "value": entry[metric]}
+    for i in range(40):
+        rank, expected = board.rank(metric, f"u{i}"), _expected(metric, f"u{i}")
+        if expected is None or expected["rank"] > board.size:
+            assert rank == expected
+        else:
+            # Ties inside the top-N are broken by user_id there
+            assert rank["value"] == expected["value"]
+
+
+@pytest.mark.parametrize("metric", METRICS)
+def test_rank_agrees_with_top_and_a_full_count(population, metric):
+    _check(Leaderboard(size=5), metric)
+
+
+def test_rank_follows_writes_in_this_process(population):
+    board = Leaderboard(size=5)
+    board.top(WEEKLY_XP)
+    for user_id in ("u1", "u5", "u9", "u0"):
+        daily_activity.insert_one({"user_id": user_id, "date": population, "xp": 350})
+        board.on_stats_change(user_id)
+    _check(board, WEEKLY_XP)
+    # u0 has no profile: its XP counts for nobody
+    assert board.rank(WEEKLY_XP, "u0") is None
+
+
+def test_lookups_are_served_while_a_reconcile_reads(population, monkeypatch):
+    board = Leaderboard(size=5)
+    board.top("total_xp")
+    board._reconciled_at = 0
+    calls = []
+    monkeypatch.setattr(leaderboard.users, "aggregate", lambda *args, **kwargs: calls.append(board._lock.locked()) or [])
+    board.top("total_xp")
+    # The reconcile's reads ran, and none of them with the lock held
+    assert calls and not any(calls)
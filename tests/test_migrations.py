@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pytest
+from pymongo import DeleteOne
+
+from models import migrations
+from models.migrations import EXERCISE_RESULTS, MIGRATED_FROM, move_exercise_results, start_migration
+from models.user_data import exercise_results, users
+
+
+def _seed():
+    # A real user with three pseudo-users its stats used to land on, and a
+    # snapshot-only pseudo-user without stats
+    users.insert_one({"user_id": "c", "email": "c@example.com", "name": "C", "total_xp": 1000,
+                      "total_score": 100, "total_reps": 1, "workouts_completed": 2})
+    for exercise in ("plank", "squat", "jump"):
+        users.insert_one({"user_id": "c", "exercise": exercise, "level": "Level1", "score": 3, "xp": 30, "reps": 3,
+                          "completed": True, "timestamp": datetime(2026, 3, 4), "date": "2026-03-04", "calories": 0,
+                          "total_xp": 30, "total_score": 3, "total_reps": 3, "workouts_completed": 1})
+    users.insert_one({"user_id": "d", "exercise": "squat", "level": "Level2", "score": 9, "xp": 10, "reps": 4,
+                      "completed": False, "timestamp": datetime(2026, 3, 4), "date": "2026-03-04", "calories": 0})
+
+
+def _snapshot():
+    return (
+        sorted((sorted(doc.items()) for doc in users.find({}, {"_id": 0})), key=repr),
+        sorted((sorted(doc.items()) for doc in exercise_results.find({}, {"_id": 0})), key=repr),
+    )
+
+
+@pytest.fixture
+def crash_before_first_delete(mongo, monkeypatch):
+    # Dies after a page's merges, before the pseudo-users are deleted
+    state = {"armed": True}
+    apply = users.bulk_write
+
+    def bulk_write(ops, ordered=True, **kwargs):
+        for op in ops:
+            if isinstance(op, DeleteOne) and state["armed"]:
+                state["armed"] = False
+                raise RuntimeError("worker died")
+            apply([op])
+
+    monkeypatch.setattr(users, "bulk_write", bulk_write, raising=False)
+
+
+def test_resume_after_a_crash_mid_page_matches_a_clean_run(mongo, request):
+    _seed()
+    move_exercise_results(batch_size=10)
+    clean = _snapshot()
+
+    for name in mongo.list_collection_names():
+        mongo[name].delete_many({})
+    _seed()
+    request.getfixturevalue("crash_before_first_delete")
+    with pytest.raises(RuntimeError):
+        move_exercise_results(batch_size=10)
+    # Resumed from the last checkpoint, which is before the page
+    move_exercise_results(batch_size=10)
+
+    assert _snapshot() == clean
+    real = users.find_one({"email": "c@example.com"})
+    assert real["total_xp"] == 1090 and real["workouts_completed"] == 5
+    assert {doc["attempts"] for doc in exercise_results.find()} == {1}
+    assert not users.count_documents({MIGRATED_FROM: {"$exists": True}})
+    assert not exercise_results.count_documents({MIGRATED_FROM: {"$exists": True}})
+
+
+def test_total_counts_only_the_documents_the_migration_moves(mongo, monkeypatch):
+    _seed()
+    started = []
+    monkeypatch.setattr(migrations.threading, "Thread",
+                        lambda **kwargs: type("T", (), {"start": lambda self: started.append(kwargs)})())
+
+    state = start_migration(EXERCISE_RESULTS)
+
+    assert started and state["total"] == 4
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+
+from models import user_data
+
+WORKOUTS = [
+    dict(user_id="ana", exercise="squat", level="Level1", score=40, xp=120, completed=True, reps=12, calories=8.5),
+    dict(user_id="ana", exercise="squat", level="Level1", score=55, xp=90, completed=False, reps=9, calories=6),
+    dict(user_id="ana", exercise="jump", level=None, score=20, xp=60, completed=True, reps=10, calories=4,
+         timeline=[{"start": 0.5, "end": 1.1, "form": 80}], form_score=80, accuracy=90),
+    dict(user_id="ben", exercise="pushup", level="Level2", score=35, xp=75, completed=True, reps=15, calories=5),
+]
+
+
+def _snapshot(db):
+    # Everything record_workout writes, minus the generated _ids and clock times
+    def clean(doc):
+        doc = {k: v for k, v in doc.items() if k not in ("_id", "timestamp")}
+        if "activities" in doc:
+            doc["activities"] = [{k: v for k, v in a.items() if k != "timestamp"} for a in doc["activities"]]
+        return doc
+
+    return {
+        name: sorted((clean(doc) for doc in db[name].find()), key=repr)
+        for name in ("users", "workout_progress", "exercise_results", "daily_activity")
+    }
+
+
+def _record_all(**kwargs):
+    for workout in WORKOUTS:
+        assert user_data.record_workout(**workout, **kwargs) is True
+
+
+@pytest.fixture
+def fixed_clock(monkeypatch):
+    # Both runs must land on the same day
+    real = user_data._workout_data
+    monkeypatch.setattr(user_data, "_workout_data",
+                        lambda *args, **kwargs: real(*args, **{**kwargs, "timestamp": datetime(2026, 3, 4, 12)}))
+
+
+def test_fallback_writes_what_the_client_bulk_write_does(mongo, fixed_clock, request):
+    _record_all()
+    fallback = _snapshot(mongo)
+
+    for name in mongo.list_collection_names():
+        mongo[name].delete_many({})
+    request.getfixturevalue("client_bulk_write")
+    _record_all()
+
+    assert _snapshot(mongo) == fallback
+    assert fallback["users"][0]["total_xp"] == 270
+
+
+@pytest.mark.parametrize("bulk", [False, True], ids=["fallback", "client_bulk_write"])
+def test_workout_id_is_recorded_once(mongo, fixed_clock, request, bulk):
+    if bulk:
+        request.getfixturevalue("client_bulk_write")
+    workout = WORKOUTS[0]
+
+    assert user_data.record_workout(**workout, workout_id="job-1:squat") is True
+    once = _snapshot(mongo)
+    assert user_data.record_workout(**workout, workout_id="job-1:squat") is False
+
+    assert _snapshot(mongo) == once
+    assert mongo["exercise_results"].find_one()["attempts"] == 1
@@ -0,0 +1,235 @@
+import atexit
+import importlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from utils import metrics
+from utils.upload_stream import read_marker
+
+# Exercise type -> (module, class). Imported lazily inside the worker processes
+# so the web process never has to load cv2 / mediapipe itself.
+DETECTOR_CLASSES = {
+    "pushup": ("detectors.pushup_detector", "PushUpDetector"),
+    "squat": ("detectors.squat_detector", "SquatDetector"),
+    "jump": ("detectors.jump_detector", "JumpDetector"),
+    "plank": ("detectors.plank_detector", "PlankDetector"),
+}
+
+POOL_SIZE = int(os.getenv("DETECTOR_POOL_SIZE", "2"))
+MAX_JOBS_PER_WORKER = int(os.getenv("DETECTOR_MAX_JOBS", "50"))  # 0 = never recycle
+JOB_TIMEOUT_SEC = float(os.getenv("DETECTOR_JOB_TIMEOUT", "120"))
+STARTUP_TIMEOUT_SEC = float(os.getenv("DETECTOR_STARTUP_TIMEOUT", "60"))
+# How often a job on a streamed upload checks whether the upload has finished
+UPLOAD_POLL_SEC = 1.0
+
+
+def is_supported(ex_type):
+    return ex_type in DETECTOR_CLASSES
+
+
+def parse_exercises(value):
+    # "pushup,squat" -> ["pushup", "squat"], in order, without duplicates
+    return list(dict.fromkeys(ex.strip() for ex in (value or "").split(",") if ex.strip()))
+
+
+def detector_class(ex_type):
+    module_name, class_name = DETECTOR_CLASSES[ex_type]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def new_detector(ex_type):
+    return detector_class(ex_type)()
+
+
+def _load_detectors():
+    detectors = {}
+    for ex_type in DETECTOR_CLASSES:
+        detectors[ex_type] = new_detector(ex_type)
+        # Pose graphs are built lazily; build them now, not on the first job
+        detectors[ex_type].pose
+    return detectors
+
+
+def _worker_main(conn, max_jobs):
+    # Runs inside the child process: build every Pose graph once, then serve jobs
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    detectors = _load_detectors()
+    # Wall clock, so the parent can time spawn + model load however late it reads this
+    conn.send(("ready", time.time()))
+
+    jobs_done = 0
+    while max_jobs == 0 or jobs_done < max_jobs:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        ex_type, video_path, options = job
+        try:
+            if isinstance(ex_type, list):
+                # Circuit: one pose pass shared by every listed exercise
+                from detectors.base import process_video_multi
+                result = process_video_multi({ex: detectors[ex] for ex in ex_type}, video_path, **options)
+            else:
+                result = detectors[ex_type].process_video(video_path, **options)
+        except Exception as e:
+            result = {"error": str(e)}
+
+        conn.send(result)
+        jobs_done += 1
+
+    for detector in detectors.values():
+        detector.close()
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, ctx, max_jobs):
+        self.conn, child_conn = ctx.Pipe()
+        # Not a daemon: chunked analysis starts its own segment processes,
+        # which daemonic processes may not do. DetectorPool.close() stops it.
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, max_jobs))
+        self.spawned_at = time.time()
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.jobs_done = 0
+
+    def wait_ready(self, timeout):
+        if self.ready:
+            return
+        if not self.conn.poll(timeout):
+            raise TimeoutError("Detector worker did not start in time")
+        _, ready_at = self.conn.recv()
+        self.ready = True
+        metrics.observe(metrics.DETECTOR_WORKER_START_SECONDS, ready_at - self.spawned_at, span="worker_start")
+
+    def stop(self, force=False):
+        if force:
+            self.process.terminate()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class DetectorPool:
+    """Long-lived worker processes that each keep all detectors preloaded.
+
+    Jobs are handed to an idle worker over a pipe. A worker is replaced when
+    it has served ``max_jobs`` jobs, crashes, or exceeds the per-job timeout.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_jobs=MAX_JOBS_PER_WORKER, timeout=JOB_TIMEOUT_SEC):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        # spawn, not fork: the parent holds a MongoClient and Flask threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(_Worker(self._ctx, max_jobs))
+
+    def run(self, ex_type, video_path, options=None, timeout=None):
+        # options are passed to process_video (target_fps, max_side, roi). A
+        # list of exercise types scores all of them from one pose pass; the
+        # result then holds one detector output per type under "exercises".
+        for ex in (ex_type if isinstance(ex_type, list) else [ex_type]):
+            if not is_supported(ex):
+                raise ValueError(f"Unsupported exercise type: {ex}")
+        if self._closed:
+            raise RuntimeError("Detector pool is closed")
+
+        timeout = timeout or self.timeout
+        exercise = ",".join(ex_type) if isinstance(ex_type, list) else ex_type
+        start = time.perf_counter()
+        worker = self._idle.get()
+        metrics.observe(metrics.DETECTOR_POOL_WAIT_SECONDS, time.perf_counter() - start, span="pool_wait")
+        broken = False
+        outcome = "error"
+        try:
+            worker.wait_ready(STARTUP_TIMEOUT_SEC)
+            start = time.perf_counter()
+            worker.conn.send((ex_type, video_path, options or {}))
+            if not self._wait_result(worker, timeout, video_path if (options or {}).get("streaming") else None):
+                broken = True
+                outcome = "timeout"
+                raise TimeoutError(f"Detector job exceeded {timeout}s")
+            result = worker.conn.recv()
+            worker.jobs_done += 1
+            outcome = "error" if "error" in result else "ok"
+            for stage, seconds in result.pop("stage_seconds", {}).items():
+                metrics.observe(metrics.DETECTOR_STAGE_SECONDS, seconds, span=stage, exercise=exercise, stage=stage)
+            return result
+        except TimeoutError:
+            broken = True
+            raise
+        except (EOFError, OSError):
+            broken = True
+            outcome = "crash"
+            raise RuntimeError("Detector worker exited unexpectedly")
+        finally:
+            metrics.observe(metrics.DETECTOR_JOB_SECONDS, time.perf_counter() - start, exercise=exercise, outcome=outcome)
+            recycle = self.max_jobs and worker.jobs_done >= self.max_jobs
+            if broken or recycle:
+                metrics.DETECTOR_WORKER_RESTARTS.inc(reason=outcome if broken else "recycle")
+                # A stuck or dead worker is killed; a recycled one exits on its own
+                worker.stop(force=broken)
+                worker = _Worker(self._ctx, self.max_jobs)
+            self._idle.put(worker)
+
+    def _wait_result(self, worker, timeout, upload_path=None):
+        # True once the worker has replied within timeout. For a streamed
+        # upload the worker waits on the uploader too, so the timeout only
+        # counts from when the upload last grew, and then from when it finished.
+        deadline = time.time() + timeout
+        if upload_path is not None:
+            size = None
+            while read_marker(upload_path) is None:
+                if worker.conn.poll(UPLOAD_POLL_SEC):
+                    return True
+                try:
+                    current = os.path.getsize(upload_path)
+                except OSError:
+                    current = size
+                if current != size:
+                    deadline, size = time.time() + timeout, current
+                elif time.time() > deadline:
+                    return False
+            deadline = time.time() + timeout
+        return worker.conn.poll(max(0.0, deadline - time.time()))
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # One pool per web worker process, created on first use
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DetectorPool()
+            atexit.register(_pool.close)
+        return _pool
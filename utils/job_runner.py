@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+
+from models.jobs import claim_next_job, finish_job, fail_job, requeue_stale_jobs, touch_job
+from utils.detector_pool import POOL_SIZE, JOB_TIMEOUT_SEC
+from utils.log import get_logger
+
+RUNNER_THREADS = int(os.getenv("JOB_RUNNER_THREADS", str(POOL_SIZE)))
+POLL_INTERVAL_SEC = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+# A job whose heartbeat is older than this belongs to a dead process
+STALE_AFTER_SEC = float(os.getenv("JOB_STALE_AFTER", str(JOB_TIMEOUT_SEC * 2)))
+HEARTBEAT_SEC = STALE_AFTER_SEC / 4
+
+log = get_logger("jobs")
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def _run_loop(handler):
+    last_sweep = 0
+    while True:
+        if time.time() - last_sweep > STALE_AFTER_SEC / 2:
+            last_sweep = time.time()
+            try:
+                requeue_stale_jobs(STALE_AFTER_SEC)
+            except Exception:
+                log.exception("Stale job sweep failed")
+
+        try:
+            job = claim_next_job()
+        except Exception:
+            log.exception("Claiming a job failed")
+            time.sleep(POLL_INTERVAL_SEC)
+            continue
+
+        if job is None:
+            time.sleep(POLL_INTERVAL_SEC)
+            continue
+
+        done = threading.Event()
+        threading.Thread(target=_heartbeat, args=(job["id"], done), name=f"job-heartbeat-{job['id']}",
+                         daemon=True).start()
+        try:
+            finish_job(job["id"], handler(job))
+        except Exception as e:
+            log.exception("Job %s failed", job["id"])
+            fail_job(job["id"], e)
+        finally:
+            done.set()
+
+
+def _heartbeat(job_id, done):
+    # A job can run past STALE_AFTER_SEC (a slow streamed upload, then the
+    # analysis timeout), so it is kept fresh for as long as its handler runs
+    while not done.wait(HEARTBEAT_SEC):
+        try:
+            touch_job(job_id)
+        except Exception:
+            log.exception("Heartbeat for job %s failed", job_id)
+
+
+def start_job_runner(handler, threads=RUNNER_THREADS):
+    """Start background threads that pull queued jobs and pass them to ``handler``.
+
+    ``handler(job)`` returns the JSON-serializable result or raises. Safe to
+    call more than once; only the first call starts threads.
+    """
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+        for i in range(threads):
+            threading.Thread(target=_run_loop, args=(handler,), name=f"job-runner-{i}", daemon=True).start()
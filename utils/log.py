@@ -0,0 +1,70 @@
+import logging
+import os
+import threading
+import time
+
+# Leveled logging for the app, the job runner and the detector workers.
+# Repeats of one message template are rate limited per logger, so a message
+# logged on every frame or every failed poll costs a bounded amount of I/O.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# At most LOG_RATE_BURST records per template every LOG_RATE_WINDOW seconds
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", "10"))
+LOG_RATE_WINDOW_SEC = float(os.getenv("LOG_RATE_WINDOW", "10"))
+
+ROOT = "fitness"
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=LOG_RATE_BURST, window_sec=LOG_RATE_WINDOW_SEC):
+        super().__init__()
+        self.burst = burst
+        self.window_sec = window_sec
+        self._lock = threading.Lock()
+        # (logger, template) -> [window start, records in window, suppressed]
+        self._windows = {}
+
+    def filter(self, record):
+        # extra={"rate_limit": False} for output that is bounded some other way
+        if not getattr(record, "rate_limit", True):
+            return True
+        # Keyed on the unformatted template, so "frame %d" is one message
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window_sec:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (and {suppressed} more like it in the last {self.window_sec:g}s)"
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def _configure():
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+        handler.addFilter(RateLimitFilter())
+        root = logging.getLogger(ROOT)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    """Logger under the app's root, e.g. get_logger("jobs") -> "fitness.jobs"."""
+    _configure()
+    return logging.getLogger(f"{ROOT}.{name}")
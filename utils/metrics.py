@@ -0,0 +1,212 @@
+import functools
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from utils.log import get_logger
+
+# Counters and latency histograms for the hot paths, rendered in the
+# Prometheus text format at /metrics. Per process: with several web workers,
+# scrape each one. With METRICS_ENABLED=0, timed() returns functions
+# unwrapped and the Flask hooks aren't installed, so there is nothing to pay.
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Fraction of requests whose spans are printed as one trace line (0 = off)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry = []
+
+log = get_logger("trace")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _family(self):
+        # The name HELP and TYPE describe, which must match the samples'
+        return self.name
+
+    def render(self):
+        family = self._family()
+        lines = [f"# HELP {family} {self.documentation}", f"# TYPE {family} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += [line for key, value in items for line in self._render(key, value)]
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _family(self):
+        # The text format has no suffix handling: a counter sampled as
+        # <name>_total is described as <name>_total too
+        return f"{self.name}_total"
+
+    def _render(self, key, value):
+        yield f"{self.name}_total{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts plus the +Inf bucket, then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def _render(self, key, state):
+        counts, total = state
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}"
+        yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+        yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+def render():
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# Request traces: spans recorded on the request's thread while it is sampled
+
+_trace = threading.local()
+
+
+def start_trace(name):
+    if TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE:
+        _trace.current = {"name": name, "start": time.perf_counter(), "spans": []}
+    else:
+        _trace.current = None
+
+
+def add_span(name, seconds):
+    current = getattr(_trace, "current", None)
+    if current is not None:
+        current["spans"].append((name, seconds))
+
+
+def end_trace(**fields):
+    current = getattr(_trace, "current", None)
+    if current is None:
+        return
+    _trace.current = None
+    total_ms = (time.perf_counter() - current["start"]) * 1000
+    spans = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in current["spans"])
+    details = " ".join(f"{key}={value}" for key, value in fields.items())
+    # Already sampled, so not rate limited
+    log.info("%s", f"{current['name']} {details} total={total_ms:.1f}ms {spans}".rstrip(), extra={"rate_limit": False})
+
+
+def timed(histogram, **labels):
+    """Decorator: observe the call's duration in histogram (and the current trace)."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        span = labels.get("call") or labels.get("stage") or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                histogram.observe(elapsed, **labels)
+                add_span(span, elapsed)
+        return wrapper
+    return decorate
+
+
+def observe(histogram, seconds, span=None, **labels):
+    # For durations measured elsewhere (e.g. reported back by a detector worker)
+    if ENABLED:
+        histogram.observe(seconds, **labels)
+        if span:
+            add_span(span, seconds)
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Flask request latency", ("method", "endpoint", "status"))
+REPOSITORY_SECONDS = Histogram("repository_call_duration_seconds", "models.user_data call latency", ("call",))
+DETECTOR_STAGE_SECONDS = Histogram(
+    "detector_stage_duration_seconds", "Video analysis time per stage", ("exercise", "stage"),
+)
+DETECTOR_JOB_SECONDS = Histogram(
+    "detector_job_duration_seconds", "Detector worker round trip per video", ("exercise", "outcome"),
+)
+DETECTOR_WORKER_START_SECONDS = Histogram(
+    "detector_worker_start_seconds", "Detector worker spawn until its Pose graphs are loaded",
+)
+DETECTOR_POOL_WAIT_SECONDS = Histogram("detector_pool_wait_seconds", "Time a job waited for an idle detector worker")
+JOB_QUEUE_WAIT_SECONDS = Histogram("upload_job_queue_wait_seconds", "Upload job time spent queued before it ran")
+JOB_SECONDS = Histogram("upload_job_duration_seconds", "Upload job processing time", ("outcome",))
+DETECTOR_WORKER_RESTARTS = Counter("detector_worker_restarts", "Detector workers replaced", ("reason",))
+
+
+def install(app):
+    """Time every Flask route and serve /metrics."""
+    if not ENABLED:
+        return
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        start_trace(f"{request.method} {request.path}")
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                    endpoint=request.endpoint or "unmatched", status=response.status_code)
+            end_trace(status=response.status_code)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -1,13 +1,18 @@
-
 import numpy as np
 
+
+def joint_angles(a, b, c):
+    # Angle at b in degrees for every row of three (n, 2) point arrays.
+    # atan2(|cross|, dot) is exact near 0/180 and yields 0 for degenerate
+    # (zero-length) limbs instead of raising like acos would.
+    ba_x = a[..., 0] - b[..., 0]
+    ba_y = a[..., 1] - b[..., 1]
+    bc_x = c[..., 0] - b[..., 0]
+    bc_y = c[..., 1] - b[..., 1]
+    cross = ba_x * bc_y - ba_y * bc_x
+    dot = ba_x * bc_x + ba_y * bc_y
+    return np.degrees(np.arctan2(np.abs(cross), dot))
+
+
 def calculate_angle(a, b, c):
-    a = np.array(a)
-    b = np.array(b)
-    c = np.array(c)
-
-    radians = np.arctan2(c[1]-b[1], c[0]-b[0]) - np.arctan2(a[1]-b[1], a[0]-b[0])
-    angle = np.abs(radians*180.0/np.pi)
-    if angle > 180.0:
-        angle = 360 - angle
-    return angle
+    return float(joint_angles(np.asarray(a, dtype=float), np.asarray(b, dtype=float), np.asarray(c, dtype=float)))
@@ -0,0 +1,93 @@
+import hashlib
+import io
+import json
+import os
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+CHUNK_SIZE = 1024 * 1024
+# Written next to a streamed video once the last byte is on disk (or the
+# upload broke off), so a detector reading it while it grows knows where EOF is
+COMPLETE_SUFFIX = ".complete"
+# Written by the job once it is done with the video. Whichever of the job and
+# the uploader finishes second removes the files, so a job that ends (or times
+# out) while the upload is still arriving never pulls the file out from under
+# the uploader, and the uploader's marker isn't left behind on its own.
+RELEASED_SUFFIX = ".released"
+
+
+class HashingFile(io.FileIO):
+    """Write-through file that hashes and size-checks every chunk on the way to disk.
+
+    Used both for raw streamed bodies and as Werkzeug's file stream for
+    multipart uploads, so the video is written once, straight to the uploads
+    directory, instead of being spooled to a temp file and copied.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        super().__init__(path, "w+b")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.moved = False
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        self._digest.update(data)
+        return super().write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def move_to(self, path):
+        # Claim the finished upload under its final name; a rename, not a copy
+        self.close()
+        os.replace(self.name, path)
+        self.moved = True
+
+
+def receive_stream(stream, path, max_bytes=None, chunk_size=CHUNK_SIZE, on_chunk=None):
+    # Copy a request body to path in fixed-size chunks; returns (sha256, size)
+    with HashingFile(path, max_bytes) as f:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            f.write(chunk)
+            f.flush()
+            if on_chunk:
+                on_chunk(f.size)
+        return f.hexdigest(), f.size
+
+
+def mark_complete(path, ok=True, sha256=None, size=None):
+    marker = path + COMPLETE_SUFFIX
+    tmp = marker + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"ok": ok, "sha256": sha256, "size": size}, f)
+    os.replace(tmp, marker)
+    if os.path.exists(path + RELEASED_SUFFIX):
+        remove_upload(path)
+
+
+def read_marker(path):
+    try:
+        with open(path + COMPLETE_SUFFIX) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def release_upload(path):
+    # Each side writes its file before checking for the other's, so at least
+    # one of them sees both; removing twice is harmless
+    open(path + RELEASED_SUFFIX, "w").close()
+    if read_marker(path) is not None:
+        remove_upload(path)
+
+
+def remove_upload(path):
+    for p in (path, path + COMPLETE_SUFFIX, path + RELEASED_SUFFIX):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
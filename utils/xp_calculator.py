@@ -20,9 +20,14 @@ def calculate_xp_and_score(reps, user_weight_kg, exercise_duration_sec, exercise
     calories = met * user_weight_kg * duration_hr
 
     # Basic scoring and XP calculations (you can adjust as needed)
-    
-    xp = reps * 10
-    score = reps * 5
+    # Plank "reps" are seconds held; a second of hold scores like 5 reps
+    REP_EQUIVALENTS = {
+        'plank': 5,
+    }
+    rep_equivalent = REP_EQUIVALENTS.get(exercise_type, 1)
+
+    xp = int(round(reps * rep_equivalent * 10))
+    score = int(round(reps * rep_equivalent * 5))
     completed = reps > 0  # You can define your own completion logic
 
     return {